@@ -1,12 +1,26 @@
+import concurrent.futures
+import contextlib
+import functools
 import http.client
+import io
+import mmap
 import threading
 import tempfile
 import zipfile
 
 import swordfish_launcher.gui.progressbar
 from ..minefish import USER_AGENT
+from .pipeline import PipelinedConnection
+from .scheduler import JobScheduler
+from .ratelimit import LIMITER
+from .verify import Verifier, VerificationError, verify_file
+from .writer import BUFFERS, ChunkWriter
+from .streamzip import StreamingUnzipper, member_path
+from .blobstore import BLOB_STORE, link_or_copy
+from ..misc.fallocate import prealloc
 import queue
 import os
+import collections
 
 
 # NOTE: The original SwordfishPDS had a rather different thread system. Downloader objects were simply frontends to a
@@ -25,7 +39,7 @@ class DownloadJob:
 
     def __init__(self, outputdir, priority=0, progressbar: 'swordfish_launcher.gui.progressbar.ProgressFrame' = None,
                  download_progressbar: 'swordfish_launcher.gui.progressbar.ProgressFrame' = None,
-                 total_filesize: int = None):
+                 total_filesize: int = None, bandwidth_weight=1.0, bandwidth_share=None):
         """
 
         :param outputdir:
@@ -37,18 +51,33 @@ class DownloadJob:
         specified, the progress bar will increase linearly with every byte downloaded up to a maximum of the specified
         value -- this allows the system to display an accurate ETA.  If set to None, or left unspecified, the overall
         progress will increase by the same amount for each file downloaded.
+        :param bandwidth_weight: If a bandwidth cap is set (see ratelimit.LIMITER), this job's share of it relative to
+        the other jobs downloading at the same time.  Give interactive stuff a bigger number than background stuff.
+        :param bandwidth_share: If not None, a hard ceiling on this job's download rate as a fraction of the cap, which
+        applies even if nothing else is downloading.
         """
         self.failures = {}
         self.queue = queue.Queue()
+        # Set by downloaders that can't afford to block on self.queue (i.e. the asyncio engine) to a function that
+        # wakes them up when something is added.  Called from whichever thread calls add() or finalize().
+        self._on_add = None
+        # Items a Downloader took off the queue but had to put down again because a higher priority job came along.
+        # They go to the front of the line when this job gets its turn again.
+        self._parked = collections.deque()
         self.outputdir = outputdir
+        self.digests = {}  # maps output paths to the digests passed to add()
         self.priority = priority
+        self.bandwidth_weight = bandwidth_weight
+        self.bandwidth_share = bandwidth_share
         self._total = 0
         self._cut_off = False
         self.cancelled = False
         self.progressbar_overall = progressbar
         self.progressbar_download = download_progressbar
         self.done = threading.Event()
-        self.failed_downloads = {}
+        # join() returns self.failures but the downloaders have always written to self.failed_downloads.  Make them
+        # the same dict so that the caller actually gets to hear about it when something breaks.
+        self.failed_downloads = self.failures
         self.determinate = total_filesize is not None
         if progressbar:
             progressbar.reset()
@@ -64,13 +93,40 @@ class DownloadJob:
             else:
                 progressbar.configure(False, 25)
 
-    def add(self, outputpath, url_args):
+    def add(self, outputpath, url_args, **digests):
+        """
+        :param outputpath: Path relative to the job's output directory, a callable (see Downloader), or a
+        streamzip.StreamingUnzipper to extract the file into as it downloads.
+        :param url_args: Tuple of arguments that tell the downloader where to get the file from.
+        :param digests: Whatever we know about what the file should look like: sha1, md5, length, fingerprint.  See
+        verify.Verifier.  They're checked as the file streams in, and if they don't match, the file is thrown away
+        rather than renamed into place.  If BLOB_STORE has a file with the same sha1 or md5 (or from the same URL, if
+        url_args is just a URL or a list of mirrors), it's put in place right away and never goes near a downloader.
+        """
         assert not self._cut_off, "attempt to add an item to the queue after join"
         if self.cancelled:
             # XXX should this just be a no-op?
             raise RuntimeError('Attempt to add item to queue after operation cancelled')
-        self.queue.put((os.path.join(self.outputdir, outputpath), *url_args))
+        if isinstance(outputpath, str):
+            outputpath = os.path.join(self.outputdir, outputpath)
+            # a list of mirrors gets stored under whichever one it came from, so try them all.
+            urls = url_args[0] if len(url_args) == 1 else ()
+            if isinstance(urls, str):
+                urls = [urls]
+            urls = [url for url in urls if isinstance(url, str) and '://' in url] or [None]
+            if any(BLOB_STORE.materialize(outputpath, url=url, **digests) for url in urls):
+                self._total += 1
+                if self.determinate:
+                    self._progress(os.path.getsize(outputpath))
+                elif self.progressbar_overall:
+                    self.progressbar_overall.progress(1)
+                return
+        if digests:
+            self.digests[outputpath] = digests
+        self.queue.put((outputpath, *url_args))
         self._total += 1  # TODO incrementing integers is not thread safe.
+        if self._on_add:
+            self._on_add()
 
     def join(self):
         self.finalize()
@@ -88,17 +144,20 @@ class DownloadJob:
             return
         self._cut_off = True
         self.queue.put((None,))
+        if self._on_add:
+            self._on_add()
         if self.progressbar_overall and not self.determinate:
             self.progressbar_overall.set_max(True, self._total)
 
     def _progress(self, progress):
-        self.progressbar_download.progress(progress)
-        if self.determinate:
+        if self.progressbar_download:
+            self.progressbar_download.progress(progress)
+        if self.determinate and self.progressbar_overall:
             self.progressbar_overall.progress(progress)
 
     def _task_done(self):
         self.queue.task_done()
-        if not self.determinate:
+        if not self.determinate and self.progressbar_overall:
             self.progressbar_overall.progress(1)
 
     def cancel(self):
@@ -119,42 +178,63 @@ class DownloadJob:
         return self.priority <= other.priority if isinstance(other, DownloadJob) else NotImplemented
 
 
-def download(resp: http.client.HTTPResponse, fout, job: DownloadJob, stop=lambda: False, blocksize=1024 * 1024):
+def download(resp: http.client.HTTPResponse, fout, job: DownloadJob, stop=lambda: False, blocksize=1024 * 1024,
+             verifier: Verifier = None, checkpoint=None):
+    """Copy the body of resp to fout, a chunk at a time, until it runs out or stop() returns True.  If a verifier is
+    given, every chunk is fed through it on its way to the disk; checking the result is up to the caller.  If
+    checkpoint is given, it's called with the length of the file after every chunk (see ResumeJournal.checkpoint).
+
+    :return: True if we got to the end of the body, False if stop() cut us off.
+    """
+    filesize = content_length(resp)
     if job.progressbar_download:
-        filesize = resp.getheader('Content-Length').strip()
-        if filesize:
-            try:
-                filesize = int(filesize)
-            except ValueError:
-                filesize = None
         if filesize:
             job.progressbar_download.configure(value=0, mode='determinate', max=filesize)
         else:
             job.progressbar_download.configure(value=0, mode='indeterminate', max=blocksize)
+    writer = ChunkWriter(fout)
+    if filesize and writer.fd is not None:
+        # Reserve the space up front, so the file ends up in one piece on disk instead of in however many pieces the
+        # filesystem happens to find for it as it grows.
+        prealloc(fout, writer.offset + filesize)
     # I don't know why, but writing to a memoryview of a bytearray is almost 50x faster than writing directly to the
     # bytearray.  On my mahchine, overwriting an entire 1MB bytearray takes an entire millisecond.  Overwriting a
     # memoryview of the same bytearray takes 43 microseconds.  Which is still pathetic, considering today's memory
-    # speeds, but it's not half bad for Python.
-    with memoryview(bytearray(blocksize)) as buffer:
+    # speeds, but it's not half bad for Python.  Allocating a fresh one for every file is worse still, hence BUFFERS.
+    # (the finally is so that fout.tell() tells the truth afterwards even if the connection drops.)
+    with BUFFERS.get(blocksize) as buffer, contextlib.closing(writer):
         while not stop():
             count = resp.readinto1(buffer)
             if not count:
                 return True
-            if count == blocksize:
-                fout.write(buffer)
-            else:
-                fout.write(buffer[:count])
+            chunk = buffer if count == blocksize else buffer[:count]
+            writer.write(chunk)
+            if verifier is not None:
+                verifier.update(chunk)
+            if checkpoint is not None:
+                checkpoint(writer.offset)
             # Subtle: advance the progressbar after writing to the output file.  This does a fair amount to alleviate
             # the age-old problem of the progress bar getting stuck at 100%.
             # I'm using the underscore in the name here to signify that this should be the only place that _progress()
             # is called from.  However, Python doesn't really have a way to denote package visibility, so Pycharm
             # will complain.
             job._progress(count)
+            LIMITER.throttle(count, job, job.bandwidth_weight, job.bandwidth_share)
         return False
 
 
+def content_length(resp):
+    """The Content-Length of resp as an int, or None if it didn't send one (or sent gibberish)."""
+    length = resp.getheader('Content-Length')
+    try:
+        return int(length)
+    except (TypeError, ValueError):
+        return None
+
+
 class Downloader(threading.Thread):
-    def __init__(self, server, urlformat, server_supports_range=True, server_supports_request_pipelining=True):
+    def __init__(self, server, urlformat, server_supports_range=True, server_supports_request_pipelining=True,
+                 pipeline_depth=8, aging_rate=1 / 60, journal=None):
         """
 
         :param server: Hostname of the server, e.g. 'forgesvc.net'
@@ -165,11 +245,29 @@ class Downloader(threading.Thread):
         when you try, and do dumb things like aborting the connection or dispensing random binary data in lieu of
         headers (I have observed both of these).  Set this to False if :param server: is such a server, to disable
         request pipelining.
+        :param pipeline_depth: How many requests we're allowed to have waiting for a response at once.  Asset installs
+        are thousands of tiny files, so this is what actually determines how fast they go.  8 or 16 is about right;
+        ignored if server_supports_request_pipelining is False.
+        :param aging_rate: Priority points a job gains per second spent waiting for its turn.  See JobScheduler.
+        :param journal: A ResumeJournal.  With one, .part files are only resumed as far as the journal says they were
+        safely written, and only if the file on the server hasn't changed since (If-Range).  Without one, they're
+        resumed from wherever they happen to end, and you'd better hope for the best.
         """
-        self.client = http.client.HTTPSConnection(server)
-        self.queue = {}  # dict mapping integer priorities to actionable DownloadJobs.
+        super().__init__(name='Downloader-' + server, daemon=True)
+        self.server = server
+        self.journal = journal
+        self.client = PipelinedConnection(server, depth=pipeline_depth if server_supports_request_pipelining else 1)
+        self.scheduler = JobScheduler(aging_rate)
         self.active_job: DownloadJob = None
-        self.queue_lock = threading.Lock()
+        self._reading_job: DownloadJob = None  # the job the response we're currently reading belongs to.
+        # Jobs whose queue we've reached the end of, but which may still have requests in the pipeline.
+        self._exhausted = set()
+        self._in_flight = collections.Counter()
+        # URL path -> (outpath, job, item) for every file that's waiting on a request already in flight for the same
+        # URL, e.g. because two instances are being installed and both want the same library.  Rather than download it
+        # twice, they get a copy of whatever the first one gets.  Every request for a file we send has an entry here,
+        # even if nobody's waiting on it.
+        self._followers = {}
         self._shutting_down = False
         self.interrupting = False
         self.urlformat = urlformat
@@ -178,68 +276,101 @@ class Downloader(threading.Thread):
 
     def interrupt(self):
         """Abort the current download, if one is in progress, and recheck the queue for a new highest priority.
-        Use when you absolutely cannot afford to wait for the previous job to finish.
+        Use when you absolutely cannot afford to wait for the previous job to finish.  enqueue_job() does this for you
+        when the job it's given outranks the one we're working on.
+
+        The file being downloaded is parked, .part file and all, and picks up where it left off once its job gets its
+        turn again.  Since download() checks between chunks, the new job starts within one chunk of this being called.
         """
         self.interrupting = True
 
-    # I'm considering habving the download queue be a dict mapping priority numbers to lists of jobs, and I'm not
-    # sure whether that would give better or worse performance than just putting all the jobs in a PriorityQueue
-    # and letting heapq do its thing.
-
-    # I don't suppose it matters much.  But I know which one will be easier to debug.
-
-    def _get_job(self) -> DownloadJob:
-        with self.queue_lock:
-            if not self.queue: return None
-            highest_priority = max(self.queue)
-            jobs = self.queue[highest_priority]
-            while not jobs and self.queue:
-                del self.queue[highest_priority]
-                highest_priority = max(self.queue)
-                jobs = self.queue[highest_priority]
-            if not self.queue: return None
-            return jobs.pop()
-
-    def _send_download_request(self):
+    def shutdown(self):
+        """Stop the downloader thread once it has finished whatever it's in the middle of.  Jobs still queued stay
+        queued."""
+        self._shutting_down = True
+        self.scheduler.close()
+
+    def _get_job(self, block=True) -> DownloadJob:
+        if self._shutting_down:
+            return None
+        return self.scheduler.pop(block)
+
+    def _next_item(self, job, block):
+        """Next (outfile, *fmt) tuple from a job: parked items first, then its queue.  (None,) means there's nothing
+        more to come from this job."""
+        if job._parked:
+            return job._parked.popleft()
+        if job in self._exhausted:
+            return (None,)
+        return job.queue.get(block)
+
+    def _finish_job_if_done(self, job):
+        if job in self._exhausted and not self._in_flight[job] and not job._parked:
+            self._exhausted.discard(job)
+            del self._in_flight[job]
+            self.scheduler.forget(job)
+            job.done.set()
+
+    def _send_download_request(self, block=True):
         """
-
-        :return: 5-tuple ultimate destination path, output file object, expected HTTP response code (either 200 or 206),
-        URL path we sent to the server, and an optional callback to invoke with the
+        Take the next file from the active job (switching jobs if need be) and send the request for it down the
+        pipeline.
+
+        :param block: If False, return None rather than waiting for the active job to have something in its queue.
+        We mustn't sit on the job queue while there are responses waiting to be read.
+        :return: None if there's nothing to send, else the 7-tuple that get_response() will hand back to run()
+        alongside the response: ultimate destination path, output file object, expected HTTP response code (either 200
+        or 206), URL path we sent to the server, an optional callback to invoke with the output file object once it's
+        downloaded, the DownloadJob it came from, and the item we took off its queue (in case we need to park it).
+        Or True, if the file was already on its way for someone else and this one will just get a copy.
         """
         if self.interrupting:
-            # Put the current job back in the queue, because one with a higher priority has just been added.
-
-            # I'm not sure I absolutely *need* to do this, given that it's only being called from one thread,
-            # or even if it would help anything if I weren't, but I'd rather just be safe.
-            active_job = self.active_job
-            self.active_job = None
-            self.enqueue_job(active_job)
-            self.interrupting = False
+            # A job with a higher priority has just been added.  Park everything we've got going.
+            self._preempt()
 
         if self.active_job is None:
-            self.active_job = self._get_job()
+            self.active_job = self._get_job(block)
 
         # we still don't have a job, we're done.
         if self.active_job is None:
-            return None, None, None, None, None
-
-        outfile, *fmt = self.active_job.queue.get()
-        while outfile is None:
-            self.active_job.done.set()
-            self.active_job = self._get_job()
-            if self.active_job is None:
-                # cave johnson, we're done here
-                return None, None, None, None, None
-            outfile, *fmt = self.active_job.queue.get()
+            return None
+
+        try:
+            item = self._next_item(self.active_job, block)
+            while item[0] is None:
+                self._exhausted.add(self.active_job)
+                self._finish_job_if_done(self.active_job)
+                self.active_job = self._get_job(block)
+                if self.active_job is None:
+                    # cave johnson, we're done here
+                    return None
+                item = self._next_item(self.active_job, block)
+        except queue.Empty:
+            return None
+        outfile, *fmt = item
+        urlpath = self.urlformat.format(*fmt, filename=outfile)
+        if isinstance(outfile, str) and urlpath in self._followers:
+            self._followers[urlpath].append((outfile.replace('/', os.path.sep), self.active_job, item))
+            self._in_flight[self.active_job] += 1
+            return True
 
         # outfile may be a callable, in which case the file will be downloaded to a temporary file, or to cache,
         # after which the callable will be invoked from the downloader thread with the resulting file object as an
         # argument.  This is used for zip file downloads, in which case the callable will put the file object into the
-        # zip extractor's queue.
+        # zip extractor's queue.  Or it may be a StreamingUnzipper, which saves it the trouble, since that extracts the
+        # zip file as it arrives and there's no temporary file at all.
         if isinstance(outfile, str):
-            outpath = os.path.join(self.outputdir, outfile.replace('/', os.path.sep))
+            # DownloadJob.add() has already joined this onto the job's output directory.
+            outpath = outfile.replace('/', os.path.sep)
+            os.makedirs(os.path.dirname(outpath) or '.', exist_ok=True)
             fout = open(outpath + '.part', 'ab')
             callback = None
+        elif isinstance(outfile, StreamingUnzipper):
+            # there's nothing on disk to resume from, so this always starts from the first byte.
+            outfile.reset()
+            fout = outfile
+            callback = None
+            outpath = None
         elif callable(outfile):
             # TODO implement a config option for caching.
             fout = tempfile.TemporaryFile()
@@ -248,51 +379,142 @@ class Downloader(threading.Thread):
         else:
             assert False, "outfile must either be a path or a callback"
         headers = {'User-Agent': USER_AGENT}
+        if self.journal is not None and outpath is not None and self.supports_resumption:
+            validator = self.journal.resume(outpath, self.server + urlpath, fout)
+            if validator:
+                headers['If-Range'] = validator
         if fout.tell() != 0 and self.supports_resumption:
             headers['Range'] = 'bytes=%d-' % fout.tell()
             expected_code = 206
         else:
-            fout.seek(0)
+            if fout.tell():
+                fout.seek(0)
+                fout.truncate()
             expected_code = 200
-        urlpath = self.urlformat.format(*fmt, filename=outfile)
-        self.client.request('GET', urlpath, headers=headers)
-        return outpath, fout, expected_code, urlpath, callback
+        entry = outpath, fout, expected_code, urlpath, callback, self.active_job, item
+        if outpath is not None:
+            self._followers[urlpath] = []
+        self.client.send_request('GET', urlpath, headers, token=entry)
+        self._in_flight[self.active_job] += 1
+        return entry
 
     def enqueue_job(self, job):
         assert isinstance(job, DownloadJob)
-        self.queue.put(job)
+        self.scheduler.push(job)
+        # The job whose file we're reading and the job we're filling the pipeline from aren't necessarily the same
+        # (if we've run off the end of one job's queue, active_job might even be None with its last files still in
+        # flight), and while we wait for the first response, we aren't reading anything at all.  So every job with a
+        # request in flight counts too.  If the new job outranks all of them, interrupt.
+        # (list() takes its copy of the Counter without letting the downloader thread in halfway through.)
+        busy = [other for other, count in list(self._in_flight.items()) if count > 0]
+        working = [self.scheduler.effective_priority(other) for other in busy + [self._reading_job, self.active_job]
+                   if other is not None]
+        if working and job.priority > max(working):
+            self.interrupt()
+
+    def _preempt(self, current_entry=None):
+        """Put everything we're working on -- the response being read, if any, and everything behind it in the
+        pipeline -- back where it came from, and the active job back in the scheduler.
+        """
+        entries = self.client.abort_all()
+        if current_entry is not None:
+            entries.insert(0, current_entry)
+        # reversed, since appendleft() reverses them again.
+        for outfile, fout, expected_code, urlpath, callback, job, item in reversed(entries):
+            # The .part file stays on disk, so when this comes back around, the Range header picks up where we
+            # stopped.  (Callbacks download to a temporary file, which doesn't survive this; those start over.)
+            if self.journal is not None and outfile is not None:
+                self.journal.checkpoint(outfile, fout, fout.tell(), force=True)
+            if outfile is not None:
+                self._release_followers(urlpath)
+            fout.close()
+            job._parked.appendleft(item)
+            self._in_flight[job] -= 1
+            self.scheduler.push(job)
+        if self.active_job is not None:
+            self.scheduler.push(self.active_job)
+            self.active_job = None
+        self._reading_job = None
+        self.interrupting = False
 
     def run(self):
-        outfile, fout, expected_code, urlpath, callback = self._send_download_request()
-
-        while fout is not None:
-            # send our next request (if any) to the server while we're working on the current one, to elimiate
-            # the lookup delay between request and response.  Pipelining is good.  Doesn't increase performance much
-            # when all you're making is GET requests, but there's no reason NOT to do it.
-            with self.client.getresponse() as resp:
-                # can't call putrequest() until we've gotten the last response, otherwise I'd put this outside the with
-                # cache active_job both for speed and because _pipeline_download() may change it.
-                active_job = self.active_job
-
-                # So HTTP request pipelining is really cool.  Look it up if you haven't already.  Basically it's
-                # when you send another request to the server on the same connection while you're still downloading the
-                # response from the last one.  It can at times be a huge speedup since you don't have to wait for the
-                # server to process your request and get a response ready (which usually takes about a second).  Thing
-                # is, not all servers support it, and sometimes do odd things like aborting the connection or dispensing
-                # apparently random binary data in lieu of headers.  So we have an option in the constructor to turn
-                # request pipelining off.
-                if self.supports_pipelining:
-                    next_entry = self._send_download_request()
-                if resp.code != expected_code:
+        # So HTTP request pipelining is really cool.  Look it up if you haven't already.  Basically it's when you send
+        # more requests to the server on the same connection while you're still downloading the response from the last
+        # one.  For thousands of tiny files (i.e. assets) it's a huge speedup, since we'd otherwise spend most of our
+        # time waiting a round trip for each file to start.  Thing is, not all servers support it, and sometimes do
+        # odd things like aborting the connection or dispensing apparently random binary data in lieu of headers.  So
+        # we have an option in the constructor to turn request pipelining off, which sets the depth to 1.
+        # PipelinedConnection deals with servers that close keep-alive connections partway through the pipeline.
+        while True:
+            # Fill the pipeline back up.  Only block waiting for more work if there's nothing in flight.
+            while self.client.can_send():
+                if self._send_download_request(block=not self.client.outstanding) is None:
+                    break
+            if not self.client.outstanding:
+                return
+
+            entry, resp = self.client.get_response()
+            outfile, fout, expected_code, urlpath, callback, active_job, item = entry
+            self._reading_job = active_job
+            with resp:
+                if resp.code == 200 and expected_code == 206:
+                    # the server ignored our Range header and is sending us the whole file.  start over.
+                    fout.seek(0)
+                    fout.truncate()
+                elif resp.code != expected_code:
                     active_job.failed_downloads[urlpath] = resp.code
-                    if resp.getheader('Connection', '').lower() == 'keep-alive':
-                        resp.read()
+                    if outfile:
+                        self._release_followers(urlpath, error=resp.code)
+                    fout.close()
+                    # read the body so the connection is positioned at the next response.
+                    resp.read()
+                    self._file_done(active_job)
                     continue
+                verifier = Verifier.from_digests(active_job.digests.get(item[0]))
+                journal = self.journal if outfile is not None else None
+                checkpoint = None
+                finished = False
                 try:
-                    download(resp, fout, active_job, lambda: self.interrupting or active_job.cancelled)
+                    if journal is not None:
+                        # for a 206, this also makes sure it's the rest of the file we've got the start of.
+                        journal.begin(outfile, self.server + urlpath, resp, fout.tell())
+                        checkpoint = functools.partial(journal.checkpoint, outfile, fout)
+                    if verifier is not None and resp.code == 206:
+                        # the start of the file came from an earlier attempt.  it needs hashing too.
+                        verifier.update_from_file(fout.name, fout.tell())
+                    finished = download(resp, fout, active_job, lambda: self.interrupting or active_job.cancelled,
+                                        verifier=verifier, checkpoint=checkpoint)
+                    if finished and verifier is not None:
+                        verifier.verify()
+                    if finished and isinstance(fout, StreamingUnzipper):
+                        # extracts whatever had to wait for the central directory, and complains if the archive
+                        # was bad.
+                        fout.finish()
+                except VerificationError as e:
+                    active_job.failed_downloads[urlpath] = e
+                    fout.close()
+                    if not finished:
+                        # journal.begin() turned the 206 down before we'd read any of it (or download() gave up
+                        # halfway), so the rest of it is still in the socket, ahead of the next response.
+                        self.client.abort_response()
+                    # The .part file isn't fine either; resuming it next time would just get us the same wrong file
+                    # again.
+                    if outfile:
+                        os.remove(fout.name)
+                    if journal is not None:
+                        journal.forget(outfile)
+                    if outfile:
+                        # they might be expecting a different file (different digests).  let them find out.
+                        self._release_followers(urlpath)
                 except Exception as e:
                     active_job.failed_downloads[urlpath] = e
+                    if checkpoint is not None:
+                        # keep what we did get, for next time.
+                        checkpoint(fout.tell(), force=True)
                     fout.close()
+                    self.client.abort_response()
+                    if outfile:
+                        self._release_followers(urlpath)
                     # XXX if the download failed due to an unexpected response code from the server, should the file
                     # XXX be deleted from disk?
                     # On the one hand, the obvious answer is yes.  On the other, the file may have simply moved,
@@ -302,10 +524,24 @@ class Downloader(threading.Thread):
                     # versions of mods vital for playing older packs, in which case a partial archive on the user's
                     # machine is at least better than nothing.
                 else:
-                    if callback:
+                    if not finished and self.interrupting:
+                        # Something more important came along.  The rest of this body is still in the socket ahead
+                        # of the next response, so this drops the connection too.
+                        self._preempt(entry)
+                        continue
+                    elif not finished:
+                        # the job was cancelled.  the .part file stays on disk in case it gets restarted.
+                        if checkpoint is not None:
+                            checkpoint(fout.tell(), force=True)
+                        fout.close()
+                        self.client.abort_response()
+                        if outfile:
+                            self._release_followers(urlpath)
+                    elif callback:
                         # it is up to the callback to close the output file once they are done with it.
                         # the callback usually simply puts the object passed to it into a queue to be processed
                         # by a different thread to avoid holding up the downloader thread with e.g. decompression.
+                        fout.seek(0)
                         callback(fout)
                     else:
                         fout.close()
@@ -313,59 +549,221 @@ class Downloader(threading.Thread):
                             # outfile is the expected output path, which we are expected to rename the file we produce
                             # to after it is downloaded successfully.  the above code passes us a file object named
                             # filename.ext.part along with the string filename.ext.
-                            os.rename(fout.name, outfile)
-            active_job._task_done()
-            outfile, fout, expected_code = next_entry if self.supports_pipelining else self._send_download_request()
+                            os.replace(fout.name, outfile)
+                            BLOB_STORE.add(outfile, **active_job.digests.get(outfile, {}))
+                            self._release_followers(urlpath, path=outfile, digests=active_job.digests.get(outfile))
+                        if journal is not None:
+                            journal.forget(outfile)
+            self._file_done(active_job)
+
+    def _release_followers(self, urlpath, path=None, error=None, digests=None):
+        """The request for urlpath is done with.  If it got the file, everyone waiting on it gets a copy of path; if the
+        server said no, they all get the same error; otherwise (cancelled, preempted, connection trouble) they go back
+        in line to try for themselves.
+
+        :param digests: What path has already been verified against.  Anyone expecting something else is checked.
+        """
+        for outpath, job, item in self._followers.pop(urlpath, ()):
+            self._in_flight[job] -= 1
+            if path is None and error is None:
+                job._parked.append(item)
+                if job is not self.active_job:
+                    self.scheduler.push(job)
+                continue
+            if path is not None:
+                try:
+                    link_or_copy(path, outpath)
+                    expected = job.digests.get(item[0])
+                    if expected and expected != digests:
+                        verify_file(outpath, expected)
+                except (OSError, VerificationError) as e:
+                    job.failed_downloads[urlpath] = e
+                    if isinstance(e, VerificationError):
+                        os.remove(outpath)
+            else:
+                job.failed_downloads[urlpath] = error
+            job._task_done()
+            self._finish_job_if_done(job)
+
+    def _file_done(self, job):
+        self._reading_job = None
+        self._in_flight[job] -= 1
+        job._task_done()
+        self._finish_job_if_done(job)
+
+
+class _MappedReader(io.RawIOBase):
+    """A seekable file object over a memoryview, with its own file position.  Lets any number of threads each have
+    their own ZipFile of the same mmap'd archive without copying it or fighting over a seek position."""
+
+    def __init__(self, view):
+        self._view = view
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, b):
+        count = max(0, min(len(b), len(self._view) - self._position))
+        b[:count] = self._view[self._position:self._position + count]
+        self._position += count
+        return count
 
 
 class ZipExtractor(threading.Thread):
-    def __init__(self, progressbar):
-        self.queue = threading.Queue()
+    """Extracts zip files handed to it, one archive at a time, spreading each archive's members across a pool of
+    worker threads.
+
+    zlib lets go of the GIL while it's decompressing, so this actually scales with cores, as long as no two workers
+    share a ZipFile (every ZipFile has a lock around its file object).  So every worker gets its own ZipFile of the
+    same mmap'd archive.
+    """
+
+    # Members are handed to the workers in batches of up to this many, or this many bytes, whichever comes first.
+    # Submitting 40,000 tiny files one at a time spends more time in the executor than in zlib.
+    BATCH_FILES = 64
+    BATCH_BYTES = 16 * 1024 * 1024
+
+    def __init__(self, progressbar=None, workers=None):
+        """
+        :param progressbar: Optional tkinter progress bar, stepped with the uncompressed bytes extracted.  It's only
+        ever touched from this thread, never the workers.
+        :param workers: Number of worker threads.  Defaults to the number of CPUs.
+        """
+        super().__init__(daemon=True)
+        self.queue = queue.Queue()
         self.progressbar = progressbar
+        self.workers = workers or os.cpu_count() or 1
+        #: member name -> exception, for every member that failed to extract.
+        self.failures = {}
+        self._progress_lock = threading.Lock()
+        self._extracted_bytes = 0
+
+    def enqueue(self, file, subdir, outputdir):
+        """Extract file (a path or a file object; file objects are closed once done) into outputdir on the extractor
+        thread.  If subdir is given, only what's under it is extracted, relative to it."""
+        self.queue.put((file, subdir, outputdir))
+
+    def shutdown(self):
+        self.queue.put((None, None, None))
+
     def run(self):
         while True:
             file, subdir, outputdir = self.queue.get()
-            if subdir and not subdir.endswith('/'):
-                subdir += '/'
             if not file:
                 break
-            with file, zipfile.ZipFile(file) as zf:
-                # I would just use zf.extractall() but I wanted the progress bar.
-                files = [zi for zi in zf.infolist() if zi.filename.startswith(subdir)] if subdir else zf.infolist()
-
+            try:
+                self.extract(file, subdir, outputdir)
+            except Exception as e:
+                self.failures[getattr(file, 'name', file)] = e
+
+    def extract(self, file, subdir, outputdir):
+        """Extract one archive, blocking until it's done."""
+        if subdir and not subdir.endswith('/'):
+            subdir += '/'
+        with contextlib.ExitStack() as stack:
+            if isinstance(file, str):
+                file = stack.enter_context(open(file, 'rb'))
+            else:
+                stack.callback(file.close)
+            try:
+                archive = stack.enter_context(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+            except (AttributeError, io.UnsupportedOperation, ValueError, OSError):
+                # not a real file (or an empty one, which mmap refuses).  read it into memory instead.
+                file.seek(0)
+                archive = file.read()
+            view = stack.enter_context(memoryview(archive))
+            # The ZipFiles are the first thing closed on the way out, since the memoryview can't be released while
+            # they're still looking at it.
+            handles = queue.SimpleQueue()
+            stack.callback(self._close_handles, handles)
+
+            zf = zipfile.ZipFile(_MappedReader(view))
+            handles.put(zf)
+            # I would just use zf.extractall() but I wanted the progress bar.
+            files = [zi for zi in zf.infolist() if zi.filename.startswith(subdir)] if subdir else zf.infolist()
+            if self.progressbar:
                 self.progressbar.config(mode='determinate', value=0, max=sum(zi.file_size for zi in files))
-                for member in files:
-
-                    ### THIS PORTION COPY PASTED FROM zipfile.py ###
-
-                    # build the destination pathname, replacing
-                    # forward slashes to platform specific separators.
-                    arcname = member.filename
-                    if subdir:
-                        assert arcname.startswith(subdir)
-                        arcname = arcname[len(subdir):]
-                    if os.path.sep != '/':
-                        arcname = arcname.replace('/', os.path.sep)
-
-                    if os.path.altsep:
-                        arcname = arcname.replace(os.path.altsep, os.path.sep)
-                    # interpret absolute pathname as relative, remove drive letter or
-                    # UNC path, redundant separators, "." and ".." components.
-                    arcname = os.path.splitdrive(arcname)[1]
-                    invalid_path_parts = ('', os.path.curdir, os.path.pardir)
-                    arcname = os.path.sep.join(x for x in arcname.split(os.path.sep)
-                                               if x not in invalid_path_parts)
-                    if os.path.sep == '\\':
-                        # filter illegal characters on Windows
-                        arcname = zf._sanitize_windows_name(arcname, os.path.sep)
-
-                    targetpath = os.path.join(outputdir, arcname)
-                    targetpath = os.path.normpath(targetpath)
-
-                    ### END COPY PASTE FROM zipfile.py ###
-
-                    os.makedirs(os.path.dirname(targetpath), exist_ok=True)
-                    with open(targetpath, 'wb') as fout, zf.open(member) as fin:
-                        data = fin.read(65536)
-                        fout.write(data)
-                        self.progressbar.step(len(data))
+            self._extracted_bytes = reported = 0
+
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+                pending = {pool.submit(self._extract_batch, view, handles, batch, subdir, outputdir)
+                           for batch in self._batches(files)}
+                while pending:
+                    _, pending = concurrent.futures.wait(pending, timeout=0.1)
+                    # one aggregated progress stream, from one thread.
+                    with self._progress_lock:
+                        extracted = self._extracted_bytes
+                    if self.progressbar and extracted != reported:
+                        self.progressbar.step(extracted - reported)
+                    reported = extracted
+
+    def _batches(self, files):
+        batch, size = [], 0
+        for member in files:
+            batch.append(member)
+            size += member.file_size
+            if len(batch) >= self.BATCH_FILES or size >= self.BATCH_BYTES:
+                yield batch
+                batch, size = [], 0
+        if batch:
+            yield batch
+
+    def _extract_batch(self, view, handles, batch, subdir, outputdir):
+        # borrow a ZipFile nobody else is using, or make one.
+        try:
+            zf = handles.get_nowait()
+        except queue.Empty:
+            zf = zipfile.ZipFile(_MappedReader(view))
+        try:
+            for member in batch:
+                try:
+                    self._extract_member(zf, member, subdir, outputdir)
+                except Exception as e:
+                    self.failures[member.filename] = e
+        finally:
+            handles.put(zf)
+
+    def _extract_member(self, zf, member, subdir, outputdir):
+        arcname = member.filename
+        if subdir:
+            assert arcname.startswith(subdir)
+            arcname = arcname[len(subdir):]
+        if not arcname:
+            return
+        targetpath = member_path(outputdir, arcname)
+        if member.is_dir():
+            os.makedirs(targetpath, exist_ok=True)
+            return
+        os.makedirs(os.path.dirname(targetpath), exist_ok=True)
+        # in chunks, all the way to the end of the member this time.
+        with open(targetpath, 'wb') as fout, zf.open(member) as fin:
+            while True:
+                data = fin.read(1024 * 1024)
+                if not data:
+                    break
+                fout.write(data)
+                with self._progress_lock:
+                    self._extracted_bytes += len(data)
+
+    @staticmethod
+    def _close_handles(handles):
+        while True:
+            try:
+                handles.get_nowait().close()
+            except queue.Empty:
+                return
@@ -10,9 +10,9 @@ import sys
 import threading
 import time
 import urllib.request
-import tempfile
-import zipfile
 
+from .ratelimit import LIMITER
+from .streamzip import StreamingUnzipper
 
 ZIP_THREADS = 5
 THREADS = 3
@@ -67,7 +67,7 @@ def get_content_length(resp, default=0):
         return 0
 
 
-def copyfileobj(fin, fout, filename='', sz=0):
+def copyfileobj(fin, fout, filename='', sz=0, consumer=None, weight=1.0):
     buffer = bytearray(64 * 1024)
     bufsz = 64 * 1024
     t = time.perf_counter()
@@ -82,6 +82,8 @@ def copyfileobj(fin, fout, filename='', sz=0):
             with memoryview(buffer)[:n] as view:
                 fout.write(view)
         total += n
+        # share the link with everything else in the process, if the user has capped it.
+        LIMITER.throttle(n, consumer, weight)
         if time.perf_counter() >= t + 1:
             # Calls to sys.stdout.write() are atomic.  Calls to print() are not.
             if sz:
@@ -111,7 +113,7 @@ def sanitize_path(filename):
     return filename.replace('/', os.path.sep)
 
 class Downloader:
-    def __init__(self, host, urlformat, tag=''):
+    def __init__(self, host, urlformat, tag='', bandwidth_weight=1.0):
         """
 
 
@@ -120,6 +122,7 @@ class Downloader:
         paramters (i.e. {0}) that will be substituted with values passed to put().
         :param dir: Path to the local directory we should dump our files in.
         :param tag: Human readable string of what this downloader is for.  Returned by str(downloader).
+        :param bandwidth_weight: This downloader's share of the bandwidth cap, if there is one.  See ratelimit.py.
         """
         self.host=host
         self.urltemplate=urlformat
@@ -129,6 +132,7 @@ class Downloader:
         self.threads = []
         self.failed_downloads = {}
         self.tag = tag
+        self.bandwidth_weight = bandwidth_weight
 
     def __str__(self):
         return str(self.tag)
@@ -193,7 +197,7 @@ class Downloader:
                     if resp.headers['Connection'] == 'keep-alive':
                         resp.read()
                     continue
-                copyfileobj(resp, fout, filename, get_content_length(resp))
+                copyfileobj(resp, fout, filename, get_content_length(resp), self, self.bandwidth_weight)
 
     def start(self, nthreads):
         if self.threads:
@@ -253,7 +257,7 @@ class ArbitraryURLDownloader(Downloader):
                     os.makedirs(os.path.dirname(dest), exist_ok=True)
                     fout = open(dest, 'wb')
                 with fout:
-                    copyfileobj(resp, fout, filename, get_content_length(resp))
+                    copyfileobj(resp, fout, filename, get_content_length(resp), self, self.bandwidth_weight)
 
 
 class ZipDownloader(Downloader):
@@ -267,15 +271,16 @@ class ZipDownloader(Downloader):
             if item is None:
                 return
             url, dest = item
-            with tempfile.TemporaryFile() as f:
-                resp = download(urllib.request.Request(url, headers={'User-Agent': 'SwordfishPDS-1.0'}),
-                                self.failed_downloads)
-                if not resp:
-                    continue
-                copyfileobj(resp, f, extract_filename(resp), get_content_length(resp))
+            resp = download(urllib.request.Request(url, headers={'User-Agent': 'SwordfishPDS-1.0'}),
+                            self.failed_downloads)
+            if not resp:
+                continue
+            # extracted as it downloads, rather than downloaded to a temporary file and then extracted.
+            with resp, StreamingUnzipper(dest) as unzipper:
                 try:
-                    with zipfile.ZipFile(f) as zf:
-                        zf.extractall(dest)
+                    copyfileobj(resp, unzipper, extract_filename(resp), get_content_length(resp), self,
+                                self.bandwidth_weight)
+                    unzipper.finish()
                 except Exception as e:
                     self.failed_downloads[extract_filename(resp)] = e
 
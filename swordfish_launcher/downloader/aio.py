@@ -0,0 +1,837 @@
+"""
+An asyncio download engine.
+
+The threaded Downloader in __init__.py needs one thread (and one connection) per server, and a modpack install talks to
+a *lot* of servers: launchermeta, libraries.minecraft.net, resources.download.minecraft.net, the Curse CDN, and every
+Solder host under the sun.  Most of those threads spend their lives blocked on a socket.  This module does the same job
+from a single thread running an event loop: every host gets a small pool of keep-alive connections, and every file
+being downloaded is a coroutine rather than a thread.
+
+This is deliberately built on asyncio streams and nothing else.  aiohttp would be less code, but see
+explanation_you_probably_demand.txt re: external libraries.
+"""
+
+import asyncio
+import contextlib
+import email.parser
+import functools
+import http.client
+import json
+import os
+import queue
+import ssl
+import tempfile
+import threading
+import time
+import urllib.parse
+
+from ..minefish import USER_AGENT
+from ..misc.fallocate import prealloc, allocate
+from .blobstore import BLOB_STORE
+from .mirrors import MirrorStats, host_of
+from .ratelimit import LIMITER
+from .streamzip import StreamingUnzipper
+from .verify import Verifier, VerificationError, verify_file
+from .writer import BUFFERS, ChunkWriter
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+REDIRECT_CODES = frozenset((301, 302, 303, 307, 308))
+
+
+class AsyncResponse:
+    """The asyncio equivalent of http.client.HTTPResponse, or at least the parts of it download() cares about."""
+
+    def __init__(self, reader: asyncio.StreamReader, version, status, reason, headers: http.client.HTTPMessage,
+                 method):
+        self.version = version
+        self.code = self.status = status
+        self.reason = reason
+        self.headers = headers
+        self._reader = reader
+        self._chunked = 'chunked' in headers.get('Transfer-Encoding', '').lower()
+        self._chunk_left = 0
+        connection = headers.get('Connection', '').lower()
+        self.will_close = connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive')
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            self.length = 0
+        elif self._chunked:
+            self.length = None
+        else:
+            try:
+                self.length = int(headers.get('Content-Length'))
+            except (TypeError, ValueError):
+                # No length and not chunked means the body runs until the server hangs up on us.
+                self.length = None
+                self.will_close = True
+        self._eof = self.length == 0
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    @property
+    def complete(self):
+        """True once the entire body has been read, i.e. the connection is positioned at the next response."""
+        return self._eof
+
+    async def readinto1(self, buffer) -> int:
+        """Read at most len(buffer) bytes of the body into buffer.  Returns 0 at the end of the body."""
+        if self._eof:
+            return 0
+        if self._chunked:
+            if self._chunk_left == 0:
+                line = await self._reader.readline()
+                size = int(line.split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    # skip the trailers, if there are any.
+                    while (await self._reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    self._eof = True
+                    return 0
+                self._chunk_left = size
+            wanted = min(len(buffer), self._chunk_left)
+        elif self.length is not None:
+            wanted = min(len(buffer), self.length)
+        else:
+            wanted = len(buffer)
+        data = await self._reader.read(wanted)
+        if not data:
+            if self.length is None and not self._chunked:
+                self._eof = True
+                return 0
+            raise http.client.IncompleteRead(b'')
+        count = len(data)
+        # StreamReader doesn't have a readinto(), so we pay for one copy here.
+        buffer[:count] = data
+        if self._chunked:
+            self._chunk_left -= count
+            if self._chunk_left == 0:
+                await self._reader.readexactly(2)  # the CRLF after every chunk
+        elif self.length is not None:
+            self.length -= count
+            if self.length == 0:
+                self._eof = True
+        return count
+
+    async def read(self) -> bytes:
+        chunks = []
+        with memoryview(bytearray(65536)) as buffer:
+            while True:
+                count = await self.readinto1(buffer)
+                if not count:
+                    return b''.join(chunks)
+                chunks.append(bytes(buffer[:count]))
+
+    async def drain(self):
+        """Read and discard the rest of the body so the connection can be reused."""
+        with memoryview(bytearray(65536)) as buffer:
+            while await self.readinto1(buffer):
+                pass
+
+
+class AsyncConnection:
+    """One keep-alive HTTP/1.1 connection to one host."""
+
+    def __init__(self, scheme, host, port):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    @property
+    def closed(self):
+        return self._writer is None or self._writer.is_closing() or self._reader.at_eof()
+
+    async def connect(self):
+        if self.scheme == 'https':
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port,
+                                                                       ssl=ssl.create_default_context(),
+                                                                       server_hostname=self.host)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def send_request(self, method, path, headers=None, body=None):
+        """Write a request to the socket without waiting for the response."""
+        if self.port == _DEFAULT_PORTS[self.scheme]:
+            host_header = self.host
+        else:
+            host_header = '%s:%d' % (self.host, self.port)
+        lines = ['%s %s HTTP/1.1' % (method, path), 'Host: ' + host_header]
+        all_headers = {'User-Agent': USER_AGENT, 'Accept-Encoding': 'identity'}
+        if headers:
+            all_headers.update(headers)
+        if body is not None:
+            all_headers['Content-Length'] = str(len(body))
+        lines.extend('%s: %s' % item for item in all_headers.items())
+        self._writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if body is not None:
+            self._writer.write(body)
+
+    async def get_response(self, method='GET') -> AsyncResponse:
+        while True:
+            status_line = await self._reader.readline()
+            if not status_line:
+                raise http.client.RemoteDisconnected('Remote end closed connection without response')
+            version, status, *reason = status_line.decode('latin-1').rstrip('\r\n').split(None, 2)
+            header_lines = []
+            while True:
+                line = await self._reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                header_lines.append(line)
+            headers = email.parser.BytesParser(_class=http.client.HTTPMessage).parsebytes(b''.join(header_lines))
+            status = int(status)
+            # 100 Continue and friends are followed by the real response.
+            if status != 100:
+                return AsyncResponse(self._reader, version, status, reason[0] if reason else '', headers, method)
+
+    async def request(self, method, path, headers=None, body=None) -> AsyncResponse:
+        self.send_request(method, path, headers, body)
+        await self._writer.drain()
+        return await self.get_response(method)
+
+
+class HostPool:
+    """Keep-alive connections to a single (scheme, host, port), no more than `limit` of them open at a time."""
+
+    def __init__(self, scheme, host, port, limit):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self._semaphore = asyncio.Semaphore(limit)
+        self._idle = []
+
+    async def acquire(self) -> AsyncConnection:
+        await self._semaphore.acquire()
+        try:
+            while self._idle:
+                conn = self._idle.pop()
+                if not conn.closed:
+                    return conn
+            conn = AsyncConnection(self.scheme, self.host, self.port)
+            await conn.connect()
+            return conn
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    def release(self, conn: AsyncConnection, reusable):
+        """Give a connection back to the pool.  Pass reusable=False if the response wasn't read to completion or the
+        server said it was going to hang up on us, and the connection will be closed instead.
+        """
+        if reusable and not conn.closed:
+            self._idle.append(conn)
+        else:
+            conn.close()
+        self._semaphore.release()
+
+    def close(self):
+        for conn in self._idle:
+            conn.close()
+        self._idle.clear()
+
+
+class RedirectCache:
+    """Remembers which URLs redirected where, so that next time we can skip the redirect (and the round trip to the
+    server that issues it) altogether.  If a remembered target stops working, AsyncDownloader forgets it and goes back
+    to the original URL.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: JSON file to load the cache from and save it to, or None to keep it in memory only.
+        """
+        self.path = path
+        self._redirects = {}
+        self._dirty = False
+        if path is not None:
+            try:
+                with open(path) as f:
+                    self._redirects = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def get(self, url):
+        return self._redirects.get(url)
+
+    def add(self, url, target):
+        if self._redirects.get(url) != target:
+            self._redirects[url] = target
+            self._dirty = True
+
+    def forget(self, url):
+        if self._redirects.pop(url, None) is not None:
+            self._dirty = True
+
+    def save(self):
+        if self.path is None or not self._dirty:
+            return
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self._redirects, f)
+        os.replace(self.path + '.tmp', self.path)
+        self._dirty = False
+
+
+def split_url(url):
+    """Split a URL into the pool key (scheme, host, port) and the path we send in the request line."""
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in _DEFAULT_PORTS:
+        raise ValueError('Unsupported URL scheme: %r' % url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return (parts.scheme, parts.hostname, parts.port or _DEFAULT_PORTS[parts.scheme]), path.replace(' ', '%20')
+
+
+async def download(resp: AsyncResponse, fout, job, stop=lambda: False, blocksize=256 * 1024, verifier=None,
+                   checkpoint=None, stall_timeout=None):
+    """The asyncio equivalent of downloader.download().  Returns True if the whole body was written to fout, False
+    if stop() returned True partway through.  Raises asyncio.TimeoutError if stall_timeout seconds go by without a
+    single byte arriving.
+    """
+    writer = ChunkWriter(fout)
+    if resp.length and not isinstance(fout, StreamingUnzipper):
+        prealloc(fout, writer.offset + resp.length)
+    with BUFFERS.get(blocksize) as buffer, contextlib.closing(writer):
+        while not stop():
+            count = await asyncio.wait_for(resp.readinto1(buffer), stall_timeout)
+            if not count:
+                return True
+            chunk = buffer if count == blocksize else buffer[:count]
+            writer.write(chunk)
+            if verifier is not None:
+                verifier.update(chunk)
+            if checkpoint is not None:
+                checkpoint(writer.offset)
+            job._progress(count)
+            delay = LIMITER.reserve(count, job, job.bandwidth_weight, job.bandwidth_share)
+            if delay:
+                await asyncio.sleep(delay)
+        return False
+
+
+class AsyncDownloader(threading.Thread):
+    """Services DownloadJobs for every host from a single thread running an asyncio event loop.
+
+    Unlike the threaded Downloader, this isn't tied to one server.  Items added to a DownloadJob serviced by an
+    AsyncDownloader are (outputpath, url) pairs, i.e. call job.add('mods/foo.jar', (url,)).  As with the threaded
+    Downloader, outputpath may instead be a callable, in which case the file is downloaded to a temporary file
+    which is passed to the callable once the download is complete.  The callable is run in the loop's default
+    executor, not on the loop, so it can take as long as it likes (extracting a zip, say) without stalling every other
+    download; it does need to be thread-safe, as it already does with the threaded Downloader's worker threads.  Or
+    outputpath may be a streamzip.StreamingUnzipper.
+
+    The url may also be a list of URLs for the same file (see mirrors.mod_urls()), in which case they're tried fastest
+    first, and if one stalls or fails partway through, the next carries on from where it stopped.
+    """
+
+    def __init__(self, max_connections_per_host=2, blocksize=256 * 1024, segment_threshold=None, segments=4,
+                 redirect_cache: 'RedirectCache' = None, max_redirects=10, journal=None,
+                 mirror_stats: MirrorStats = None, stall_timeout=30, probe_timeout=5):
+        """
+        :param max_connections_per_host: How many connections we're allowed to have open to any one server at once.
+        See the note at the top of __init__.py -- more is not better, but two lets one connection be busy with a big
+        file while the other gets on with the small ones.
+        :param blocksize: Size of the receive buffer for each file.
+        :param segment_threshold: Files at least this many bytes long are split into `segments` byte ranges which are
+        downloaded concurrently, each on its own connection.  On a high latency link a single connection can't fill
+        the pipe, and the pack zip that everything else is waiting on is exactly the file where that hurts.  None (the
+        default) disables this.  Segments still count against max_connections_per_host, so raise that too.
+        :param segments: How many pieces to split large files into.
+        :param redirect_cache: Where to remember redirects.  Pass a RedirectCache with a path to have them remembered
+        between runs; by default they're only remembered until this downloader shuts down.
+        :param max_redirects: How many redirects in a row we'll follow before giving up on a URL.
+        :param journal: A ResumeJournal for files that aren't downloaded in segments (segmented ones keep their own
+        state next to the .part file).  See the threaded Downloader.
+        :param mirror_stats: Where to keep track of how fast each host is.  Pass a MirrorStats with a path to have it
+        remembered between runs.
+        :param stall_timeout: Give up on a download if nothing arrives for this many seconds.  When there's another
+        mirror to try, it takes over from there.
+        :param probe_timeout: How long a HEAD request to an unfamiliar mirror gets to answer before we write it off.
+        """
+        super().__init__(name='AsyncDownloader', daemon=True)
+        self.loop = asyncio.new_event_loop()
+        self.max_connections_per_host = max_connections_per_host
+        self.blocksize = blocksize
+        self.segment_threshold = segment_threshold
+        self.segments = segments
+        self.redirects = redirect_cache if redirect_cache is not None else RedirectCache()
+        self.max_redirects = max_redirects
+        self.journal = journal
+        self.mirrors = mirror_stats if mirror_stats is not None else MirrorStats()
+        self.stall_timeout = stall_timeout
+        self.probe_timeout = probe_timeout
+        self._pools = {}
+        self._job_tasks = set()
+        # a future of our loop's rather than an asyncio.Event, which (before 3.10) belongs to whichever loop is current
+        # in the thread that makes it, and that's not ours.
+        self._shutting_down = self.loop.create_future()
+
+    def enqueue_job(self, job):
+        """Start servicing a DownloadJob.  Safe to call from any thread, before or after start()."""
+        self.loop.call_soon_threadsafe(self._start_job, job)
+
+    def shutdown(self, wait=True):
+        """Stop the event loop once every job that has been enqueued is done.  Jobs that are never finalized will
+        hang this, just like they hang the threaded Downloader.
+        """
+        self.loop.call_soon_threadsafe(self._begin_shutdown)
+        if wait:
+            self.join()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            for pool in self._pools.values():
+                pool.close()
+            self.loop.close()
+            self.redirects.save()
+            self.mirrors.save()
+
+    def _begin_shutdown(self):
+        if not self._shutting_down.done():
+            self._shutting_down.set_result(None)
+
+    async def _main(self):
+        await self._shutting_down
+        while self._job_tasks:
+            await asyncio.gather(*self._job_tasks, return_exceptions=True)
+
+    def _start_job(self, job):
+        task = self.loop.create_task(self._run_job(job))
+        self._job_tasks.add(task)
+        task.add_done_callback(self._job_tasks.discard)
+
+    def get_pool(self, scheme, host, port) -> HostPool:
+        key = (scheme, host, port)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = self._pools[key] = HostPool(scheme, host, port, self.max_connections_per_host)
+        return pool
+
+    async def _run_job(self, job):
+        wakeup = asyncio.Event()
+        job._on_add = lambda: self.loop.call_soon_threadsafe(wakeup.set)
+        fetches = set()
+        try:
+            while True:
+                try:
+                    outfile, *url_args = job.queue.get_nowait()
+                except queue.Empty:
+                    wakeup.clear()
+                    # add() may have been called between get_nowait() and clear(), in which case its wakeup call is
+                    # already sitting in the loop's queue and will be along shortly.  Either way, no lost wakeups.
+                    if job.queue.empty():
+                        await wakeup.wait()
+                    continue
+                if outfile is None:
+                    break
+                if job.cancelled:
+                    job._task_done()
+                    continue
+                task = self.loop.create_task(self._fetch(job, outfile, url_args[0]))
+                fetches.add(task)
+                task.add_done_callback(fetches.discard)
+            while fetches:
+                await asyncio.gather(*fetches, return_exceptions=True)
+        finally:
+            job._on_add = None
+            job.done.set()
+
+    async def _fetch(self, job, outfile, url):
+        key = url[0] if isinstance(url, (list, tuple)) else url
+        try:
+            if isinstance(url, (list, tuple)):
+                result = await self._fetch_mirrored(job, outfile, url)
+            else:
+                result = await self._fetch_url(job, outfile, url)
+            if result is not None:
+                job.failed_downloads[key] = result
+        except Exception as e:
+            job.failed_downloads[key] = e
+        finally:
+            job._task_done()
+
+    async def _fetch_mirrored(self, job, outfile, urls):
+        """Fetch a file that's available from several URLs.  Returns None if we got it, else whatever went wrong with
+        the last mirror we tried."""
+        digests = job.digests.get(outfile) or {}
+        # Every mirror has its own idea of ETags, so If-Range would make the next mirror start again from zero.  If we
+        # can check the whole file at the end (a hash, or Curse's fingerprint), we can leave it off and carry on from the
+        # same byte.  Otherwise, If-Range stays on (assuming there's a journal) and a mirror that isn't the one we
+        # started with starts over.
+        splice = bool(digests.get('sha1') or digests.get('md5')) or digests.get('fingerprint') is not None
+        result = None
+        for url in await self._rank_mirrors(urls, digests.get('length')):
+            host = host_of(url)
+            part = outfile + '.part' if isinstance(outfile, str) else None
+            before = os.path.getsize(part) if part and os.path.exists(part) else 0
+            started = time.monotonic()
+            try:
+                # the journal knows the file by its first URL, whichever mirror it's coming from.
+                result = await self._fetch_url(job, outfile, url, journal_url=urls[0], if_range=not splice)
+            except (OSError, asyncio.TimeoutError, http.client.HTTPException, ValueError) as e:
+                result = e
+            if result is None:
+                if isinstance(outfile, str) and os.path.exists(outfile):
+                    self.mirrors.record_transfer(host, os.path.getsize(outfile) - before, time.monotonic() - started)
+                return None
+            self.mirrors.record_failure(host)
+            if job.cancelled:
+                break
+        return result
+
+    async def _rank_mirrors(self, urls, size=None):
+        """urls, best first.  Hosts we've never heard from get a HEAD request to see how quickly they answer, and URLs
+        that turn out not to exist go to the very back."""
+        missing = set()
+
+        async def probe(url):
+            key, path = split_url(url)
+            pool = self.get_pool(*key)
+            conn = await pool.acquire()
+            resp = None
+            try:
+                started = time.monotonic()
+                resp = await asyncio.wait_for(conn.request('HEAD', path), self.probe_timeout)
+                self.mirrors.record_latency(key[1], time.monotonic() - started)
+                if resp.status in (404, 410):
+                    missing.add(url)
+                elif resp.status >= 400:
+                    self.mirrors.record_failure(key[1])
+            except (OSError, asyncio.TimeoutError, http.client.HTTPException):
+                self.mirrors.record_failure(key[1])
+            finally:
+                pool.release(conn, resp is not None and resp.complete and not resp.will_close)
+
+        unknown = [url for url in urls if not self.mirrors.known(host_of(url))]
+        if len(urls) > 1 and unknown:
+            await asyncio.gather(*map(probe, unknown), return_exceptions=True)
+        return self.mirrors.rank([url for url in urls if url not in missing], size) + \
+            [url for url in urls if url in missing]
+
+    async def _fetch_url(self, job, outfile, url, journal_url=None, if_range=True):
+        """Fetch url into outfile, following redirects.  Returns None if we're done with it, or the HTTP status code if
+        the server said no."""
+        # If we've seen this URL redirect before, go straight to wherever it went last time.  This is mostly for the
+        # Curse CDN, where every single mod download is a redirect from edge.forgecdn.net to somewhere else.
+        target = self.redirects.get(url) or url
+        from_cache = target != url
+        for _ in range(self.max_redirects + 1):
+            result = await self._fetch_from(job, outfile, target, journal_url or url, if_range)
+            if result is None:
+                if target != url:
+                    self.redirects.add(url, target)
+                if isinstance(outfile, str) and BLOB_STORE.enabled and not job.cancelled and os.path.exists(outfile):
+                    # under the URL we were asked for, which is what DownloadJob.add() will look it up by next time.
+                    # (in an executor, since it may have to hash the file.)
+                    await self.loop.run_in_executor(None, functools.partial(
+                        BLOB_STORE.add, outfile, url=url, **job.digests.get(outfile, {})))
+                return
+            elif isinstance(result, int):
+                if from_cache:
+                    # the redirect we remembered has gone stale.  forget it and go the long way round.
+                    self.redirects.forget(url)
+                    target = url
+                    from_cache = False
+                    continue
+                return result
+            else:
+                target = result
+        raise ValueError('Too many redirects fetching %s' % url)
+
+    async def _fetch_from(self, job, outfile, url, journal_url=None, if_range=True):
+        """Fetch url into outfile.  Returns None if we're done with it (successfully or because the job was cancelled),
+        the target URL if the server redirected us, or the HTTP status code if the server said no.
+
+        :param journal_url: What the journal knows the file by, if not url.
+        :param if_range: False to resume without If-Range (see _fetch_mirrored).
+        """
+        journal_url = journal_url or url
+        key, path = split_url(url)
+        pool = self.get_pool(*key)
+        digests = job.digests.get(outfile)
+        on_disk = isinstance(outfile, str)
+        if on_disk and self.segment_threshold:
+            state = SegmentedFile.load(outfile + '.part')
+            if state is not None:
+                # a previous segmented download of this file was interrupted.  pick up each piece where it left off.
+                return await self._download_segments(job, state, pool, path, digests)
+        if isinstance(outfile, StreamingUnzipper):
+            # as with the threaded Downloader, there's nothing on disk to resume from, so this always starts from the
+            # first byte.
+            outfile.reset()
+            fout = outfile
+            callback = None
+        elif callable(outfile):
+            # TODO implement a config option for caching.
+            fout = tempfile.TemporaryFile()
+            callback = outfile
+        else:
+            os.makedirs(os.path.dirname(outfile) or '.', exist_ok=True)
+            fout = open(outfile + '.part', 'ab')
+            callback = None
+        headers = {}
+        journal = self.journal if on_disk else None
+        checkpoint = None
+        if journal is not None:
+            validator = journal.resume(outfile, journal_url, fout)
+            if validator and if_range:
+                headers['If-Range'] = validator
+        if fout.tell():
+            headers['Range'] = 'bytes=%d-' % fout.tell()
+        verifier = Verifier.from_digests(digests)
+        conn = await pool.acquire()
+        resp = None
+        segmented = first = None
+        try:
+            resp = await conn.request('GET', path, headers)
+            if resp.status == 416 and 'Range' in headers:
+                # we already have the whole thing.
+                await resp.drain()
+                finished = True
+            elif resp.status == 200 and on_disk and self._should_segment(resp):
+                fout.close()
+                if journal is not None:
+                    # the segment state takes it from here.
+                    journal.forget(outfile)
+                segmented = SegmentedFile.create(outfile + '.part', resp.length,
+                                                 resp.getheader('ETag') or resp.getheader('Last-Modified'),
+                                                 self.segments, self.blocksize)
+                # This connection is already sending us the start of the file, so it gets the first segment, at the
+                # same time as the others get theirs.  It's theirs to give back to the pool from here on.
+                first, conn = (conn, resp), None
+            elif resp.status == 200 or (resp.status == 206 and 'Range' in headers):
+                if resp.status == 200 and 'Range' in headers:
+                    # the server ignored our Range header (or the file changed, and If-Range got us the new one) and
+                    # is sending the whole file again.
+                    fout.seek(0)
+                    fout.truncate()
+                if journal is not None:
+                    journal.begin(outfile, journal_url, resp, fout.tell())
+                    checkpoint = functools.partial(journal.checkpoint, outfile, fout)
+                if verifier is not None and resp.status == 206:
+                    # the start of the file came from an earlier attempt.  it needs hashing too.
+                    verifier.update_from_file(fout.name, fout.tell())
+                finished = await download(resp, fout, job, lambda: job.cancelled, self.blocksize, verifier,
+                                          checkpoint, self.stall_timeout)
+            elif resp.status in REDIRECT_CODES and resp.getheader('Location'):
+                # the connection to the target host (if it's a different one) comes out of its own pool, so this one
+                # goes back to ours for the next file.
+                await resp.drain()
+                fout.close()
+                return urllib.parse.urljoin(url, resp.getheader('Location'))
+            else:
+                await resp.drain()
+                fout.close()
+                return resp.status
+        except BaseException as e:
+            if isinstance(e, VerificationError) and journal is not None:
+                # begin() didn't like the look of the 206.  start again from scratch next time.
+                fout.truncate(0)
+            elif checkpoint is not None:
+                checkpoint(fout.tell(), force=True)
+            fout.close()
+            raise
+        finally:
+            if conn is not None:
+                pool.release(conn, resp is not None and resp.complete and not resp.will_close)
+        if segmented:
+            return await self._download_segments(job, segmented, pool, path, digests, first)
+        if finished and verifier is not None:
+            try:
+                verifier.verify()
+            except VerificationError:
+                # don't leave it lying around to be resumed; that'd just get us the same wrong file again.
+                fout.close()
+                if on_disk:
+                    os.remove(fout.name)
+                if journal is not None:
+                    journal.forget(outfile)
+                raise
+        if not finished:
+            if checkpoint is not None:
+                checkpoint(fout.tell(), force=True)
+            fout.close()
+        elif callback:
+            # as with the threaded Downloader, it is up to the callback to close the file.
+            fout.seek(0)
+            await self.loop.run_in_executor(None, callback, fout)
+        elif not on_disk:
+            # extracts whatever had to wait for the central directory (off the loop, since that's a lot of
+            # decompressing and writing), and complains if the archive was bad.
+            await self.loop.run_in_executor(None, fout.finish)
+        else:
+            fout.close()
+            os.replace(fout.name, outfile)
+            if journal is not None:
+                journal.forget(outfile)
+
+    def _should_segment(self, resp: AsyncResponse):
+        return (self.segment_threshold is not None and self.segments > 1
+                and resp.length is not None and resp.length >= self.segment_threshold
+                and resp.getheader('Accept-Ranges', '').lower() == 'bytes')
+
+    async def _download_segments(self, job, state: 'SegmentedFile', pool: HostPool, path, digests=None, first=None):
+        """Download every unfinished segment of state concurrently, then rename the .part file into place.
+
+        :param first: (conn, resp) for a response for the whole file that nobody's read any of yet.  The first segment
+        comes from that rather than a connection of its own.
+        """
+        tasks = [self._download_segment(job, state, i, pool, path, *(first if i == 0 and first else ()))
+                 for i in range(len(state.segments)) if not state.segment_done(i)]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        state.save()
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        if job.cancelled or not state.complete:
+            return
+        if digests:
+            # The segments arrived out of order, so there was no stream to hash as it went by.  This is the one case
+            # where we do have to read the file back.
+            try:
+                verify_file(state.path, digests)
+            except VerificationError:
+                state.discard()
+                raise
+        state.finish()
+
+    async def _download_segment(self, job, state: 'SegmentedFile', index, pool: HostPool, path, conn=None,
+                                resp=None):
+        """Download one segment of a file into its place in the preallocated .part file.
+
+        If conn and resp are given, resp is a response for the whole file which we read the start of.  Otherwise we
+        acquire our own connection and send a Range request.  Either way, the connection goes back to the pool when
+        we're done (and won't be reused if we stopped partway through a body).
+        """
+        start, position, end = state.segments[index]
+        if position >= end:
+            return
+        own_connection = conn is None
+        if own_connection:
+            conn = await pool.acquire()
+        try:
+            if own_connection:
+                headers = {'Range': 'bytes=%d-%d' % (position, end - 1)}
+                if state.validator:
+                    # If the file has changed since we started, If-Range gets us a 200 with the new file rather than a
+                    # 206 with a piece of it, and we know not to splice the two together.
+                    headers['If-Range'] = state.validator
+                resp = await conn.request('GET', path, headers)
+                if resp.status != 206:
+                    await resp.drain()
+                    if resp.status == 200:
+                        state.discard()
+                        raise ValueError('%s changed on the server partway through a segmented download' % path)
+                    raise ValueError(resp.status)
+            with open(state.path, 'r+b') as fout, BUFFERS.get(self.blocksize) as buffer:
+                # each segment has its own handle and writes at its own offsets, so they never fight over a position.
+                writer = ChunkWriter(fout, position)
+                since_save = 0
+                while position < end and not job.cancelled:
+                    count = await asyncio.wait_for(resp.readinto1(buffer[:min(self.blocksize, end - position)]),
+                                                   self.stall_timeout)
+                    if not count:
+                        raise http.client.IncompleteRead(b'', end - position)
+                    writer.write(buffer[:count])
+                    position += count
+                    state.segments[index][1] = position
+                    job._progress(count)
+                    delay = LIMITER.reserve(count, job, job.bandwidth_weight, job.bandwidth_share)
+                    if delay:
+                        await asyncio.sleep(delay)
+                    since_save += count
+                    if since_save >= SegmentedFile.SAVE_INTERVAL:
+                        # the resume state must never claim more than has actually made it to disk.  (pwrite() means
+                        # there's no buffer to flush, but on platforms without it, there is.)
+                        fout.flush()
+                        state.save()
+                        since_save = 0
+        finally:
+            pool.release(conn, resp is not None and resp.complete and not resp.will_close)
+
+
+class SegmentedFile:
+    """Resume state for a file being downloaded in several pieces at once.
+
+    The pieces are written straight into their final positions in a .part file that is preallocated to the full
+    length.  Which bytes of it are actually filled in lives next to it in <name>.part.segments, so that a crash or a
+    cancellation only costs us whatever was written since the last save.
+    """
+
+    # How many bytes a segment downloads between saves of the resume state.
+    SAVE_INTERVAL = 4 * 1024 * 1024
+
+    def __init__(self, path, length, validator, segments):
+        """
+        :param path: Path to the .part file.
+        :param length: Total length of the file.
+        :param validator: ETag or Last-Modified of the file, or None if the server didn't send either.
+        :param segments: List of [start, position, end] lists.  Bytes start to position have been written, position
+        to end (exclusive) haven't.
+        """
+        self.path = path
+        self.length = length
+        self.validator = validator
+        self.segments = segments
+
+    @classmethod
+    def create(cls, path, length, validator, count, alignment):
+        """Split a file of the given length into count segments (aligned to alignment bytes), preallocate the .part
+        file and save the initial state.
+        """
+        size = -(-length // count)
+        size += -size % alignment
+        segments = [[start, start, min(start + size, length)] for start in range(0, length, size)]
+        with open(path, 'wb') as f:
+            allocate(f, length)
+        state = cls(path, length, validator, segments)
+        state.save()
+        return state
+
+    @classmethod
+    def load(cls, path):
+        """Return the saved state for the .part file at path, or None if it isn't being downloaded in segments (or the
+        state doesn't match the file on disk, in which case the regular resume logic is the best we can do).
+        """
+        try:
+            with open(path + '.segments') as f:
+                data = json.load(f)
+            if os.path.getsize(path) != data['length']:
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+        return cls(path, data['length'], data['validator'], data['segments'])
+
+    def save(self):
+        with open(self.path + '.segments.tmp', 'w') as f:
+            json.dump({'length': self.length, 'validator': self.validator, 'segments': self.segments}, f)
+        os.replace(self.path + '.segments.tmp', self.path + '.segments')
+
+    def segment_done(self, index):
+        return self.segments[index][1] >= self.segments[index][2]
+
+    @property
+    def complete(self):
+        return all(position >= end for _, position, end in self.segments)
+
+    def discard(self):
+        """Forget the resume state and the .part file.  Used when the file has changed under us."""
+        for path in (self.path + '.segments', self.path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def finish(self):
+        """Rename the finished .part file to its final name and remove the resume state."""
+        os.replace(self.path, self.path[:-len('.part')])
+        os.remove(self.path + '.segments')
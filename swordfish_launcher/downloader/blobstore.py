@@ -0,0 +1,186 @@
+"""
+One copy of every file we've ever downloaded, shared by every instance.
+
+Install the same pack on five instances and you get the same two hundred jars five times over, and until now, five
+downloads of each.  The blob store keeps one copy of each file, named by its SHA-1, and when a DownloadJob is asked for
+a file we already have, it links (or copies) it into place instead of adding it to the download queue.
+
+Files are found by whatever we know about them before asking the server anything: a SHA-1 (Mojang gives us those), an
+MD5 (Technic), or failing both, the URL.  URLs are trusted without asking the server again, which is fine for the
+places we download mods from: Curse and Technic file URLs have the file's ID or version in them and never change.
+(Mojang's version manifests do change, but those aren't downloaded through DownloadJobs.)
+
+The store has a size cap.  When it goes over, the files that were least recently put into an instance go first.  Since
+instances get hard links where possible, evicting a file from the store doesn't take it away from any instance that
+already has it.
+
+Like LIMITER, there's one store per process, BLOB_STORE, which does nothing until it's configured:
+
+    BLOB_STORE.configure('~/.swordfish/blobs', max_size=10 * 1024 ** 3)
+"""
+
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+
+def file_sha1(path, blocksize=1024 * 1024):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f, memoryview(bytearray(blocksize)) as buffer:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                return sha1.hexdigest()
+            sha1.update(buffer[:count])
+
+
+def link_or_copy(source, dest, link=True):
+    """Put a file at dest that's the same as source: a hard link if possible (and link is True), else a copy.  Either
+    way it's made next to dest first and renamed into place, so nobody ever sees half a file."""
+    os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+    temp = dest + '.blob'
+    if os.path.lexists(temp):
+        os.remove(temp)
+    try:
+        if not link:
+            raise OSError
+        os.link(source, temp)
+    except OSError:
+        # different filesystem, or one without hard links (FAT32 USB sticks...)
+        shutil.copyfile(source, temp)
+    os.replace(temp, dest)
+
+
+class BlobStore:
+    def __init__(self, root=None, max_size=None, link=True):
+        """
+        :param root: Directory to keep everything in.  None means disabled, and every method is a no-op.
+        :param max_size: Size cap in bytes, or None for no cap.
+        :param link: Put files into instances as hard links (which cost no space) rather than copies, where the
+        filesystem allows it.  Only turn this off if something is going to edit files in place in an instance, since
+        that edits them in every other instance too.
+        """
+        self.root = None
+        self._lock = threading.Lock()
+        self.configure(root, max_size, link)
+
+    def configure(self, root, max_size=None, link=True):
+        with self._lock:
+            self.max_size = max_size
+            self.link = link
+            if root is None:
+                self.root = self.db = None
+                return
+            self.root = os.path.expanduser(root)
+            os.makedirs(os.path.join(self.root, 'objects'), exist_ok=True)
+            # Other launcher processes may be using the same store, hence WAL and a timeout.
+            self.db = sqlite3.connect(os.path.join(self.root, 'index.sqlite'), timeout=30, check_same_thread=False)
+            self.db.execute('pragma journal_mode=wal')
+            with self.db:
+                self.db.execute('create table if not exists blobs('
+                                'sha1 text primary key, size integer not null,'
+                                # when this was last put into an instance (or added).  eviction goes by this.
+                                'last_used real not null)')
+                self.db.execute('create table if not exists aliases('
+                                # 'md5' or 'url'
+                                'kind text not null, key text not null,'
+                                'sha1 text not null,'
+                                'primary key (kind, key))')
+
+    @property
+    def enabled(self):
+        return self.root is not None
+
+    def _object_path(self, sha1):
+        return os.path.join(self.root, 'objects', sha1[:2], sha1)
+
+    def find(self, sha1=None, md5=None, url=None):
+        """The SHA-1 of a blob we have matching any of the given keys, or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            if sha1:
+                row = self.db.execute('select sha1 from blobs where sha1 = ?', (sha1.lower(),)).fetchone()
+            elif md5:
+                row = self.db.execute("select sha1 from aliases where kind = 'md5' and key = ?",
+                                      (md5.lower(),)).fetchone()
+            elif url:
+                row = self.db.execute("select sha1 from aliases where kind = 'url' and key = ?", (url,)).fetchone()
+            else:
+                row = None
+        if row and os.path.exists(self._object_path(row[0])):
+            return row[0]
+        return None
+
+    def materialize(self, dest, sha1=None, md5=None, url=None, **ignored):
+        """If we have the file, put it at dest and return True.  Otherwise return False.  Takes the same keyword
+        arguments as DownloadJob.add() (digests) plus url, and ignores the ones that aren't keys."""
+        found = self.find(sha1, md5, url)
+        if found is None:
+            return False
+        try:
+            link_or_copy(self._object_path(found), dest, self.link)
+        except OSError:
+            return False
+        with self._lock, self.db:
+            self.db.execute('update blobs set last_used = ? where sha1 = ?', (time.time(), found))
+        return True
+
+    def add(self, path, sha1=None, md5=None, url=None, **ignored):
+        """Put a copy of a freshly downloaded file into the store, under its SHA-1 and whichever other keys it has.
+        Takes the same keyword arguments as materialize()."""
+        if not self.enabled:
+            return
+        if not sha1:
+            sha1 = file_sha1(path)
+        sha1 = sha1.lower()
+        target = self._object_path(sha1)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(target))
+            os.close(fd)
+            try:
+                os.remove(temp)
+                os.link(path, temp)
+            except OSError:
+                shutil.copyfile(path, temp)
+            os.replace(temp, target)
+        size = os.stat(target).st_size
+        with self._lock, self.db:
+            self.db.execute('insert or replace into blobs values (?, ?, ?)', (sha1, size, time.time()))
+            if md5:
+                self.db.execute("insert or replace into aliases values ('md5', ?, ?)", (md5.lower(), sha1))
+            if url:
+                self.db.execute("insert or replace into aliases values ('url', ?, ?)", (url, sha1))
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+    def evict(self, max_size):
+        """Delete least recently used blobs until the store is no bigger than max_size."""
+        if not self.enabled:
+            return
+        with self._lock, self.db:
+            total, = self.db.execute('select coalesce(sum(size), 0) from blobs').fetchone()
+            if total <= max_size:
+                return
+            victims = []
+            for sha1, size in self.db.execute('select sha1, size from blobs order by last_used'):
+                if total <= max_size:
+                    break
+                victims.append(sha1)
+                total -= size
+            self.db.executemany('delete from aliases where sha1 = ?', ((sha1,) for sha1 in victims))
+            self.db.executemany('delete from blobs where sha1 = ?', ((sha1,) for sha1 in victims))
+        for sha1 in victims:
+            try:
+                os.remove(self._object_path(sha1))
+            except FileNotFoundError:
+                pass
+
+
+# The one everybody uses.  Disabled until BLOB_STORE.configure(root) is called.
+BLOB_STORE = BlobStore()
@@ -19,6 +19,8 @@ import csv
 import io
 import pkgutil
 
+from .mirrors import mod_urls
+
 local_logger = logging.getLogger('Mod cache')
 authority_client = http.client.HTTPSConnection('some-server-i-will-put-up-probably-on-aws-someday.net')
 
@@ -204,6 +206,13 @@ class Cache:
                         if local_value and remote_value and local_value != remote_value:
                             raise ValueError("Metadata conflict!  Either our database is corrupt or the server's is!")
 
+    def download_urls(self, zhash):
+        """Every URL we know the mod with this zhash can be downloaded from, for AsyncDownloader to pick between.  See
+        mirrors.mod_urls()."""
+        row = self.cursor.execute('select cf_fileid, canonical_filename, nodecdn_url from mods where zhash=?',
+                                  (zhash,)).fetchone()
+        return mod_urls(*row) if row else []
+
     def procure_file(self, manifest, outputdir):
         paths = self._local_files.get(manifest)
         if not paths:
@@ -1,33 +1,123 @@
 import urllib.parse
 import http.client
 import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .singleflight import FLIGHTS
+from .httpcache import HTTP_CACHE
+
+# What a keep-alive connection the server has quietly closed looks like when we next try to use it.  For a GET, that
+# just means "try again on a new connection".  For anything else, it does too, as long as it was an idle connection
+# and nothing came back: then the server had hung up before the request got there.
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest,
+                            http.client.BadStatusLine, ConnectionResetError, BrokenPipeError)
+
 
 class API:
-    def __init__(self, baseurl, default_headers):
+    def __init__(self, baseurl, default_headers, pool_size=8, retries=2, timeout=60):
+        """
+        :param pool_size: How many connections to the server we'll have open at once, at most.  That's also how many
+        requests get_json_many() makes at once.
+        :param retries: How many more times to try a GET if the connection dies under it.  POSTs aren't retried,
+        except on a new connection when the idle one they were sent on turns out to have been closed already.
+        :param timeout: Socket timeout, in seconds.
+        """
         scheme, host, path, _, _, _ = urllib.parse.urlparse(baseurl)
         self._basepath = path
         assert scheme in ('http','https')
-        self._client = {'http': http.client.HTTPConnection, 'https': http.client.HTTPSConnection}[scheme](host)
+        self._connection_class = {'http': http.client.HTTPConnection, 'https': http.client.HTTPSConnection}[scheme]
+        self._host = host
+        self._timeout = timeout
         self._default_headers = default_headers
+        self.pool_size = pool_size
+        self.retries = retries
+        # GETs for the same URL with the same headers, from any API object, share one request while it's in flight.
+        self._flight_key = (scheme, host, tuple(sorted(default_headers.items())))
+        # idle connections, most recently used first, since those are the ones least likely to have been closed by the
+        # server.  _slots stops us opening more than pool_size of them.
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
 
-    def post_json(self, path, data, headers={}):
+    def _request(self, method, path, body=None, headers={}, retries=0):
+        """Make a request on a pooled connection and return (status, headers, body).  The response is always read in
+        full, so that the connection can go back in the pool for the next request."""
         _headers = self._default_headers.copy()
-        _headers['Content-Type'] = 'application/json'
         _headers.update(headers)
-        self._client.request('POST', self._basepath+path, json.dumps(data), _headers)
-        return self._client.getresponse()
+        with self._slots:
+            while True:
+                try:
+                    client, pooled = self._idle.get_nowait(), True
+                except queue.Empty:
+                    client, pooled = self._connection_class(self._host, timeout=self._timeout), False
+                answered = False
+                try:
+                    client.request(method, self._basepath+path, body, _headers)
+                    with client.getresponse() as resp:
+                        answered = True
+                        result = resp.status, resp.headers, resp.read()
+                        reusable = not resp.will_close
+                except _STALE_CONNECTION_ERRORS as e:
+                    client.close()
+                    # RemoteDisconnected is the server hanging up without a word; any other BadStatusLine means it
+                    # said *something*, so it may have got the request.
+                    unanswered = not answered and (isinstance(e, http.client.RemoteDisconnected)
+                                                   or not isinstance(e, http.client.BadStatusLine))
+                    if pooled and unanswered:
+                        # stale.  that doesn't count as a retry: there's at most pool_size of them to get through.
+                        continue
+                    if retries <= 0:
+                        raise
+                    retries -= 1
+                    continue
+                except BaseException:
+                    # who knows what state it's in.
+                    client.close()
+                    raise
+                if reusable:
+                    self._idle.put(client)
+                else:
+                    client.close()
+                return result
+
+    def close(self):
+        """Close every idle connection.  The API object still works afterwards; it'll just open new ones."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def post_json(self, path, data, headers={}):
+        _headers = {'Content-Type': 'application/json'}
+        _headers.update(headers)
+        # not retried (beyond _request() getting past a stale pooled connection): a POST that died halfway might have
+        # done whatever it does.
+        status, _, body = self._request('POST', path, json.dumps(data), _headers)
+        if status != 200:
+            raise ValueError(status)
+        return json.loads(body)
 
     def get_json(self, path):
-        self._client.request('GET', self._basepath+path, headers=self._default_headers)
-        with self._client.getresponse() as resp:
-            if resp.code != 200:
-                raise ValueError(resp.code)
-            return json.load(resp)
+        # decoded separately for every caller, so nobody gets a dict somebody else has been messing with.
+        return json.loads(self.get_raw(path))
+
+    def get_json_many(self, paths):
+        """get_json() for each of paths, pool_size at a time.  Returns a list in the same order as paths; if any of
+        them fails, that exception is raised (once the ones already under way have finished)."""
+        paths = list(paths)
+        if len(paths) <= 1:
+            return [self.get_json(path) for path in paths]
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(paths))) as executor:
+            return list(executor.map(self.get_json, paths))
 
     def get_raw(self, path):
-        self._client.request('GET', self._basepath+path, headers=self._default_headers)
-        with self._client.getresponse() as resp:
-            if resp.code != 200:
-                raise ValueError(resp.code)
-            return resp.read()
+        # through HTTP_CACHE, which answers from disk when it can and otherwise asks us (with If-None-Match etc.) via
+        # _get().  the cache is keyed on the URL alone, so it assumes default_headers don't change what comes back.
+        url = self._flight_key[0] + '://' + self._flight_key[1] + self._basepath + path
+        return FLIGHTS.do(self._flight_key + (self._basepath+path,),
+                          lambda: HTTP_CACHE.get(url, lambda _, headers: self._get(path, headers)))
 
+    def _get(self, path, headers={}):
+        return self._request('GET', path, headers=headers, retries=self.retries)
@@ -0,0 +1,179 @@
+"""
+An on-disk cache for the JSON (and other small things) we get from modpack APIs.
+
+Every time the pack browser opens, it asks Curse, Technic and ATLauncher for the same JSON it asked for last time, and
+almost all of it hasn't changed.  HTTP has had the answer to this since 1997: keep the response along with its ETag and
+Last-Modified, and next time ask for it with If-None-Match/If-Modified-Since.  If it hasn't changed, the server says
+304 and sends nothing else.  If the server says (with Cache-Control: max-age) that the response is good for a while,
+we don't even need to ask.  And some servers don't bother saying, so you can set a TTL per endpoint yourself
+(set_ttl()), which beats whatever the server said.
+
+If the network's down, you get the stale copy rather than an exception.  Better an hour-old pack list than none.
+
+Like LIMITER, there's one for the whole process, HTTP_CACHE, which does nothing until it's configured:
+
+    HTTP_CACHE.configure('~/.swordfish/http')
+    HTTP_CACHE.set_ttl('https://download.nodecdn.net/containers/atl/launcher/json/', 3600)
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from .singleflight import FLIGHTS
+from ..minefish import USER_AGENT
+
+
+def urllib_request(url, headers):
+    """The default way HTTPCache.get() makes requests.  Returns (status, headers, body)."""
+    request = urllib.request.Request(url, headers=dict({'User-Agent': USER_AGENT}, **headers))
+    try:
+        with urllib.request.urlopen(request) as resp:
+            return resp.status, resp.headers, resp.read()
+    except urllib.error.HTTPError as e:
+        # urllib thinks 304 is an error.  it isn't, and get() can decide about the rest.
+        with e:
+            return e.code, e.headers, b''
+
+
+def _max_age(cache_control):
+    """(max-age in seconds or None, whether we're allowed to store it at all) from a Cache-Control header."""
+    max_age, store = None, True
+    for directive in (cache_control or '').lower().split(','):
+        name, _, value = directive.strip().partition('=')
+        if name == 'no-store':
+            store = False
+        elif name == 'no-cache':
+            max_age = 0
+        elif name == 'max-age' and max_age is None:
+            try:
+                max_age = int(value.strip('"'))
+            except ValueError:
+                pass
+    return max_age, store
+
+
+class HTTPCache:
+    def __init__(self, directory=None, default_ttl=0):
+        """
+        :param directory: Where to keep responses.  None (the default) disables the cache: get() just makes the
+        request.
+        :param default_ttl: How many seconds a response is used without revalidating it, when the server doesn't say
+        and there's no override.  0 means always revalidate (which is still just a 304 if nothing's changed).
+        """
+        self._lock = threading.Lock()
+        self._ttls = {}
+        self.configure(directory, default_ttl)
+
+    def configure(self, directory, default_ttl=0):
+        self.directory = os.path.expanduser(directory) if directory is not None else None
+        self.default_ttl = default_ttl
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def set_ttl(self, url_prefix, seconds):
+        """Use responses from any URL starting with url_prefix for this many seconds before revalidating them,
+        whatever the server says.  A * in url_prefix stands for any one path segment, so '.../modpack/*/' is every
+        pack's builds but not the packs themselves.  The longest matching prefix wins."""
+        pattern = re.compile('[^/]+'.join(re.escape(part) for part in url_prefix.split('*')))
+        with self._lock:
+            self._ttls[url_prefix] = (pattern, seconds)
+
+    def _ttl(self, url, max_age):
+        with self._lock:
+            matches = [prefix for prefix, (pattern, _) in self._ttls.items() if pattern.match(url)]
+            if matches:
+                return self._ttls[max(matches, key=len)][1]
+        return max_age if max_age is not None else self.default_ttl
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + '.json'), os.path.join(self.directory, key + '.body')
+
+    def _load(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None, None
+        # two URLs with the same SHA-1 aren't going to happen, but it costs nothing to check.
+        if meta.get('url') != url:
+            return None, None
+        return meta, body
+
+    def _save(self, url, meta, body=None):
+        meta_path, body_path = self._paths(url)
+        # body first, then the metadata that says it's there.  a crash in between leaves metadata describing the old
+        # body, which _load() will happily read, and at worst we revalidate something we didn't need to.
+        if body is not None:
+            with open(body_path + '.tmp', 'wb') as f:
+                f.write(body)
+            os.replace(body_path + '.tmp', body_path)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def get(self, url, request=urllib_request):
+        """The body of url, from the cache if it's fresh, otherwise from the server (conditionally, if we have an old
+        copy).  Raises ValueError(status) if the server answers with anything other than 200 or 304.
+
+        :param request: Function that makes the request: request(url, headers) -> (status, headers, body).  The
+        response headers only need a .get().  Defaults to urllib; http_api.API passes its own connection.
+        """
+        if self.directory is None:
+            status, _, body = request(url, {})
+            if status != 200:
+                raise ValueError(status)
+            return body
+
+        meta, body = self._load(url)
+        now = time.time()
+        if meta is not None and now - meta['fetched_at'] < self._ttl(url, meta.get('max_age')):
+            return body
+
+        headers = {}
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        try:
+            status, resp_headers, new_body = request(url, headers)
+        except OSError:
+            if meta is None:
+                raise
+            # offline.  stale beats nothing.
+            return body
+
+        if status == 304 and meta is not None:
+            max_age, _ = _max_age(resp_headers.get('Cache-Control'))
+            meta['fetched_at'] = now
+            if max_age is not None:
+                meta['max_age'] = max_age
+            # a 304 may come with a new ETag; keep it.
+            meta['etag'] = resp_headers.get('ETag') or meta.get('etag')
+            self._save(url, meta)
+            return body
+        if status != 200:
+            raise ValueError(status)
+        max_age, store = _max_age(resp_headers.get('Cache-Control'))
+        if store:
+            self._save(url, {'url': url, 'fetched_at': now, 'max_age': max_age, 'etag': resp_headers.get('ETag'),
+                             'last_modified': resp_headers.get('Last-Modified')}, new_body)
+        return new_body
+
+    def get_json(self, url, request=urllib_request):
+        """get(), decoded.  Concurrent calls for the same URL share one request (see singleflight)."""
+        return json.loads(FLIGHTS.do(('cache', url), lambda: self.get(url, request)))
+
+
+# The one everybody uses.  Disabled until HTTP_CACHE.configure(directory) is called.
+HTTP_CACHE = HTTPCache()
@@ -0,0 +1,270 @@
+"""
+Updating a jar by downloading only the entries that changed since the version we already have.
+
+A point release of a mod rebuilds the jar, but most of what's in it -- the classes nobody touched, and especially the
+textures and sounds in a big content mod -- comes out byte for byte the same.  zipprobe gets us the new jar's central
+directory for a couple of small requests, and that tells us the (filename, size, CRC) of every entry, like the
+signatures in generate_cache and CurseModCache, plus where in the file each one lives.  Every entry that the old jar
+has too (same name, CRC, sizes, compression and flags, and the same number of bytes on disk) is copied straight out of
+the old jar, local header and all, with the new modification time patched in.  Everything else is fetched with
+multi-range requests (a few dozen ranges per request), and the central directory we already have goes on the end.
+
+None of that is guaranteed to come out bit-identical (two builds can compress the same bytes differently, or put a
+timestamp in an extra field), so patch_jar() won't even try without a SHA-1, MD5 or fingerprint to check the result
+against, and if the check fails it throws the patched jar away and downloads the whole thing instead.
+"""
+
+import bisect
+import collections
+import io
+import os
+import re
+import shutil
+import struct
+import urllib.request
+import zipfile
+
+from .verify import VerificationError, verify_file
+from .zipprobe import PROBER
+from ..minefish import USER_AGENT
+
+# Ranges closer together than this are fetched as one, since each part of a multipart response costs a hundred-odd
+# bytes of headers anyway.
+MERGE_GAP = 512
+# How many ranges to ask for in one request.  Apache refuses more than 200 by default; other servers are stingier.
+MAX_RANGES = 50
+_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+# Where the modification time and date are in a local header.
+_TIME_OFFSET = 10
+_CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+#: What patch_jar() did: bytes of the new jar copied from the old one, bytes downloaded, and the new jar's length.
+#: fetched is the whole length if it had to give up and download all of it.
+PatchStats = collections.namedtuple('PatchStats', ('reused', 'fetched', 'length'))
+
+
+def _dos_time(date_time):
+    year, month, day, hour, minute, second = date_time
+    return struct.pack('<2H', hour << 11 | minute << 5 | second // 2, (year - 1980) << 9 | month << 5 | day)
+
+
+def _key(info):
+    return info.filename, info.CRC, info.file_size, info.compress_size, info.compress_type, info.flag_bits
+
+
+def _regions(infos, offset, end):
+    """(start, end, info) for each entry in the file: from its local header to where the next one starts."""
+    infos = sorted(infos, key=lambda info: info.header_offset)
+    starts = [info.header_offset + offset for info in infos]
+    return list(zip(starts, starts[1:] + [end], infos))
+
+
+class DeltaPlan:
+    def __init__(self, length, cd_offset, reuse, fetch):
+        """Use plan_delta() rather than making one of these yourself."""
+        self.length = length
+        #: Where the tail (central directory onwards) goes.
+        self.cd_offset = cd_offset
+        #: (offset in new jar, offset in old jar, length, DOS time and date to patch in) for everything to copy.
+        self.reuse = reuse
+        #: (start, end) ranges of the new jar to download, end exclusive.
+        self.fetch = fetch
+
+    @property
+    def reused_bytes(self):
+        return sum(length for _, _, length, _ in self.reuse)
+
+    @property
+    def fetched_bytes(self):
+        return sum(end - start for start, end in self.fetch)
+
+
+def plan_delta(old_path, tail, merge_gap=MERGE_GAP):
+    """Work out which bits of the new jar can come out of the old one.
+
+    :param old_path: The jar we've got.
+    :param tail: zipprobe.ZipTail of the jar we want.  Must not be complete (there'd be nothing left to fetch).
+    """
+    with zipfile.ZipFile(old_path) as zf:
+        old = {}
+        for start, end, info in _regions(zf.infolist(), 0, zf.start_dir):
+            old[_key(info)] = (start, end - start)
+    with zipfile.ZipFile(io.BytesIO(tail.data)) as zf:
+        # zipfile puts the offsets relative to the start of what it was given, which is tail.offset into the file.
+        new = _regions(zf.infolist(), tail.offset, tail.offset)
+    reuse, fetch = [], []
+    position = 0
+    for start, end, info in new:
+        if start > position:
+            # something before the first entry (or between two): nothing to do with us, so fetch it.
+            fetch.append((position, start))
+        match = old.get(_key(info))
+        if match is not None and match[1] == end - start:
+            reuse.append((start, match[0], end - start, _dos_time(info.date_time)))
+        else:
+            fetch.append((start, end))
+        position = end
+    if position < tail.offset:
+        fetch.append((position, tail.offset))
+    merged = []
+    for start, end in fetch:
+        if merged and start - merged[-1][1] <= merge_gap:
+            merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    # anything a merge swallowed is fetched, not reused.
+    ends = [end for _, end in merged]
+    reuse = [piece for piece in reuse if not _inside(piece[0], merged, ends)]
+    return DeltaPlan(tail.length, tail.offset, reuse, merged)
+
+
+def _inside(offset, ranges, ends):
+    i = bisect.bisect_right(ends, offset)
+    return i < len(ranges) and ranges[i][0] <= offset
+
+
+def _write_at(fout, offset, fin, length):
+    fout.seek(offset)
+    _copy(fin, offset, length, lambda _, data: fout.write(data))
+
+
+def _copy(fin, offset, length, put):
+    end = offset + length
+    while offset < end:
+        data = fin.read(min(end - offset, 1024 * 1024))
+        if not data:
+            raise EOFError('response ended %d bytes early' % (end - offset))
+        put(offset, data)
+        offset += len(data)
+
+
+def range_header(ranges):
+    """The Range header asking for each of ranges, as (start, end) pairs with end exclusive."""
+    return 'bytes=' + ','.join('%d-%d' % (start, end - 1) for start, end in ranges)
+
+
+def read_byteranges(resp, put):
+    """Read a 206 response to a Range request, whether it's one range or a multipart/byteranges of several.
+
+    :param resp: The http.client.HTTPResponse.
+    :param put: Called with each chunk of the response body and where in the file it goes, in the order they come.
+    (Servers may merge ranges, so don't count on getting back the ones you asked for.)
+    """
+    if resp.headers.get_content_type() != 'multipart/byteranges':
+        # one range, or the server merged them into one.
+        start, end = _parse_content_range(resp.getheader('Content-Range'))
+        _copy(resp, start, end - start, put)
+        return
+    delimiter = b'--' + resp.headers.get_param('boundary').encode('latin-1')
+    while True:
+        line = resp.readline()
+        if not line:
+            raise EOFError('multipart response ended without a closing delimiter')
+        line = line.rstrip(b'\r\n')
+        if not line.startswith(delimiter):
+            continue
+        if line[len(delimiter):] == b'--':
+            # there might be an epilogue.  nobody cares what's in it.
+            resp.read()
+            return
+        content_range = None
+        while True:
+            line = resp.readline().rstrip(b'\r\n')
+            if not line:
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-range':
+                content_range = value.strip()
+        start, end = _parse_content_range(content_range)
+        _copy(resp, start, end - start, put)
+
+
+def fetch_ranges(url, ranges, fout, timeout=60):
+    """Download each of ranges of url into the same place in fout, in one request.
+
+    :param ranges: (start, end) pairs, end exclusive.
+    :return: True if the server sent the whole file instead (it doesn't do ranges, or not several at once), in which
+    case that's what's in fout now.
+    """
+    request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT, 'Range': range_header(ranges)})
+    with urllib.request.urlopen(request, timeout=timeout) as fin:
+        if fin.status == 200:
+            fout.seek(0)
+            fout.truncate()
+            shutil.copyfileobj(fin, fout)
+            return True
+        if fin.status != 206:
+            raise ValueError(fin.status)
+
+        def put(offset, data):
+            fout.seek(offset)
+            fout.write(data)
+        read_byteranges(fin, put)
+        return False
+
+
+def _parse_content_range(value):
+    match = _CONTENT_RANGE.fullmatch(value or '')
+    if not match:
+        raise ValueError('bad Content-Range: %r' % value)
+    return int(match.group(1)), int(match.group(2)) + 1
+
+
+def patch_jar(old_path, url, outpath, digests, tail=None, prober=PROBER, max_ranges=MAX_RANGES):
+    """Download the jar at url to outpath, reusing what we can of the one at old_path.  outpath may be old_path.
+
+    :param digests: What to check the result against, as for DownloadJob.add().  Must have a sha1, md5 or fingerprint.
+    :param tail: The new jar's zipprobe.ZipTail, if it's been probed already.
+    :return: PatchStats.
+    """
+    if not (digests.get('sha1') or digests.get('md5') or digests.get('fingerprint') is not None):
+        raise ValueError("nothing to check a patched jar against")
+    if tail is None:
+        tail = prober.probe([url])[url]
+    if isinstance(tail, Exception):
+        raise tail
+    part = outpath + '.part'
+    try:
+        with open(part, 'wb') as fout:
+            if tail.complete:
+                fout.write(tail.data)
+                stats = PatchStats(0, tail.length, tail.length)
+            else:
+                plan = plan_delta(old_path, tail)
+                fout.truncate(plan.length)
+                whole = False
+                for i in range(0, len(plan.fetch), max_ranges):
+                    whole = fetch_ranges(url, plan.fetch[i:i + max_ranges], fout)
+                    if whole:
+                        break
+                if whole:
+                    stats = PatchStats(0, plan.length, plan.length)
+                else:
+                    with open(old_path, 'rb') as fin:
+                        for new_offset, old_offset, length, dos_time in plan.reuse:
+                            fin.seek(old_offset)
+                            header = fin.read(_TIME_OFFSET + len(dos_time))
+                            if header[:4] != _LOCAL_HEADER_SIGNATURE:
+                                raise zipfile.BadZipFile('no local header at %d in %s' % (old_offset, old_path))
+                            fout.seek(new_offset)
+                            fout.write(header[:_TIME_OFFSET] + dos_time)
+                            _write_at(fout, new_offset + len(header), fin, length - len(header))
+                    fout.seek(plan.cd_offset)
+                    fout.write(tail.data)
+                    stats = PatchStats(plan.reused_bytes, plan.fetched_bytes, plan.length)
+        try:
+            verify_file(part, digests)
+        except VerificationError:
+            if not stats.reused:
+                raise
+            # the reused entries weren't quite the same after all.  the whole thing it is, then.
+            with open(part, 'wb') as fout, \
+                    urllib.request.urlopen(urllib.request.Request(url, headers={'User-Agent': USER_AGENT})) as fin:
+                shutil.copyfileobj(fin, fout)
+            verify_file(part, digests)
+            stats = PatchStats(0, tail.length, tail.length)
+        os.replace(part, outpath)
+        return stats
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
@@ -0,0 +1,142 @@
+"""
+A crash-safe record of what every .part file on disk actually is.
+
+Resuming a .part file by its length alone assumes two things: that every byte up to that length made it to the disk
+(not true if the launcher, or the machine, died mid-write), and that the file on the server is still the one we started
+downloading (not true if the modpack author pushed an update in the meantime).  Get either wrong, and you splice two
+files together and the result fails verification at best, or crashes Minecraft at worst.
+
+So for every file in flight, the journal keeps the URL it came from, the validator the server gave us for it (a strong
+ETag, or failing that Last-Modified), how long it's supposed to be, and how many bytes of it have been fsync()ed.  When
+we come back to the file, anything past that last number is thrown away, and we ask for the rest with If-Range, so if
+the file has changed, the server sends us the whole new one instead of the end of it.
+
+It's sqlite, like the mod cache, and is meant to live next to it.  Either give it the cache's sqlite file or its own.
+"""
+
+import collections
+import os
+import sqlite3
+import threading
+
+from .verify import VerificationError
+
+JournalEntry = collections.namedtuple('JournalEntry', 'url validator length verified')
+
+
+def response_validator(resp):
+    """The validator to resume this response's file with, or None if it didn't come with a usable one.  Weak ETags
+    (W/"...") aren't allowed in If-Range, so for those we fall back to Last-Modified."""
+    etag = resp.getheader('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return resp.getheader('Last-Modified')
+
+
+class ResumeJournal:
+    # How many bytes we write between fsync()s.  Lower means less to redownload after a crash, higher means less time
+    # waiting on the disk.
+    CHECKPOINT_INTERVAL = 8 * 1024 * 1024
+
+    def __init__(self, db):
+        """
+        :param db: Path to the sqlite database, or an open sqlite3.Connection (opened with check_same_thread=False if
+        more than one downloader thread is going to share the journal).
+        """
+        if not isinstance(db, sqlite3.Connection):
+            db = sqlite3.connect(db, check_same_thread=False)
+            # WAL survives the process dying mid-transaction without a rollback journal dance, and lets the GUI read
+            # while a downloader writes.
+            db.execute('pragma journal_mode=wal')
+        self.db = db
+        self._lock = threading.Lock()
+        # path -> offset of the last checkpoint, so checkpoint() can decide cheaply that it's not time yet.
+        self._last_checkpoint = {}
+        with self._lock, self.db:
+            self.db.execute('create table if not exists resume_journal('
+                            # where the finished file is going (the .part file is this plus '.part')
+                            'path text primary key,'
+                            # where it's coming from
+                            'url text not null,'
+                            # ETag or Last-Modified, as the server sent it.  null if it sent neither, in which case
+                            # there's no way to resume safely and we don't.
+                            'validator text,'
+                            # total length in bytes, if the server told us
+                            'length integer,'
+                            # how many bytes at the start of the .part file are known to be on the disk
+                            'verified integer not null)')
+
+    def lookup(self, path):
+        """The JournalEntry for path, or None."""
+        with self._lock:
+            row = self.db.execute('select url, validator, length, verified from resume_journal where path = ?',
+                                  (path,)).fetchone()
+        return JournalEntry(*row) if row else None
+
+    def resume(self, path, url, fout):
+        """Work out how much of a .part file to keep before requesting url into it again.
+
+        Truncates fout (the .part file, open for appending) to the last verified checkpoint if the journal has a
+        resumable entry for this path and URL, or to nothing if it doesn't.
+
+        :return: The validator to send as If-Range along with the Range header, or None if we're starting from scratch.
+        """
+        entry = self.lookup(path)
+        keep = 0
+        if entry is not None and entry.url == url and entry.validator:
+            # anything past the checkpoint might be garbage, or might not have made it to disk at all.
+            keep = min(entry.verified, os.fstat(fout.fileno()).st_size)
+        fout.truncate(keep)
+        fout.seek(keep)
+        if not keep:
+            self.forget(path)
+            return None
+        self._last_checkpoint[path] = keep
+        return entry.validator
+
+    def begin(self, path, url, resp, offset=0):
+        """Record a response we're about to start writing into path's .part file at offset.  For a 206, this checks
+        the response really is the rest of the file we started, and raises VerificationError if it isn't."""
+        length = resp.getheader('Content-Length')
+        length = int(length) + offset if length and length.isdigit() else None
+        validator = response_validator(resp)
+        if offset:
+            entry = self.lookup(path)
+            content_range = resp.getheader('Content-Range', '')
+            # bytes <first>-<last>/<total>
+            try:
+                first = int(content_range.split()[1].split('-')[0])
+                total = content_range.rpartition('/')[2]
+                total = None if total == '*' else int(total)
+            except (IndexError, ValueError):
+                first = total = None
+            if entry is None or first != offset or (entry.length and total and total != entry.length):
+                self.forget(path)
+                raise VerificationError('%s: server sent %r when resuming from byte %d of %s' %
+                                        (path, content_range, offset, entry.length if entry else '?'))
+            length = entry.length or total
+            validator = validator or entry.validator
+        with self._lock, self.db:
+            self.db.execute('insert or replace into resume_journal values (?, ?, ?, ?, ?)',
+                            (path, url, validator, length, offset))
+        self._last_checkpoint[path] = offset
+
+    def checkpoint(self, path, fout, offset, force=False):
+        """Note that the first offset bytes of path's .part file have been written.  Every CHECKPOINT_INTERVAL bytes
+        (or right away, with force) they're fsync()ed and the journal updated; before that, this does nothing, so it's
+        fine to call after every chunk.  The journal never claims more than has actually been synced."""
+        if not force and offset - self._last_checkpoint.get(path, 0) < self.CHECKPOINT_INTERVAL:
+            return
+        if fout.closed:
+            return
+        fout.flush()
+        os.fsync(fout.fileno())
+        with self._lock, self.db:
+            self.db.execute('update resume_journal set verified = ? where path = ?', (offset, path))
+        self._last_checkpoint[path] = offset
+
+    def forget(self, path):
+        """Done with path, one way or another."""
+        self._last_checkpoint.pop(path, None)
+        with self._lock, self.db:
+            self.db.execute('delete from resume_journal where path = ?', (path,))
@@ -0,0 +1,120 @@
+"""
+Picking which of several places to download a file from.
+
+Most mods can be had from more than one place: Curse serves every file from both media.forgecdn.net and
+edge.forgecdn.net, and ATLauncher's NodeCDN has copies of a lot of them, including plenty that their authors have
+since deleted from Curse (see the nodecdn_url column in cache.py).  MirrorStats remembers how each host has been
+doing -- how long it takes to answer, how fast it sends, and whether it's been failing lately -- and ranks the
+candidate URLs for a file so the fastest healthy one goes first.  AsyncDownloader does the rest: it asks hosts it knows
+nothing about yet with a HEAD request, and if the mirror it picked stalls or fails partway through, carries on from
+the same byte on the next one.
+"""
+
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+# How much each new measurement counts for against everything we'd measured before.
+_SMOOTHING = 0.3
+
+
+def mod_urls(cf_fileid=None, filename=None, nodecdn_url=None):
+    """Every URL a mod file can be downloaded from, given what the mods table in cache.py knows about it."""
+    urls = []
+    if cf_fileid and filename:
+        # Curse files live at /files/<file ID minus its last three digits>/<last three digits, no leading zeroes>/...
+        path = '/files/%d/%d/%s' % (cf_fileid // 1000, cf_fileid % 1000, urllib.parse.quote(filename))
+        urls.append('https://media.forgecdn.net' + path)
+        urls.append('https://edge.forgecdn.net' + path)
+    if nodecdn_url:
+        urls.append(nodecdn_url)
+    return urls
+
+
+def host_of(url):
+    return urllib.parse.urlsplit(url).netloc
+
+
+class MirrorStats:
+    """Per-host latency, throughput and health, optionally remembered between runs (as JSON, like RedirectCache)."""
+
+    # A host that fails is avoided for this many seconds, doubled for each failure in a row, up to MAX_BACKOFF.
+    BACKOFF = 60
+    MAX_BACKOFF = 3600
+    # What we assume about a host's throughput before we've downloaded anything from it, in bytes/second.
+    DEFAULT_THROUGHPUT = 1024 * 1024
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        # host -> {'latency': seconds, 'throughput': bytes/second, 'failures': failures in a row, 'failed_at': time}
+        self._hosts = {}
+        if path is not None:
+            try:
+                with open(path) as f:
+                    self._hosts = json.load(f)
+            except (FileNotFoundError, ValueError):
+                pass
+
+    def _host(self, host):
+        return self._hosts.setdefault(host, {'latency': None, 'throughput': None, 'failures': 0, 'failed_at': 0})
+
+    @staticmethod
+    def _smooth(old, new):
+        return new if old is None else old + _SMOOTHING * (new - old)
+
+    def known(self, host):
+        """Whether we've got a latency figure for host, i.e. whether it's worth probing."""
+        with self._lock:
+            return self._hosts.get(host, {}).get('latency') is not None
+
+    def record_latency(self, host, seconds):
+        with self._lock:
+            stats = self._host(host)
+            stats['latency'] = self._smooth(stats['latency'], seconds)
+
+    def record_transfer(self, host, nbytes, seconds):
+        """A download from host finished: nbytes in seconds.  Also clears its failure count."""
+        with self._lock:
+            stats = self._host(host)
+            if nbytes and seconds > 0:
+                stats['throughput'] = self._smooth(stats['throughput'], nbytes / seconds)
+            stats['failures'] = 0
+
+    def record_failure(self, host):
+        with self._lock:
+            stats = self._host(host)
+            stats['failures'] += 1
+            stats['failed_at'] = time.time()
+
+    def healthy(self, host):
+        with self._lock:
+            stats = self._hosts.get(host)
+            if not stats or not stats['failures']:
+                return True
+            backoff = min(self.MAX_BACKOFF, self.BACKOFF * 2 ** (stats['failures'] - 1))
+            return time.time() - stats['failed_at'] >= backoff
+
+    def score(self, host, size=None):
+        """Roughly how many seconds we'd expect a file of the given size to take from host.  Lower is better."""
+        with self._lock:
+            stats = self._hosts.get(host) or {}
+        latency = stats.get('latency') or 0.0
+        throughput = stats.get('throughput') or self.DEFAULT_THROUGHPUT
+        return latency + (size or 0) / throughput
+
+    def rank(self, urls, size=None):
+        """urls, best first.  Unhealthy hosts go to the back rather than being left out: if they're all we've got, a
+        host that might have recovered is better than nothing."""
+        return sorted(urls, key=lambda url: (not self.healthy(host_of(url)), self.score(host_of(url), size)))
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            data = json.dumps(self._hosts)
+        with open(self.path + '.tmp', 'w') as f:
+            f.write(data)
+        os.replace(self.path + '.tmp', self.path)
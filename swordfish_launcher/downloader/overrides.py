@@ -0,0 +1,111 @@
+"""
+Applying a modpack's overrides (configs, scripts, resource packs...) to an instance without rewriting all of them.
+
+A pack update usually changes a handful of the thousands of files under overrides/, but extracting the zip rewrites
+every one of them, and the ones the new version dropped are left lying around.  The zip already tells us the CRC-32
+and size of every file in it, though.  OverrideIndex remembers the CRC, size and mtime of every file it has put in the
+instance, so most of the time it can tell a file hasn't changed from a stat() alone; if the stat doesn't match (the user
+edited it, or it's the first time), it reads the file and works the CRC out.  StreamingUnzipper asks it about each
+member (see its index parameter) and skips the ones that match, and once the whole zip is through, finish() deletes
+whatever the last version of the pack put there that this version doesn't have.
+
+The index lives in the instance directory, in INDEX_NAME.
+"""
+
+import json
+import os
+import zlib
+
+INDEX_NAME = '.swordfish-overrides.json'
+# How coarse we assume file modification times might be.  FAT has 2 second mtimes.
+_RACY_NS = 2 * 10 ** 9
+
+
+def file_crc32(path, blocksize=1024 * 1024):
+    crc = 0
+    with open(path, 'rb') as f, memoryview(bytearray(blocksize)) as buffer:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                return crc
+            crc = zlib.crc32(buffer[:count], crc)
+
+
+class OverrideIndex:
+    def __init__(self, outputdir):
+        """
+        :param outputdir: The instance directory the overrides go in.
+        """
+        self.outputdir = outputdir
+        self.path = os.path.join(outputdir, INDEX_NAME)
+        # path relative to outputdir -> [size, mtime_ns, crc], for every file the last version of the pack put there.
+        self._files = {}
+        # when the index was last saved.  see unchanged().
+        self._saved_at = 0
+        try:
+            with open(self.path) as f:
+                self._files = json.load(f)
+                self._saved_at = os.fstat(f.fileno()).st_mtime_ns
+        except (FileNotFoundError, ValueError):
+            pass
+        # the files in the archive being applied now.
+        self._seen = set()
+        #: How many files unchanged() said could be skipped.
+        self.skipped = 0
+
+    def _key(self, path):
+        return os.path.relpath(path, self.outputdir).replace(os.path.sep, '/')
+
+    def unchanged(self, path, crc, size):
+        """Whether the file at path already has this CRC and size, i.e. whether extracting over it can be skipped.
+        Counts path as part of the archive being applied either way."""
+        key = self._key(path)
+        self._seen.add(key)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if st.st_size != size:
+            return False
+        entry = self._files.get(key)
+        # a file changed in the same tick as we recorded it would look untouched (git calls this "racily clean"), so
+        # the stat only counts for files that were last written a good while before the index was saved.
+        if entry is None or entry[0] != st.st_size or entry[1] != st.st_mtime_ns or \
+                entry[1] > self._saved_at - _RACY_NS:
+            # first time we've seen it, or somebody's been at it since.  only reading it will tell.
+            entry = self._files[key] = [st.st_size, st.st_mtime_ns, file_crc32(path)]
+        if entry[2] != crc:
+            return False
+        self.skipped += 1
+        return True
+
+    def record(self, path, crc, size):
+        """path has just been written with this CRC and size."""
+        key = self._key(path)
+        self._seen.add(key)
+        self._files[key] = [size, os.stat(path).st_mtime_ns, crc]
+
+    def finish(self):
+        """Delete every file the previous version put in the instance that isn't in this one, unless the user has
+        changed it since, then save the index.  Only call this once the whole archive has been applied.
+
+        :return: The paths that were deleted.
+        """
+        removed = []
+        for key in sorted(set(self._files) - self._seen):
+            size, mtime_ns, _ = self._files.pop(key)
+            path = os.path.join(self.outputdir, key.replace('/', os.path.sep))
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if st.st_size == size and st.st_mtime_ns == mtime_ns:
+                os.remove(path)
+                removed.append(path)
+        self.save()
+        return removed
+
+    def save(self):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self._files, f)
+        os.replace(self.path + '.tmp', self.path)
@@ -0,0 +1,221 @@
+"""
+HTTP/1.1 request pipelining on top of http.client.
+
+http.client.HTTPConnection will let you send exactly one request ahead of the response you're reading, and even that
+only works by accident: every HTTPResponse makes its own buffered file object around the socket, so if the server
+answers the second request quickly enough, the first response's buffer eats the start of the second response and
+everything goes sideways.  PipelinedConnection keeps one buffered reader for the lifetime of the socket and hands it
+to each HTTPResponse in turn, so any number of requests can be in flight at once.
+"""
+
+import collections
+import http.client
+import socket
+import ssl
+import threading
+
+# Errors that mean "the server hung up on us", as opposed to "the server said something we didn't like".
+_DISCONNECT_ERRORS = (http.client.RemoteDisconnected, http.client.IncompleteRead, http.client.BadStatusLine,
+                      ConnectionError, socket.timeout)
+
+
+class _NonClosingReader:
+    """HTTPResponse closes its file object once it has read the whole body.  We need ours to stay open for the next
+    response on the connection, so we don't let it.
+    """
+
+    def __init__(self, fp):
+        self._fp = fp
+
+    def close(self):
+        pass
+
+    def flush(self):
+        # HTTPResponse.close() flushes before closing, which blows up if the connection has been dropped under it.
+        pass
+
+    def __getattr__(self, item):
+        return getattr(self._fp, item)
+
+
+class _SharedReaderSocket:
+    """Stands in for the socket passed to HTTPResponse so that it uses our reader instead of making its own."""
+
+    def __init__(self, fp):
+        self._fp = fp
+
+    def makefile(self, mode):
+        return _NonClosingReader(self._fp)
+
+
+class PipelinedConnection:
+    """A keep-alive connection to one host with up to `depth` requests outstanding at once.
+
+    Requests are sent with send_request() and their responses collected, strictly in order, with get_response().  If
+    the server closes the connection with requests still unanswered -- which servers are allowed to do at any time,
+    and which a lot of them do after some fixed number of requests -- the connection is reopened and the unanswered
+    requests sent again, without the caller needing to know.  This is safe because we only ever pipeline GETs.
+    """
+
+    def __init__(self, host, port=None, depth=8, https=True, timeout=60, max_replays=3):
+        """
+        :param host: Hostname of the server.
+        :param port: Port to connect to, if not the default for the scheme.
+        :param depth: Maximum number of requests that may be awaiting a response at once.  1 disables pipelining.
+        :param timeout: Socket timeout in seconds.
+        :param max_replays: How many times in a row we'll reconnect and replay without getting a single response
+        before concluding that it's not the keep-alive timeout, it's us, and giving up.
+        """
+        self.host = host
+        self.port = port or (443 if https else 80)
+        self.https = https
+        self.depth = max(1, depth)
+        self.timeout = timeout
+        self.max_replays = max_replays
+        self._sock = None
+        self._fp = None
+        # (method, path, headers, token) for every request we've sent that we haven't started reading a response for.
+        self._unanswered = collections.deque()
+        self._current = None  # the HTTPResponse whose body is being read.
+        self._reconnect_before_next = False
+
+    @property
+    def outstanding(self):
+        return len(self._unanswered)
+
+    def can_send(self):
+        return len(self._unanswered) < self.depth
+
+    def connect(self):
+        self.close()
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        if self.https:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+        self._sock = sock
+        self._fp = sock.makefile('rb')
+        self._reconnect_before_next = False
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        self._current = None
+
+    def _format_request(self, method, path, headers):
+        lines = ['%s %s HTTP/1.1' % (method, path),
+                 'Host: ' + (self.host if self.port in (80, 443) else '%s:%d' % (self.host, self.port)),
+                 'Accept-Encoding: identity']
+        lines.extend('%s: %s' % item for item in headers.items())
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    def send_request(self, method, path, headers=None, token=None):
+        """Send a request without waiting for the response.
+
+        :param token: Anything you like.  Handed back alongside the matching response by get_response(), which saves
+        the caller having to keep its own queue in step with ours.
+        """
+        if not self.can_send():
+            raise http.client.CannotSendRequest('%d requests already in flight' % len(self._unanswered))
+        headers = headers or {}
+        self._unanswered.append((method, path, headers, token))
+        if self._sock is None or self._reconnect_before_next:
+            # get_response() will reconnect and send everything in _unanswered.
+            return
+        try:
+            self._sock.sendall(self._format_request(method, path, headers))
+        except OSError:
+            self._reconnect_before_next = True
+
+    def abort_response(self):
+        """Give up on the body of the response currently being read.  Since the rest of it is still sitting in the
+        socket ahead of the next response, the only way to do that is to drop the connection; anything still unanswered
+        gets replayed on a new one.
+        """
+        self._current = None
+        self._reconnect_before_next = True
+
+    def abort_all(self):
+        """Drop the connection along with every request still waiting for a response, and return their tokens, oldest
+        first.  Used when something more important has come along and we don't want to sit through the rest of the
+        pipeline before getting to it.
+        """
+        tokens = [token for _, _, _, token in self._unanswered]
+        self._unanswered.clear()
+        self.close()
+        return tokens
+
+    def _replay(self):
+        self.connect()
+        self._sock.sendall(b''.join(self._format_request(method, path, headers)
+                                    for method, path, headers, _ in self._unanswered))
+
+    def get_response(self):
+        """Return a 2-tuple of the token passed to send_request() and the http.client.HTTPResponse for the oldest
+        unanswered request.  The previous response's body must have been read to the end (or abort_response() called)
+        before calling this.
+        """
+        if not self._unanswered:
+            raise http.client.ResponseNotReady('no requests in flight')
+        if self._current is not None:
+            if not self._current.isclosed():
+                raise http.client.ResponseNotReady('previous response not read to completion')
+            if self._current.will_close:
+                self._reconnect_before_next = True
+            self._current = None
+        attempts = 0
+        while True:
+            try:
+                if self._sock is None or self._reconnect_before_next:
+                    self._replay()
+                method, path, headers, token = self._unanswered[0]
+                resp = http.client.HTTPResponse(_SharedReaderSocket(self._fp), method=method)
+                resp.begin()
+            except _DISCONNECT_ERRORS:
+                # The server closed the connection before answering.  Nothing has been read for this request yet,
+                # so it's safe to send it (and everything queued behind it) again.
+                attempts += 1
+                if attempts > self.max_replays:
+                    self.close()
+                    raise
+                self._reconnect_before_next = True
+                continue
+            self._unanswered.popleft()
+            self._current = resp
+            return token, resp
+
+
+class ConnectionPool:
+    """Idle PipelinedConnections, by (scheme, host, port) as aio.split_url() gives it, kept for whoever wants one
+    next.  Thread safe; the connections themselves aren't, so each one belongs to whoever took it until it's put back.
+    """
+
+    def __init__(self, depth=8, timeout=60):
+        """
+        :param depth: How many requests the connections it makes may have in flight at once.
+        """
+        self.depth = depth
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = collections.defaultdict(list)
+
+    def get(self, key):
+        with self._lock:
+            if self._idle[key]:
+                return self._idle[key].pop()
+        scheme, host, port = key
+        return PipelinedConnection(host, port, depth=self.depth, https=scheme == 'https', timeout=self.timeout)
+
+    def put(self, key, conn):
+        """Hand a connection back.  Anything it still has in flight had better be meant for the next user."""
+        with self._lock:
+            self._idle[key].append(conn)
+
+    def close(self):
+        with self._lock:
+            for connections in self._idle.values():
+                for conn in connections:
+                    conn.close()
+            self._idle.clear()
@@ -0,0 +1,87 @@
+"""
+Process-wide bandwidth shaping.
+
+Every downloader in the process -- the threaded Downloader, the asyncio engine, and the SwordfishPDS leftovers in
+_sfpds -- reports each chunk it receives to LIMITER, which tells it how long to sleep before reading the next one.
+Sleeping on a socket makes the kernel's receive window fill up, which makes the sender slow down, so this throttles
+the actual traffic on the link and not just how fast we write it to disk.
+
+Bandwidth is shared between consumers (usually DownloadJobs) in proportion to their weights, among whichever consumers
+have been active recently.  A consumer can also be given a max_share, a hard ceiling as a fraction of the cap, for
+the "background pack update gets no more than 30% of the link, ever" case.  If no cap is configured (the default),
+nothing is throttled at all.
+"""
+
+import threading
+import time
+
+# Consumers that haven't downloaded anything in this many seconds stop counting towards the total weight.
+IDLE_TIMEOUT = 1.0
+
+
+class BandwidthLimiter:
+    def __init__(self, cap=None, burst=0.25, clock=time.monotonic):
+        """
+        :param cap: Maximum total download rate, in bytes per second, or None for no limit.
+        :param burst: How many seconds' worth of bandwidth a consumer is allowed to "save up" while idle and then use
+        all at once.  Keeps small files from being throttled at all on a mostly idle link.
+        :param clock: Where the time comes from, in seconds.  For the tests, which would rather not sit there waiting.
+        """
+        self.cap = cap
+        self.burst = burst
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._consumers = {}  # consumer -> (weight, time last seen)
+        self._consumer_next = {}  # consumer -> earliest time its next byte is due
+        self._global_next = 0.0
+
+    def configure(self, cap):
+        """Change the cap.  Takes effect from the next chunk."""
+        with self._lock:
+            self.cap = cap
+            self._consumer_next.clear()
+            self._global_next = 0.0
+
+    def reserve(self, nbytes, consumer=None, weight=1.0, max_share=None):
+        """Account for nbytes just received by consumer, and return how many seconds the caller should wait before
+        reading any more.  Use this from asyncio code (await asyncio.sleep(...)); threads can just call throttle().
+
+        :param consumer: Anything hashable identifying who's downloading.  Weights are shared out per consumer.
+        :param weight: This consumer's share of the bandwidth relative to every other active consumer.
+        :param max_share: If not None, this consumer never gets more than this fraction of the cap, even when nobody
+        else wants the bandwidth.
+        """
+        if self.cap is None or nbytes <= 0:
+            return 0.0
+        with self._lock:
+            cap = self.cap
+            if cap is None:
+                return 0.0
+            now = self.clock()
+            self._consumers[consumer] = (weight, now)
+            total_weight = 0.0
+            for key, (other_weight, last_seen) in list(self._consumers.items()):
+                if now - last_seen > IDLE_TIMEOUT:
+                    del self._consumers[key]
+                    self._consumer_next.pop(key, None)
+                else:
+                    total_weight += other_weight
+            rate = cap * weight / total_weight if total_weight > 0 else cap
+            if max_share is not None:
+                rate = min(rate, cap * max_share)
+            # Each bucket is kept as the time at which it will next have room for a byte, which can lag up to
+            # `burst` seconds behind the present (that's the saved-up allowance).
+            start = max(self._consumer_next.get(consumer, 0.0), now - self.burst)
+            consumer_next = self._consumer_next[consumer] = start + nbytes / rate
+            global_next = self._global_next = max(self._global_next, now - self.burst) + nbytes / cap
+            return max(0.0, consumer_next - now, global_next - now)
+
+    def throttle(self, nbytes, consumer=None, weight=1.0, max_share=None):
+        """As reserve(), but sleeps for however long it says."""
+        delay = self.reserve(nbytes, consumer, weight, max_share)
+        if delay:
+            time.sleep(delay)
+
+
+# The one everybody uses.  LIMITER.configure(bytes_per_second) to turn it on.
+LIMITER = BandwidthLimiter()
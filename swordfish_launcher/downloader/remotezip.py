@@ -0,0 +1,250 @@
+"""
+Reading things out of a zip file (well, a jar) on a server without downloading the rest of it.
+
+To find out what a mod is -- its mcmod.info, fabric.mod.json or META-INF/mods.toml -- we've always had to download the
+whole jar, when what we want is a kilobyte or two out of the middle of it.  zipprobe already gets us the central
+directory for a couple of tiny requests; from there, each entry lives between its local header and the next entry's,
+so a Range request for exactly that span gets everything zipfile needs to read it.
+
+RemoteFile is a read-only, seekable file object over a URL that does just that: it starts out knowing the tail from the
+probe, and whenever it's asked for bytes it hasn't got, it fetches the whole entry they're in (one request, on a
+connection borrowed from the probe's pool).  Anything that takes a file object -- zipfile.ZipFile, and so
+moddb.metadata_extractor.extract_metadata -- can read from it.  RemoteZipFile is a zipfile.ZipFile over one, with
+prefetch() to get a list of entries in one multi-range request rather than one request each.  read_members() does the
+lot for a whole list of jars at once.
+"""
+
+import bisect
+import io
+import tempfile
+import urllib.parse
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .aio import split_url
+from .jardelta import MAX_RANGES, MERGE_GAP, range_header, read_byteranges
+from .zipprobe import MAX_REDIRECTS, PROBER, REDIRECTS
+from ..minefish import USER_AGENT
+
+#: What read_members() looks for by default: the metadata files of Forge (old and new) and Fabric mods.
+METADATA_NAMES = ('mcmod.info', 'META-INF/mods.toml', 'fabric.mod.json')
+# Fetched bytes stay in memory up to this much per file, then go to a temporary file.
+SPOOL_SIZE = 1024 * 1024
+# Without boundaries to go by (see RemoteFile.set_boundaries()), a miss fetches at least this much.
+READ_AHEAD = 64 * 1024
+
+
+class RemoteFile(io.RawIOBase):
+    """A file on a server, read with Range requests.  Made for zip files, but it'll do for anything."""
+
+    def __init__(self, url, tail=None, prober=PROBER):
+        """
+        :param tail: The file's zipprobe.ZipTail, if it's been probed already.  Otherwise it's probed now.
+        :param prober: The ZipProber to probe with, and whose connections to use.
+        """
+        super().__init__()
+        if tail is None:
+            tail = prober.probe([url])[url]
+        if isinstance(tail, Exception):
+            raise tail
+        self.url = url
+        self.length = tail.length
+        self.pool = prober.pool
+        #: How many bytes have been fetched after the probe, and in how many requests.
+        self.fetched = 0
+        self.requests = 0
+        self._store = tempfile.SpooledTemporaryFile(SPOOL_SIZE)
+        # sorted, non-overlapping (start, end) spans of the file that are in _store, end exclusive.
+        self._have = []
+        # sorted starts of the spans a miss is rounded out to (see set_boundaries()).
+        self._boundaries = None
+        self._position = 0
+        self._put(tail.offset, tail.data)
+
+    def set_boundaries(self, offsets):
+        """Tell the file where its natural pieces start (a zip's entries), so that reading any part of one fetches all
+        of it."""
+        self._boundaries = sorted(set(offsets) | {0})
+
+    # the bits of the file object interface zipfile uses.
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.length
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer):
+        start = min(self._position, self.length)
+        end = min(start + len(buffer), self.length)
+        if start == end:
+            return 0
+        if self.missing(start, end):
+            if self._boundaries is None:
+                first, last = start, min(self.length, max(end, start + READ_AHEAD))
+            else:
+                first = self._boundaries[bisect.bisect_right(self._boundaries, start) - 1]
+                i = bisect.bisect_left(self._boundaries, end)
+                last = self._boundaries[i] if i < len(self._boundaries) else self.length
+            self.fetch([(first, last)])
+        self._store.seek(start)
+        # (SpooledTemporaryFile only has readinto() from 3.11.)
+        data = self._store.read(end - start)
+        count = len(data)
+        memoryview(buffer)[:count] = data
+        self._position = start + count
+        return count
+
+    def close(self):
+        self._store.close()
+        super().close()
+
+    def missing(self, start, end):
+        """The spans of start to end (exclusive) we haven't got yet."""
+        spans = []
+        for have_start, have_end in self._have[max(0, bisect.bisect_right(self._have, (start,)) - 1):]:
+            if have_start >= end:
+                break
+            if have_start > start:
+                spans.append((start, have_start))
+            start = max(start, have_end)
+        if start < end:
+            spans.append((start, end))
+        return spans
+
+    def fetch(self, spans):
+        """Make sure we have every one of spans, (start, end) with end exclusive, fetching whatever we haven't got with
+        as few requests as we can."""
+        wanted = []
+        for span in sorted(spans):
+            for start, end in self.missing(*span):
+                if wanted and start - wanted[-1][1] <= MERGE_GAP:
+                    wanted[-1] = (wanted[-1][0], max(end, wanted[-1][1]))
+                else:
+                    wanted.append((start, end))
+        for i in range(0, len(wanted), MAX_RANGES):
+            self._request(wanted[i:i + MAX_RANGES])
+
+    def _put(self, offset, data):
+        self._store.seek(offset)
+        self._store.write(data)
+        end = offset + len(data)
+        # merge (offset, end) into _have.
+        i = bisect.bisect_left(self._have, (offset,))
+        if i and self._have[i - 1][1] >= offset:
+            i -= 1
+            offset = self._have[i][0]
+        j = i
+        while j < len(self._have) and self._have[j][0] <= end:
+            end = max(end, self._have[j][1])
+            j += 1
+        self._have[i:j] = [(offset, end)]
+
+    def _fetched(self, offset, data):
+        self.fetched += len(data)
+        self._put(offset, data)
+
+    def _request(self, spans):
+        for _ in range(MAX_REDIRECTS + 1):
+            key, path = split_url(self.url)
+            conn = self.pool.get(key)
+            try:
+                conn.send_request('GET', path, {'User-Agent': USER_AGENT, 'Range': range_header(spans)})
+                _, resp = conn.get_response()
+                self.requests += 1
+                if resp.status in REDIRECTS:
+                    resp.read()
+                    self.url = urllib.parse.urljoin(self.url, resp.getheader('Location'))
+                    continue
+                if resp.status == 200:
+                    # no ranges here.  we've got the whole thing now, at least.
+                    offset = 0
+                    while True:
+                        data = resp.read(1024 * 1024)
+                        if not data:
+                            break
+                        self._fetched(offset, data)
+                        offset += len(data)
+                elif resp.status == 206:
+                    read_byteranges(resp, self._fetched)
+                else:
+                    resp.read()
+                    raise ValueError(resp.status)
+                return
+            except Exception:
+                # whatever was half read is still in the socket.  the next user gets a fresh connection.
+                conn.abort_all()
+                raise
+            finally:
+                self.pool.put(key, conn)
+        raise ValueError('too many redirects from %s' % self.url)
+
+
+class RemoteZipFile(zipfile.ZipFile):
+    """A zipfile.ZipFile of a zip file on a server, which only downloads the entries that are read."""
+    remote = None
+
+    def __init__(self, url, tail=None, prober=PROBER):
+        """
+        :param tail: The file's zipprobe.ZipTail, if it's been probed already.
+        """
+        self.remote = RemoteFile(url, tail, prober)
+        try:
+            super().__init__(self.remote)
+        except Exception:
+            self.remote.close()
+            raise
+        self.remote.set_boundaries([info.header_offset for info in self.infolist()] + [self.start_dir])
+
+    def _span(self, name):
+        info = self.getinfo(name)
+        boundaries = self.remote._boundaries
+        return info.header_offset, boundaries[bisect.bisect_right(boundaries, info.header_offset)]
+
+    def prefetch(self, names):
+        """Fetch every one of names (that we haven't already got) at once, so that reading them doesn't cost a request
+        each.  Entries that are next to each other come in the same range."""
+        self.remote.fetch(self._span(name) for name in names)
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            if self.remote is not None:
+                self.remote.close()
+
+
+def read_members(urls, names=METADATA_NAMES, prober=PROBER, max_workers=8):
+    """Read the entries called names out of each of the zip files at urls, as far as they have them.
+
+    The central directories are probed in one go (see zipprobe), and then each file's entries are fetched with one
+    request (at most) per file, a few files at a time.
+
+    :return: dict of url -> {name: contents}, or url -> the exception that stopped us.
+    """
+    urls = list(dict.fromkeys(urls))
+    tails = prober.probe(urls)
+
+    def read(url):
+        try:
+            with RemoteZipFile(url, tails[url], prober) as zf:
+                present = [name for name in names if name in zf.NameToInfo]
+                zf.prefetch(present)
+                return {name: zf.read(name) for name in present}
+        except Exception as e:
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(urls, executor.map(read, urls)))
@@ -0,0 +1,81 @@
+"""
+Priority scheduling for DownloadJobs.
+
+The Downloader used to keep a dict mapping priorities to lists of jobs and call max() on it every time it wanted a new
+job.  This replaces that with a heap.  Jobs are ordered by priority, then by how long they've been waiting; the
+waiting time also slowly counts *towards* their priority, so that a steady trickle of high priority jobs can't starve
+a low priority one forever.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class JobScheduler:
+    """A thread-safe priority queue of DownloadJobs with aging.
+
+    A job's effective priority is job.priority + aging_rate * (seconds since it was first enqueued).  Every waiting job
+    ages at the same rate, so the order of the heap never changes as time passes and we never have to re-sort it: the
+    job with the highest effective priority is always the one with the highest job.priority - aging_rate * enqueue_time.
+    """
+
+    def __init__(self, aging_rate=1 / 60):
+        """
+        :param aging_rate: How many priority points a job gains per second spent waiting.  The default means a job
+        that has been waiting ten minutes beats a job one priority higher that has just arrived.  0 disables aging.
+        """
+        self.aging_rate = aging_rate
+        self._heap = []
+        self._counter = itertools.count()  # tiebreaker, so we never compare two jobs directly.
+        self._queued = set()
+        self._enqueued_at = {}
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, job):
+        """Add a job to the queue, or put a preempted job back.  A job that's put back keeps the age it had built up
+        before, so being preempted doesn't send it to the back of the line.  No-op if the job is already queued.
+        """
+        with self._condition:
+            if job in self._queued:
+                return
+            enqueued_at = self._enqueued_at.setdefault(job, time.monotonic())
+            heapq.heappush(self._heap, (self.aging_rate * enqueued_at - job.priority, next(self._counter), job))
+            self._queued.add(job)
+            self._condition.notify()
+
+    def pop(self, block=True):
+        """Remove and return the job with the highest effective priority.  If the queue is empty, wait for one to be
+        pushed if block is True, otherwise (or if the scheduler has been closed) return None.
+        """
+        with self._condition:
+            while not self._heap:
+                if not block or self._closed:
+                    return None
+                self._condition.wait()
+            _, _, job = heapq.heappop(self._heap)
+            self._queued.discard(job)
+            return job
+
+    def forget(self, job):
+        """Call once a job is finished with, so that we don't hold on to it forever."""
+        with self._condition:
+            self._enqueued_at.pop(job, None)
+
+    def effective_priority(self, job):
+        """The priority job would be compared at if it were in the queue right now."""
+        enqueued_at = self._enqueued_at.get(job)
+        if enqueued_at is None:
+            return job.priority
+        return job.priority + self.aging_rate * (time.monotonic() - enqueued_at)
+
+    def close(self):
+        """Wake up anything blocked in pop() and make it return None."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
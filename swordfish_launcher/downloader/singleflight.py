@@ -0,0 +1,58 @@
+"""
+Asking the server for something once, no matter how many threads want it at the same time.
+
+The icon loader and a pack install both want /addon/1234 at the same moment; two instances being installed side by
+side both want the same Forge version JSON.  SingleFlight lets the first caller make the request and everyone who asks
+for the same thing while it's in flight wait for that one request and share its result (or its exception).  Nothing
+is cached: the moment the request finishes, the next caller makes a fresh one.  For caching, see the blob store.
+
+The threaded Downloader does the same for whole files, but since that all happens on its own thread it keeps track of
+that itself (see Downloader._followers).
+"""
+
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, function):
+        """Return function(), unless another thread is already in the middle of a call with the same key, in which
+        case wait for that one to finish and return what it returned (or raise what it raised).
+
+        Every waiter gets the same object, so don't give this a function that returns something mutable unless you
+        don't mind them sharing it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+# Shared by every http_api.API in the process, so that two API objects for the same server dedupe too.
+FLIGHTS = SingleFlight()
@@ -0,0 +1,422 @@
+"""
+Extracting zip files while they're still downloading.
+
+The old way of installing a modpack was to download the whole zip to a temporary file, then open it with zipfile and
+extract it, which for a 500MB pack means sitting through the download and then sitting through the extraction.  But a
+zip file doesn't actually have to be read from the end: every member is preceded by a local file header saying what
+it's called, how it's compressed and (usually) how big it is, so we can pick the members off one at a time as the bytes
+go past, and by the time the last byte arrives, everything but the last member is already on disk.
+
+The catch is "usually".  An entry written with a data descriptor (general purpose flag bit 3) has zeroes where its
+sizes should be, and the real ones come *after* the data.  For deflated entries that's fine, since a deflate stream
+knows where it ends.  For stored ones (and for compression methods we don't handle ourselves) there's no way to tell
+where the data stops short of the central directory at the very end of the archive.  So when we meet one of those, we
+stop streaming and spool everything from that entry onwards to a temporary file, and finish() extracts the rest from
+there once the central directory has arrived.
+
+Every member is written to a temporary file next to where it's going and renamed into place once its CRC checks out, so
+an instance never has half a config file in it.  And given an overrides.OverrideIndex, members the instance already has
+an identical copy of aren't written at all.
+"""
+
+import os
+import struct
+import tempfile
+import zipfile
+import zlib
+
+_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+_LOCAL_SIGNATURE = b'PK\x03\x04'
+# Anything else that can follow the last member: the central directory, a zip64 end of central directory record, the
+# end of central directory record itself (for an empty archive), and the archive extra data record.
+_TAIL_SIGNATURES = (b'PK\x01\x02', b'PK\x06\x06', b'PK\x05\x06', b'PK\x06\x08')
+_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+
+_FLAG_ENCRYPTED = 0x1
+_FLAG_DATA_DESCRIPTOR = 0x8
+_FLAG_UTF8 = 0x800
+
+# States
+_HEADER, _DATA, _DESCRIPTOR, _TAIL, _SPOOL = range(5)
+
+
+def member_path(outputdir, arcname):
+    """Where a member called arcname belongs under outputdir, with the path made safe the way zipfile does it."""
+
+    ### THIS PORTION COPY PASTED FROM zipfile.py ###
+
+    # build the destination pathname, replacing
+    # forward slashes to platform specific separators.
+    if os.path.sep != '/':
+        arcname = arcname.replace('/', os.path.sep)
+
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    # interpret absolute pathname as relative, remove drive letter or
+    # UNC path, redundant separators, "." and ".." components.
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid_path_parts = ('', os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(x for x in arcname.split(os.path.sep)
+                               if x not in invalid_path_parts)
+    if os.path.sep == '\\':
+        # filter illegal characters on Windows
+        arcname = zipfile.ZipFile._sanitize_windows_name(arcname, os.path.sep)
+
+    targetpath = os.path.join(outputdir, arcname)
+    targetpath = os.path.normpath(targetpath)
+
+    ### END COPY PASTE FROM zipfile.py ###
+
+    return targetpath
+
+
+class _Member:
+    """The member we're currently in the middle of."""
+
+    def __init__(self, name, flags, method, crc, compress_size, file_size, zip64):
+        self.name = name
+        self.flags = flags
+        self.method = method
+        self.expected_crc = crc
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.zip64 = zip64
+        # A deflate stream ends itself, so for deflated entries with a data descriptor we just feed it bytes until it
+        # says it's done.  Everything else counts down the compressed size from the local header.
+        self.until_eof = bool(flags & _FLAG_DATA_DESCRIPTOR) and method == zipfile.ZIP_DEFLATED
+        self.remaining = compress_size
+        self.decompressor = zlib.decompressobj(-15) if method == zipfile.ZIP_DEFLATED else None
+        self.crc = 0
+        self.length = 0
+        self.fout = None
+        self.kept = None
+        self.path = None
+        # set if the index said the file on disk is already this member, in which case we just skip over its data.
+        self.skip = False
+
+    def output(self, data):
+        if not data:
+            return
+        self.crc = zlib.crc32(data, self.crc)
+        self.length += len(data)
+        if self.fout is not None:
+            self.fout.write(data)
+        if self.kept is not None:
+            self.kept += data
+
+    def close(self):
+        if self.fout is not None:
+            self.fout.close()
+            self.fout = None
+
+    def discard(self):
+        """Close and delete the half-written member."""
+        if self.fout is not None:
+            self.close()
+            os.remove(self.path + '.tmp')
+
+
+class StreamingUnzipper:
+    """A write-only file object that extracts the zip file written to it.
+
+    Hand it to anything that copies a response into a file object (shutil.copyfileobj, downloader.download(), or just
+    DownloadJob.add() in place of an output path) and call finish() once the last byte is in.  finish() is where the
+    members that couldn't be streamed get extracted, and where a truncated archive gets noticed, so don't skip it.
+    """
+
+    def __init__(self, outputdir, subdir='', keep=(), progress=None, index=None):
+        """
+        :param outputdir: Directory to extract into.
+        :param subdir: If given, only members under this directory are extracted, relative to it.  ('overrides/' for
+        a Curse modpack.)
+        :param keep: Names of members to hold on to in memory (see .kept), whether or not they're under subdir.  For
+        manifests and the like, which we want to read but have no need to write out.
+        :param progress: Optional callable, called with the uncompressed size of each member as it finishes.
+        :param index: Optional overrides.OverrideIndex for outputdir.  Members it says are already there are skipped,
+        and everything else that's extracted is recorded in it.  Call its finish() after this object's.
+        """
+        if subdir and not subdir.endswith('/'):
+            subdir += '/'
+        self.outputdir = outputdir
+        self.subdir = subdir
+        self.keep = frozenset(keep)
+        self.progress = progress
+        self.index = index
+        self.reset()
+
+    def reset(self):
+        """Forget everything and start again from the first byte, e.g. because the download had to be restarted.
+        Members that were already extracted will simply be extracted again over the top."""
+        if getattr(self, '_member', None) is not None:
+            self._member.discard()
+        if getattr(self, '_spool', None) is not None:
+            self._spool.close()
+        self._buffer = bytearray()
+        self._state = _HEADER
+        self._member = None
+        self._spool = None
+        # Offset in the archive of the first byte in self._buffer, and of the first byte in the spool.
+        self._offset = 0
+        self._spool_offset = None
+        self.closed = False
+        #: Paths of the members that have been extracted, in the order they were extracted in.
+        self.extracted = []
+        #: Contents of the members named in `keep`, by name.
+        self.kept = {}
+
+    # Enough of the file object interface for download() and shutil.copyfileobj().
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def tell(self):
+        return self._offset + len(self._buffer) + (self._spool.tell() if self._spool else 0)
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed StreamingUnzipper')
+        if self._state == _SPOOL:
+            self._spool.write(data)
+        elif self._state != _TAIL:
+            self._buffer += data
+            self._process()
+        else:
+            # the central directory.  we don't need it unless we're spooling, and then we're in the branch above.
+            self._offset += len(data)
+        return len(data)
+
+    def finish(self):
+        """Call once the whole archive has been written.  Extracts whatever couldn't be extracted on the fly, and
+        raises zipfile.BadZipFile if the archive was cut short or anything in it was corrupt."""
+        try:
+            if self._state == _SPOOL:
+                self._finish_from_central_directory()
+            elif self._state != _TAIL:
+                raise zipfile.BadZipFile('archive ended in the middle of %s' %
+                                         (self._member.name if self._member else 'a local header'))
+        finally:
+            self.close()
+
+    def close(self):
+        """Throw away any partial state.  Doesn't finish anything; that's finish()."""
+        if self._member is not None:
+            self._member.discard()
+            self._member = None
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _consume(self, count):
+        data = bytes(self._buffer[:count])
+        del self._buffer[:count]
+        self._offset += count
+        return data
+
+    def _process(self):
+        while True:
+            if self._state == _HEADER:
+                if not self._read_header():
+                    return
+            elif self._state == _DATA:
+                if not self._read_data():
+                    return
+            elif self._state == _DESCRIPTOR:
+                if not self._read_descriptor():
+                    return
+            elif self._state == _TAIL:
+                self._offset += len(self._buffer)
+                self._buffer.clear()
+                return
+            else:
+                # we just switched to spooling.  whatever's left in the buffer is the start of the spool.
+                self._spool.write(self._buffer)
+                self._buffer.clear()
+                return
+
+    def _read_header(self):
+        buffer = self._buffer
+        if len(buffer) < 4:
+            return False
+        signature = bytes(buffer[:4])
+        if signature in _TAIL_SIGNATURES:
+            self._state = _TAIL
+            return True
+        if signature != _LOCAL_SIGNATURE:
+            raise zipfile.BadZipFile('bad local file header signature %r at offset %d' % (signature, self._offset))
+        if len(buffer) < _LOCAL_HEADER.size:
+            return False
+        (_, _, flags, method, _, _, crc, compress_size, file_size, name_length,
+         extra_length) = _LOCAL_HEADER.unpack_from(buffer)
+        header_length = _LOCAL_HEADER.size + name_length + extra_length
+        if len(buffer) < header_length:
+            return False
+
+        can_stream = (not flags & _FLAG_ENCRYPTED and method in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) and
+                      (method == zipfile.ZIP_DEFLATED or not flags & _FLAG_DATA_DESCRIPTOR or compress_size))
+        if not can_stream:
+            # From here on, the central directory is the only way to find out where anything is.
+            self._spool_offset = self._offset
+            self._spool = tempfile.TemporaryFile()
+            self._state = _SPOOL
+            return True
+
+        name = bytes(buffer[_LOCAL_HEADER.size:_LOCAL_HEADER.size + name_length])
+        name = name.decode('utf-8' if flags & _FLAG_UTF8 else 'cp437')
+        extra = bytes(buffer[_LOCAL_HEADER.size + name_length:header_length])
+        zip64 = False
+        position = 0
+        while position + 4 <= len(extra):
+            tag, size = struct.unpack_from('<HH', extra, position)
+            if tag == 0x0001:
+                # zip64 extended information.  The 64 bit sizes are only there if the 32 bit ones are maxed out.
+                zip64 = True
+                values = extra[position + 4:position + 4 + size]
+                if file_size == 0xffffffff and len(values) >= 8:
+                    file_size, = struct.unpack_from('<Q', values)
+                    values = values[8:]
+                if compress_size == 0xffffffff and len(values) >= 8:
+                    compress_size, = struct.unpack_from('<Q', values)
+            position += 4 + size
+        self._consume(header_length)
+
+        member = self._member = _Member(name, flags, method, crc, compress_size, file_size, zip64)
+        if name in self.keep:
+            member.kept = bytearray()
+        if not self.subdir or name.startswith(self.subdir):
+            arcname = name[len(self.subdir):]
+            if arcname:
+                member.path = member_path(self.outputdir, arcname)
+                if name.endswith('/'):
+                    os.makedirs(member.path, exist_ok=True)
+                elif (self.index is not None and not flags & _FLAG_DATA_DESCRIPTOR and
+                      self.index.unchanged(member.path, crc, file_size)):
+                    member.skip = True
+                else:
+                    os.makedirs(os.path.dirname(member.path), exist_ok=True)
+                    member.fout = open(member.path + '.tmp', 'wb')
+        self._state = _DATA
+        return True
+
+    def _read_data(self):
+        member = self._member
+        if not self._buffer:
+            return False
+        if member.until_eof:
+            data = self._consume(len(self._buffer))
+            member.output(member.decompressor.decompress(data))
+            if not member.decompressor.eof:
+                return False
+            # the end of the deflate stream was somewhere in there.  put back what came after it.
+            unused = member.decompressor.unused_data
+            self._buffer[:0] = unused
+            self._offset -= len(unused)
+        else:
+            data = self._consume(min(len(self._buffer), member.remaining))
+            member.remaining -= len(data)
+            if not member.skip:
+                member.output(member.decompressor.decompress(data) if member.decompressor else data)
+            if member.remaining:
+                return False
+            if member.decompressor and not member.skip:
+                member.output(member.decompressor.flush())
+        if member.flags & _FLAG_DATA_DESCRIPTOR:
+            self._state = _DESCRIPTOR
+        else:
+            self._member_done(member.expected_crc, member.file_size)
+        return True
+
+    def _read_descriptor(self):
+        buffer = self._buffer
+        if len(buffer) < 4:
+            return False
+        signed = buffer[:4] == _DESCRIPTOR_SIGNATURE
+        sizes = '<QQ' if self._member.zip64 else '<II'
+        length = (4 if signed else 0) + 4 + struct.calcsize(sizes)
+        if len(buffer) < length:
+            return False
+        descriptor = self._consume(length)
+        if signed:
+            descriptor = descriptor[4:]
+        crc, = struct.unpack_from('<I', descriptor)
+        _, file_size = struct.unpack_from(sizes, descriptor, 4)
+        self._member_done(crc, file_size)
+        return True
+
+    def _member_done(self, crc, file_size):
+        member = self._member
+        self._member = None
+        if member.skip:
+            # nothing was decompressed, so there's nothing to check.  the local header's CRC is what the index matched.
+            if self.progress:
+                self.progress(file_size)
+            self._state = _HEADER
+            return
+        if member.crc != crc or member.length != file_size:
+            member.discard()
+            raise zipfile.BadZipFile('bad CRC or size for %s' % member.name)
+        if member.fout is not None:
+            member.close()
+            os.replace(member.path + '.tmp', member.path)
+            if self.index is not None:
+                self.index.record(member.path, crc, file_size)
+        if member.kept is not None:
+            self.kept[member.name] = bytes(member.kept)
+        if member.path:
+            self.extracted.append(member.path)
+        if self.progress:
+            self.progress(member.length)
+        self._state = _HEADER
+
+    def _finish_from_central_directory(self):
+        spool = self._spool
+        spool.seek(0)
+        # The spool is the archive minus its first _spool_offset bytes.  zipfile copes with that: it works out where
+        # the central directory really is from where the end record is, and shifts every offset in it by the
+        # difference (normally that's for zips with something stuck on the front, like self-extractors; this is the
+        # same thing backwards).  Members we've already extracted end up at negative offsets, and we skip them.
+        with zipfile.ZipFile(spool) as zf:
+            for info in zf.infolist():
+                if info.header_offset < 0:
+                    continue
+                name = info.filename
+                wanted = not self.subdir or name.startswith(self.subdir)
+                arcname = name[len(self.subdir):] if wanted else ''
+                if name in self.keep:
+                    self.kept[name] = zf.read(info)
+                if not arcname:
+                    continue
+                path = member_path(self.outputdir, arcname)
+                if info.is_dir():
+                    os.makedirs(path, exist_ok=True)
+                    continue
+                if self.index is not None and self.index.unchanged(path, info.CRC, info.file_size):
+                    if self.progress:
+                        self.progress(info.file_size)
+                    continue
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with zf.open(info) as fin, open(path + '.tmp', 'wb') as fout:
+                    try:
+                        while True:
+                            data = fin.read(1024 * 1024)
+                            if not data:
+                                break
+                            fout.write(data)
+                    except BaseException:
+                        fout.close()
+                        os.remove(path + '.tmp')
+                        raise
+                os.replace(path + '.tmp', path)
+                if self.index is not None:
+                    self.index.record(path, info.CRC, info.file_size)
+                self.extracted.append(path)
+                if self.progress:
+                    self.progress(info.file_size)
@@ -1,12 +1,11 @@
-import http.client
 from ...modpack import AbstractModpack
-import time
-from threading import Lock
+from ...httpcache import HTTP_CACHE
 import json
 from PIL import Image
 
-CDN_CLIENT = http.client.HTTPSConnection('download.nodecdn.net')
-CDN_CLIENT_LOCK = Lock()
+PACKSNEW_URL = 'https://download.nodecdn.net/containers/atl/launcher/json/packsnew.json'
+# ATLauncher doesn't say how long packsnew is good for, so we do.
+HTTP_CACHE.set_ttl(PACKSNEW_URL, 3600)
 
 def _clean_string(string:str):
     out=''
@@ -19,23 +18,13 @@ def _clean_string(string:str):
 with open(r'C:\Users\sawor.000\Downloads\folder atlauncher can vomit into\configs\json\packsnew.json') as f:
     _PACKSNEW = json.load(f)
 
-_PACKSNEW_REFRESHED = None
 
 
 def _refresh_packsnew():
-    global _PACKSNEW, _PACKSNEW_REFRESHED
-    # If we have never refreshed packsnew, or if it has been at least one hour since we last refreshed packsnew,
-    # attempt to acquire the lock.  Only block on acquiring the lock if we have never refreshed packsnew, otherwise
-    # (if we have *something* and the lock is held by another thread) just go with what we have.
-    if (_PACKSNEW is None or _PACKSNEW_REFRESHED >= time.time() + 3600) \
-            and CDN_CLIENT_LOCK.acquire(blocking=_PACKSNEW is None):
-        try:
-            CDN_CLIENT.request('/containers/atl/launcher/json/packsnew.json')
-            with CDN_CLIENT.getresponse() as resp:
-                assert resp.code == 200, resp.code
-                _PACKSNEW = json.load(resp)
-        finally:
-            CDN_CLIENT_LOCK.release()
+    global _PACKSNEW
+    # HTTP_CACHE does the work: within the hour it's read off disk, after that it's revalidated (usually a 304), and if
+    # several threads want it at once they share one request.
+    _PACKSNEW = HTTP_CACHE.get_json(PACKSNEW_URL)
 
 
 class ATLPack(AbstractModpack):
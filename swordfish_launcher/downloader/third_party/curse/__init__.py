@@ -1,10 +1,11 @@
 from ...modpack import AbstractModpack
-import zipfile
-import tempfile
 from ...http_api import API
+from ...streamzip import StreamingUnzipper
+from ...overrides import OverrideIndex
 import urllib.parse
 import os
 import json
+import shutil
 from ....minefish import USER_AGENT
 
 CURSEFORGE_API = API('https://addons-ecs.forgesvc.net/api/v2', {'User-Agent': USER_AGENT})
@@ -69,27 +70,23 @@ class CurseModpack(AbstractModpack, CurseBase):
         else:
             self.getVersions()
             download_url = self._all_files[version]
-        with tempfile.TemporaryFile() as f:
-            with urllib.request.urlopen(download_url) as fin:
-                import shutil
-                shutil.copyfileobj(fin,f)
-            with zipfile.ZipFile(f) as zf:
-                # I would love to use zf.extract() or zf.extractall() here, but for whatever reason, those two methods
-                # simply *insist* on extracting the full file path, and I have to extract everything from overrides/
-                # into the modpack dir, not the modpack dir/overrides.
-                for file in zf.infolist():
-                    if file.filename.startswith('overrides/'):
-                        fspath = os.path.join(self._on_disk_path, file.filename[10:].replace('/',os.path.sep))
-                        if file.isdir():
-                            os.mkdir(fspath)
-                        else:
-                            with zf.open(file) as fin, open(fspath, 'w') as fout:
-                                shutil.copyfileobj(fin, fout)
-                with zf.open('manifest.json') as f:
-                    manifest=json.load(f)
+        # Everything in overrides/ goes into the modpack dir (not the modpack dir/overrides), and it's extracted while
+        # it downloads.  We only need the manifest in memory.  The index means an update only writes the overrides
+        # that changed, and removes the ones that went away.
+        index = OverrideIndex(self._on_disk_path)
+        with urllib.request.urlopen(download_url) as fin, \
+                StreamingUnzipper(self._on_disk_path, 'overrides/', keep=('manifest.json',), index=index) as unzipper:
+            shutil.copyfileobj(fin, unzipper)
+            unzipper.finish()
+        index.finish()
+        manifest = json.loads(unzipper.kept['manifest.json'])
         yield 'Minecraft', manifest['version']
         for loader in manifest['modLoaders']:
             yield 'Loader', loader['id']
+        # resolve every required mod now, in a few batched requests, so that whatever handles the 'Curse' lines below
+        # finds them all in RESOLVER rather than asking about each one in turn.
+        from .manifest import RESOLVER
+        RESOLVER.resolve(mod for mod in manifest['files'] if mod['required'])
         optional_mods = []
         for mod in manifest['files']:
             if not mod['required']:
@@ -1,21 +1,140 @@
-from . import CURSEFORGE_API
-import io
-import zipfile
-import urllib.request
+"""
+What we know about Curse files that we'd otherwise have to ask the network about every time.
+
+For every (project ID, file ID) we've ever procured, the mod's signature (its table of contents, see below), filename,
+length and download URL go into the same sqlite database as the rest of the mod cache, so installing a pack whose mods
+we've seen before doesn't probe anything.  Signatures are stored packed and compressed (pack_signature()) since a big
+mod's table of contents is a few thousand filenames, and they're read in as they're asked for, with the most recently
+used ones kept in memory.
+"""
+
+import collections
 import os
 import shutil
-from ....minefish import Minefish, USER_AGENT
+import sqlite3
+import struct
+import threading
+import urllib.request
+import zlib
+
+from .manifest import RESOLVER
+from ...zipprobe import PROBER
+from ....minefish import USER_AGENT
+
+CurseFile = collections.namedtuple('CurseFile', 'signature filename length url')
+
+
+def pack_signature(signature):
+    """Signature (a frozenset of (filename, size, CRC)) -> compact bytes for the database.  Sorted, so the same
+    signature always packs the same way, and compressed, since sorted filenames share a lot of prefixes."""
+    out = bytearray()
+    for name, size, crc in sorted(signature):
+        name = name.encode('utf-8')
+        out += struct.pack('<IIH', size, crc, len(name))
+        out += name
+    return zlib.compress(bytes(out), 9)
+
+
+def unpack_signature(packed):
+    data = zlib.decompress(packed)
+    entries = []
+    offset = 0
+    while offset < len(data):
+        size, crc, length = struct.unpack_from('<IIH', data, offset)
+        offset += 10
+        entries.append((data[offset:offset + length].decode('utf-8'), size, crc))
+        offset += length
+    return frozenset(entries)
 
 
 class CurseModCache:
-    def __init__(self, master_cache):
+    # How many files' worth of signatures to keep in memory.
+    LRU_SIZE = 1024
+
+    def __init__(self, master_cache, db=None, lru_size=None):
+        """
+        :param master_cache: The cache.Cache whose copies of mods we try before downloading anything.
+        :param db: Path to the sqlite database, or an open sqlite3.Connection.  Defaults to master_cache's.
+        :param lru_size: How many files' worth of signatures to keep in memory.  Defaults to LRU_SIZE.
+        """
         self._master_cache = master_cache
-        self._cache = {}  # TODO actually load the cache
+        if db is None:
+            db = master_cache.cursor.connection
+        elif not isinstance(db, sqlite3.Connection):
+            db = sqlite3.connect(db, check_same_thread=False)
+        self.db = db
+        self.lru_size = self.LRU_SIZE if lru_size is None else lru_size
+        self._lock = threading.Lock()
+        # (projectID, fileID) -> CurseFile, least recently used first.
+        self._lru = collections.OrderedDict()
+        # (projectID, fileID) -> zipprobe.ZipTail fetched by prefetch(), for procure_mod() to finish the download with.
+        self._tails = {}
+        with self._lock, self.db:
+            self.db.execute('create table if not exists curse_files('
+                            'project_id integer not null,'
+                            # file IDs are unique across projects, so that's enough of a key on its own.
+                            'file_id integer primary key,'
+                            # pack_signature() of the file's table of contents
+                            'signature blob not null,'
+                            'filename text not null,'
+                            'length integer not null,'
+                            'url text not null)')
+
+    def lookup(self, projectID, fileID):
+        """The CurseFile for a file, or None if we've never seen it."""
+        key = projectID, fileID
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None:
+                self._lru.move_to_end(key)
+                return entry
+            row = self.db.execute('select signature, filename, length, url from curse_files '
+                                  'where project_id = ? and file_id = ?', key).fetchone()
+            if row is None:
+                return None
+            entry = CurseFile(unpack_signature(row[0]), *row[1:])
+            self._remember(key, entry)
+            return entry
+
+    def _remember(self, key, entry):
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    def store(self, projectID, fileID, signature, filename, length, url):
+        """Remember a file.  Goes to the database on the next save()."""
+        entry = CurseFile(frozenset(signature), filename, length, url)
+        with self._lock:
+            self.db.execute('insert or replace into curse_files values (?,?,?,?,?,?)',
+                            (projectID, fileID, pack_signature(entry.signature), filename, length, url))
+            self._remember((projectID, fileID), entry)
+        return entry
+
+    def prefetch(self, files, prober=PROBER):
+        """Probe every one of files we don't know yet at once (say, every mod in a manifest), pipelined, rather than
+        one at a time as procure_mod() gets to them.
+
+        :param files: (projectID, fileID) pairs, or the 'files' list from a manifest.json.
+        """
+        files = [(mod['projectID'], mod['fileID']) if isinstance(mod, dict) else tuple(mod) for mod in files]
+        resolved = RESOLVER.resolve(key for key in files if self.lookup(*key) is None)
+        tails = prober.probe(info['downloadUrl'] for info in resolved.values())
+        for (projectID, fileID), info in resolved.items():
+            tail = tails.get(info['downloadUrl'])
+            # anything that failed gets another go from procure_mod().
+            if tail is not None and not isinstance(tail, Exception):
+                self.store(projectID, fileID, tail.signature(), info['fileName'], info['fileLength'],
+                           info['downloadUrl'])
+                with self._lock:
+                    self._tails[projectID, fileID] = tail
 
     def procure_mod(self, projectID, fileID, disk_directory):
-        signature, filename = self._cache.get((projectID, fileID))
-        if signature is None:
-            file_info = CURSEFORGE_API.get_json('/addon/%d/file/%d' % (projectID, fileID))
+        entry = self.lookup(projectID, fileID)
+        with self._lock:
+            tail = self._tails.pop((projectID, fileID), None)
+        if entry is None:
+            file_info = RESOLVER.resolve([(projectID, fileID)])[(projectID, fileID)]
             # Now this next section may get a little confusing.  Let me explain.
             # You see, JAR files are actually ZIP files, and all of the information about the contents of a ZIP file
             # is encoded in the End Central Directory record, which, unless the file uses the ZIP64 extension of the
@@ -38,44 +157,48 @@ class CurseModCache:
             # if the processor can hash data just as fast as the disk can supply it, which it usually can't, reading an
             # entire file is always going to be slower than reading the last 64K and closing it again.
 
-            # Some minecraft mods are very small and the entire file is less than 64K.  The server would complain if we
-            # passed it a negative number
-            if file_info['fileLength'] <= 65536:
-                have_entire_file = True
-                request = urllib.request.Request(file_info['downloadUrl'], headers={'User-Agent': USER_AGENT})
-            else:
-                have_entire_file = False
-                request = urllib.request.Request(file_info['downloadUrl'],
-                                                 headers={'User-Agent': USER_AGENT,
-                                                          'Range': 'bytes=-65536'})
-            with urllib.request.urlopen(request) as resp:
-                partial_file = io.BytesIO(resp.read())
-
-            with zipfile.ZipFile(partial_file) as zf:
-                signature = frozenset((info.filename, info.file_size, info.CRC) for info in zf.infolist())
-            self._cache[(projectID, fileID)] = signature, filename
-        else:
-            partial_file = None
-        procured_file = self._master_cache.procure_mod(signature, disk_directory)
+            # (These days zipprobe does the probing.  It reads the End of Central Directory record first to find out
+            # exactly where the table of contents starts, rather than hoping it's in the last 64K, so it copes with
+            # mods with enormous tables of contents, and ZIP64 for that matter.)
+            tail = PROBER.probe([file_info['downloadUrl']])[file_info['downloadUrl']]
+            if isinstance(tail, Exception):
+                raise tail
+            entry = self.store(projectID, fileID, tail.signature(), file_info['fileName'], file_info['fileLength'],
+                               file_info['downloadUrl'])
+        procured_file = self._master_cache.procure_file(entry.signature, disk_directory)
         if procured_file:
             return procured_file
-        output_path = os.path.join(disk_directory, filename)
-        with open(output_path, 'wb') as fout:
-            if partial_file:
-                request = None if have_entire_file else urllib.request.Request(-
-                    file_info['downloadUrl'],
-                    headers={'User-Agent': USER_AGENT,
-                             'Range': 'bytes=0-%d' % (file_info['fileLength'] - 65536)}
-                )
-            else:
-                request = urllib.request.Request(file_info['downloadUrl'], headers={'User-Agent': USER_AGENT})
-            if request:
-                with urllib.request.urlopen(request) as fin:
-                    shutil.copyfileobj(fin, fout)
-            if partial_file:
-                fout.write(partial_file.getbuffer())
-        self._master_cache.add_entry(output_path, signature)
+        output_path = os.path.join(disk_directory, entry.filename)
+        try:
+            with open(output_path, 'wb') as fout:
+                if tail is None or not tail.complete:
+                    # everything, or everything up to the tail we've already got.
+                    headers = {'User-Agent': USER_AGENT}
+                    if tail is not None:
+                        headers['Range'] = 'bytes=0-%d' % (tail.offset - 1)
+                    with urllib.request.urlopen(urllib.request.Request(entry.url, headers=headers)) as fin:
+                        if tail is not None and not (fin.status == 206 and fin.headers.get('Content-Range', '')
+                                                     .startswith('bytes 0-%d/' % (tail.offset - 1))):
+                            if fin.status != 200:
+                                raise ValueError('%s: asked for bytes 0-%d, got %d %s' % (
+                                    entry.url, tail.offset - 1, fin.status, fin.headers.get('Content-Range')))
+                            # the server (or a CDN in the way) ignored the Range header and is sending the whole jar,
+                            # tail and all.
+                            tail = None
+                        shutil.copyfileobj(fin, fout)
+                if tail is not None:
+                    fout.write(tail.data)
+                size = fout.tell()
+            if entry.length and size != entry.length:
+                raise ValueError('%s: got %d bytes, expected %d' % (entry.url, size, entry.length))
+        except BaseException:
+            # not something that should end up in the cache, or be mistaken for the mod next time.
+            os.remove(output_path)
+            raise
+        self._master_cache.add_to_cache(output_path, entry.signature)
         return output_path
 
     def save(self):
-
+        """Commit everything store()d since the last save()."""
+        with self._lock:
+            self.db.commit()
@@ -0,0 +1,140 @@
+"""
+Curse fingerprints.
+
+See "curse fingerprint notes" in this directory for how I got here.  The short version: a Curse fingerprint is the
+32-bit MurmurHash2 (seed 1) of the file with every tab, newline, carriage return and space byte removed first.  Yes,
+even for binary files like jars.  No, I don't know why either.
+
+MurmurHash2 is one multiply-and-xor per 4 bytes, which is nothing in C and a lot in Python.  Two things help:
+
+ - Each 4-byte block gets mixed on its own (multiply, shift, xor, multiply) before it goes into the running hash, and
+   that part doesn't depend on anything that came before, so if NumPy is installed it's done for the whole file in one
+   go.  What's left -- h = h * M ^ k, once per block -- has to be done in order, so that's still a Python loop, but a
+   much tighter one.  Without NumPy it's all one loop, but at least the blocks come out of an array rather than a
+   tuple at a time from struct.
+ - Hashing a lot of files (say, every jar the scavenger found) uses a process per CPU; see fingerprint_files().
+"""
+
+import array
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The bytes Curse strips out before hashing.
+WHITESPACE = b'\t\n\r '
+
+_M = 0x5bd1e995
+_MASK = 0xffffffff
+# whichever array typecode is 32 bits here ('I' almost everywhere).
+_UINT32 = next(code for code in 'IL' if array.array(code).itemsize == 4)
+
+# Below this many bytes, setting NumPy up costs more than it saves.
+NUMPY_THRESHOLD = 4096
+
+
+def normalize(data) -> bytes:
+    """Strip the bytes Curse ignores."""
+    return bytes(data).translate(None, WHITESPACE)
+
+
+def _blocks(data, tail_start):
+    """The 4-byte blocks of data[:tail_start], as little-endian unsigned ints, without a tuple per block like
+    struct.iter_unpack() would make."""
+    blocks = array.array(_UINT32)
+    blocks.frombytes(memoryview(data)[:tail_start])
+    if sys.byteorder == 'big':
+        blocks.byteswap()
+    return blocks
+
+
+def murmur2(data, seed=1):
+    """32-bit MurmurHash2 of data, exactly as Austin Appleby wrote it (little-endian blocks)."""
+    length = len(data)
+    h = (seed ^ length) & _MASK
+    tail_start = length - length % 4
+    m, mask = _M, _MASK
+    if numpy is not None and tail_start >= NUMPY_THRESHOLD:
+        mixed = numpy.frombuffer(data, dtype='<u4', count=tail_start // 4).astype(numpy.uint32)
+        # uint32 arithmetic wraps, which is exactly the & _MASK we'd otherwise need.
+        mixed *= numpy.uint32(m)
+        mixed ^= mixed >> numpy.uint32(24)
+        mixed *= numpy.uint32(m)
+        for k in mixed.tolist():
+            h = ((h * m) & mask) ^ k
+    else:
+        for k in _blocks(data, tail_start):
+            k = (k * m) & mask
+            k = ((k ^ (k >> 24)) * m) & mask
+            h = ((h * m) & mask) ^ k
+    tail = data[tail_start:]
+    if len(tail) == 3:
+        h ^= tail[2] << 16
+    if len(tail) >= 2:
+        h ^= tail[1] << 8
+    if len(tail) >= 1:
+        h ^= tail[0]
+        h = (h * _M) & _MASK
+    h ^= h >> 13
+    h = (h * _M) & _MASK
+    h ^= h >> 15
+    return h
+
+
+def fingerprint(data):
+    """Curse fingerprint of a bytes-like object."""
+    return murmur2(normalize(data))
+
+
+def fingerprint_file(path):
+    """Curse fingerprint of a file on disk."""
+    with open(path, 'rb') as f:
+        return fingerprint(f.read())
+
+
+def _fingerprint_or_none(path):
+    try:
+        return fingerprint_file(path)
+    except OSError:
+        return None
+
+
+def fingerprint_files(paths, processes=None):
+    """Curse fingerprints of a lot of files at once, spread over a pool of processes.
+
+    :param processes: How many processes to use.  Defaults to one per CPU; 1 does it all in this process.
+    :return: dict of path -> fingerprint.  Files we couldn't read are left out.
+    """
+    paths = list(paths)
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1 or len(paths) <= 1:
+        results = map(_fingerprint_or_none, paths)
+        return {path: result for path, result in zip(paths, results) if result is not None}
+    with ProcessPoolExecutor(max_workers=min(processes, len(paths))) as executor:
+        # jars are mostly small, so hand them out a few at a time to keep the pickling overhead down.
+        results = executor.map(_fingerprint_or_none, paths, chunksize=max(1, len(paths) // (processes * 4)))
+        return {path: result for path, result in zip(paths, results) if result is not None}
+
+
+class FingerprintHasher:
+    """Computes a Curse fingerprint over data fed to it a chunk at a time, hashlib style.
+
+    MurmurHash2 mixes the length of the input into its initial state, and the length that matters here is the length
+    *after* stripping whitespace, which nobody tells us in advance.  So the hash can't actually start until we've seen
+    the last byte; what we can do is strip each chunk as it goes past and keep the result, so that we never have to
+    read the file back off the disk.
+    """
+
+    def __init__(self):
+        self._normalized = bytearray()
+
+    def update(self, data):
+        self._normalized += normalize(data)
+
+    def intdigest(self):
+        return murmur2(self._normalized)
@@ -0,0 +1,48 @@
+"""
+Working out which Curse files the jars lying around on someone's drive are, without downloading anything.
+
+POST /fingerprint (see curseforge.apib, "Get Addon By Fingerprint") takes a list of fingerprints and tells us which
+files they belong to.  So: fingerprint every jar (fingerprint.fingerprint_files, a process per CPU), send the
+fingerprints off in batches, and match the answers back up with the paths.  Everything that matches also goes into the
+manifest resolver's memory, so a pack that wants one of those files later doesn't have to ask about it again.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import CURSEFORGE_API
+from .fingerprint import fingerprint_files
+from .manifest import RESOLVER
+
+
+def match_fingerprints(fingerprints, api=CURSEFORGE_API, batch_size=1000, resolver=RESOLVER):
+    """Ask Curse which files the given fingerprints belong to.
+
+    :param fingerprints: Iterable of fingerprints (ints).
+    :param batch_size: How many fingerprints go in each request.
+    :param resolver: A manifest.ManifestResolver to tell about every file we find, or None.
+    :return: dict of fingerprint -> (projectID, file info) for every fingerprint Curse knows.
+    """
+    fingerprints = sorted(set(fingerprints))
+    batches = [fingerprints[i:i + batch_size] for i in range(0, len(fingerprints), batch_size)]
+    matches = {}
+    if not batches:
+        return matches
+    with ThreadPoolExecutor(max_workers=min(api.pool_size, len(batches))) as executor:
+        for result in executor.map(lambda batch: api.post_json('/fingerprint', batch), batches):
+            for match in result.get('exactMatches') or ():
+                info = match['file']
+                matches[info['packageFingerprint']] = match['id'], info
+                if resolver is not None:
+                    resolver.remember(info)
+    return matches
+
+
+def identify_files(paths, api=CURSEFORGE_API, processes=None, resolver=RESOLVER):
+    """Which Curse file each of paths is.
+
+    :param processes: See fingerprint.fingerprint_files().
+    :return: dict of path -> (projectID, file info), for the paths Curse recognised.
+    """
+    fingerprints = fingerprint_files(paths, processes)
+    matches = match_fingerprints(fingerprints.values(), api, resolver=resolver)
+    return {path: matches[fp] for path, fp in fingerprints.items() if fp in matches}
@@ -0,0 +1,126 @@
+"""
+Turning the list of mods in a Curse modpack's manifest.json into things we can download.
+
+A manifest only gives a project ID and a file ID for each mod.  Asking /addon/{project}/file/{file} for each of them is
+one round trip per mod, and a big pack has a few hundred.  POST /addon (see curseforge.apib, "Get Multiple Addons")
+takes a list of project IDs and returns them all at once, each with its latestFiles -- which is where most of the files
+a pack pins will be, since packs tend to be built from whatever was current.  So we ask for every project in a few
+batches, pick our files out of the answers, and only go file-by-file (get_json_many, so it's still concurrent) for the
+ones that were pinned to something older.
+
+A file ID never changes what it refers to, so whatever we resolve is remembered for good, optionally in a JSON file (like
+MirrorStats) so the next install of the same pack doesn't ask at all.
+"""
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import CURSEFORGE_API
+from ...mirrors import mod_urls
+
+# What we keep of each file's info; the rest of it (dependencies, modules, game versions...) is a lot of JSON we don't
+# need.
+_FIELDS = ('id', 'fileName', 'fileLength', 'downloadUrl', 'packageFingerprint')
+
+
+class ManifestResolver:
+    # How many project IDs go in each POST /addon.  Curse doesn't document a limit; this keeps each response a sane size.
+    BATCH_SIZE = 100
+
+    def __init__(self, api=CURSEFORGE_API, path=None):
+        """
+        :param api: The http_api.API to ask.
+        :param path: JSON file to remember resolved files in between runs, or None to only remember them in memory.
+        """
+        self.api = api
+        self.path = path
+        self._lock = threading.Lock()
+        # fileID -> file info (just _FIELDS of it).  Keyed by file ID alone since those are unique across projects.
+        self._files = {}
+        if path is not None:
+            try:
+                with open(path) as f:
+                    self._files = {int(file_id): info for file_id, info in json.load(f).items()}
+            except (FileNotFoundError, ValueError):
+                pass
+
+    def remember(self, info):
+        """Remember a file's info (as the API returns it), e.g. one we found some other way than resolve()."""
+        with self._lock:
+            self._files[info['id']] = {field: info.get(field) for field in _FIELDS}
+
+    def resolve(self, files):
+        """Look up the file info for each of files.
+
+        :param files: (projectID, fileID) pairs, or the 'files' list from a manifest.json.
+        :return: dict of (projectID, fileID) -> file info, with at least fileName, fileLength, downloadUrl and
+        packageFingerprint.  Raises ValueError if the server won't tell us about one of them.
+        """
+        wanted = [(mod['projectID'], mod['fileID']) if isinstance(mod, dict) else tuple(mod) for mod in files]
+        with self._lock:
+            missing = {file_id: project_id for project_id, file_id in wanted if file_id not in self._files}
+        if missing:
+            self._resolve_batched(missing)
+            with self._lock:
+                stragglers = [(project_id, file_id) for file_id, project_id in missing.items()
+                              if file_id not in self._files]
+            # pinned to something that isn't one of its project's latest files.  one at a time, but all at once.
+            for info in self.api.get_json_many('/addon/%d/file/%d' % pair for pair in stragglers):
+                self.remember(info)
+        with self._lock:
+            # the server answered, but not about that file (a file ID that belongs to some other project, say).
+            unknown = [(project_id, file_id) for project_id, file_id in wanted if file_id not in self._files]
+            if unknown:
+                raise ValueError('no file info for (projectID, fileID) %s' % ', '.join(map(str, unknown)))
+            return {(project_id, file_id): self._files[file_id] for project_id, file_id in wanted}
+
+    def _resolve_batched(self, missing):
+        project_ids = sorted(set(missing.values()))
+        batches = [project_ids[i:i + self.BATCH_SIZE] for i in range(0, len(project_ids), self.BATCH_SIZE)]
+        with ThreadPoolExecutor(max_workers=max(1, min(self.api.pool_size, len(batches)))) as executor:
+            for addons in executor.map(lambda batch: self.api.post_json('/addon', batch), batches):
+                for addon in addons:
+                    for info in addon.get('latestFiles') or ():
+                        if info['id'] in missing:
+                            self.remember(info)
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            data = json.dumps(self._files)
+        with open(self.path + '.tmp', 'w') as f:
+            f.write(data)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def file_sources(file_id, info):
+    """Where a resolved file can be had from and what to check it against.
+
+    :param info: The file's info, as ManifestResolver.resolve() returns it.
+    :return: (urls, digests): every URL for it, the API's own first, and the digests for DownloadJob.add().
+    """
+    urls = [info['downloadUrl']]
+    urls += [url for url in mod_urls(file_id, info['fileName']) if url not in urls]
+    digests = {'length': info['fileLength']}
+    if info.get('packageFingerprint'):
+        digests['fingerprint'] = info['packageFingerprint']
+    return urls, digests
+
+
+def add_to_job(job, resolved, subdir='mods'):
+    """Queue every resolved file on a DownloadJob (for an AsyncDownloader), each with every URL it can be had from and
+    the length and fingerprint to check it against.
+
+    :param resolved: What ManifestResolver.resolve() returned.
+    :param subdir: Where the mods go, relative to the job's output directory.
+    """
+    for (_, file_id), info in resolved.items():
+        urls, digests = file_sources(file_id, info)
+        job.add(os.path.join(subdir, info['fileName']), (urls,), **digests)
+
+
+# The one everybody uses.
+RESOLVER = ManifestResolver()
@@ -1,17 +1,23 @@
 import urllib.request
 import urllib.parse
-import json
+from concurrent.futures import ThreadPoolExecutor
 from ...modpack import AbstractModpack
+from ...http_api import API
+from ...httpcache import HTTP_CACHE
+from .solder import PACK_TTL, SolderClient
+from ....minefish import USER_AGENT
+
+TECHNIC_API = API('https://api.technicpack.net', {'User-Agent': USER_AGENT})
+HTTP_CACHE.set_ttl('https://api.technicpack.net/modpack/', PACK_TTL)
+# Fills in the details of packs in the background (see TechnicModpack.hydrate).  Each Solder's API object limits how
+# many of these are talking to it at once.
+_HYDRATOR = ThreadPoolExecutor(max_workers=16, thread_name_prefix='technic-hydrate')
 
 
 def download_technicpack(slug):
-    with urllib.request.urlopen('https://api.technicpack.net/modpack/%s?build=999' % urllib.parse.quote(slug)) as resp:
-        data = json.load(resp)
-    with urllib.request.urlopen(data['solder'] + 'modpack/' + slug) as resp:
-        version_list = json.load(resp)
-    with urllib.request.urlopen(data['solder'] + 'modpack/' + slug + '/' + version_list['recommended']) as resp:
-        pack = json.load(resp)
-    return pack
+    data = TECHNIC_API.get_json('/modpack/%s?build=999' % urllib.parse.quote(slug))
+    client = SolderClient.for_url(data['solder'])
+    return client.build(slug, client.modpack(slug)['recommended'])
 
 _SENTINEL = object()
 
@@ -24,12 +30,13 @@ class TechnicModpack(AbstractModpack):
         self.recommended_version = _SENTINEL
         self.icon_url = icon_url
         self.bg_url = _SENTINEL
-        self._query_solder() # TODO remvoe this
+        # filled in by _query_solder(), which search() leaves to hydrate() rather than making everybody wait for it.
+        self.versions = None
+        self.latest_version = None
+        self.minecraft = None
 
     def _init(self):
-        with urllib.request.urlopen(
-                'https://api.technicpack.net/modpack/%s?build=minefish' % urllib.parse.quote(self.slug)) as resp:
-            data = json.load(resp)
+        data = TECHNIC_API.get_json('/modpack/%s?build=minefish' % urllib.parse.quote(self.slug))
         self.solder = data['solder']
         self.summary = data['description']
         self.url = data['url']
@@ -40,24 +47,56 @@ class TechnicModpack(AbstractModpack):
     def _query_solder(self):
         if self.solder is _SENTINEL:
             self._init()
-        if self.solder is None:
+        if self.solder is None or self.versions is not None:
             return
-        with urllib.request.urlopen(self.solder + 'modpack/' + self.slug) as f:
-            data = json.load(f)
+        data = SolderClient.for_url(self.solder).modpack(self.slug)
         self.versions = data['builds']
         self.latest_version = data['latest']
         self.recommended_version = data['recommended']
         self.minecraft = data['minecraft']
 
     @classmethod
-    def search(cls, search_term):
-        with urllib.request.urlopen('https://api.technicpack.net/search?build=minefish&q='+urllib.parse.quote(search_term)) as resp:
-            if resp.code != 200:
-                raise ValueError('Technicpack search: server returned error', resp.code)
-            data = json.load(resp)
-        return [cls(mp['slug'], mp['name'], mp['iconUrl']) for mp in data['modpacks']]
+    def search(cls, search_term, on_ready=None):
+        """Search the Technic platform.  Returns as soon as the search does, with packs that only know their slug,
+        title and icon; the rest is fetched when it's first needed, or right away in the background if on_ready is given
+        (see hydrate())."""
+        try:
+            data = TECHNIC_API.get_json('/search?build=minefish&q='+urllib.parse.quote(search_term))
+        except ValueError as e:
+            raise ValueError('Technicpack search: server returned error', *e.args)
+        packs = [cls(mp['slug'], mp['name'], mp['iconUrl']) for mp in data['modpacks']]
+        if on_ready is not None:
+            cls.hydrate(packs, on_ready)
+        return packs
+
+    @classmethod
+    def hydrate(cls, packs, on_ready=None):
+        """Fill in the details (description, Solder, builds...) of every one of packs in the background, all at once,
+        or as near as the servers' connection pools allow.
+
+        :param on_ready: Called with each pack as soon as its details are in, from whichever thread fetched them.
+        :return: A Future for each pack, which raises whatever went wrong with it, if anything did.
+        """
+        futures = []
+        for pack in packs:
+            future = _HYDRATOR.submit(pack._query_solder)
+            if on_ready is not None:
+                future.add_done_callback(lambda f, pack=pack: f.exception() is None and on_ready(pack))
+            futures.append(future)
+        return futures
+
+    def getBuilds(self, versions=None):
+        """The Solder build info for each of versions (all of them, by default), fetched side by side.
+
+        :return: dict of version -> build info, as SolderClient.build() returns it.
+        """
+        self._query_solder()
+        if self.solder is None:
+            return {}
+        return SolderClient.for_url(self.solder).builds(self.slug, self.versions if versions is None else versions)
 
     def _download(self, version: str = None):
+        self._query_solder()
         if version is None or version == 'recommended':
             version = self.recommended_version
         if self.solder is None:
@@ -66,23 +105,16 @@ class TechnicModpack(AbstractModpack):
             return
         if version == 'latest':
             version = self.latest_version
-        with urllib.request.urlopen('{}modpack/{}/{}'.format(self.solder, self.slug, version)) as resp:
-            assert resp.code == 200  # TODO handle this error more gracefully
-            data = json.load(resp)
+        data = SolderClient.for_url(self.solder).build(self.slug, version)  # TODO handle errors more gracefully
         yield 'Minecraft', data['minecraft']
         yield 'Modloader', 'Forge', data['forge']
 
 
     def getVersions(self):
+        self._query_solder()
         if self.solder is None:
-            return [self.advertised_version]
+            return [self.recommended_version]
         else:
-            if self.versions is None:
-                with urllib.request.urlopen(self.solder + 'modpack/' + self.slug) as f:
-                    data = json.load(f)
-                self.versions = data['builds']
-                self.latest_version = data['latest']
-                self.recommended_version = data['recommended']
             return self.versions
 
     def _get_image_bytes(self, image_type):
@@ -0,0 +1,70 @@
+"""
+Talking to Technic Solder servers.
+
+Every Technic pack with builds has its own Solder (the platform API tells you which), and a lot of them share the same
+few hosts.  SolderClient.for_url() hands out one client per Solder, each with its own pool of keep-alive connections
+(see http_api.API), so a page of search results asks each host for its packs a few at a time down connections that are
+already open, rather than one urlopen() after another.
+
+Everything goes through HTTP_CACHE, with TTLs: a pack's build list changes when somebody publishes a build, so it's
+kept for PACK_TTL, but a build, once published, doesn't change, so builds are kept for BUILD_TTL.  (Unless the cache
+hasn't been configured, in which case every call is a request.)
+"""
+
+import threading
+import urllib.parse
+
+from ...http_api import API
+from ...httpcache import HTTP_CACHE
+from ....minefish import USER_AGENT
+
+# How long to use a modpack/{slug} response before asking again.
+PACK_TTL = 10 * 60
+# And a modpack/{slug}/{build} response.
+BUILD_TTL = 24 * 60 * 60
+
+
+class SolderClient:
+    _clients = {}
+    _clients_lock = threading.Lock()
+
+    def __init__(self, solder_url, pool_size=4):
+        """
+        :param solder_url: Where the Solder API is, as the Technic platform gives it ('http://solder.example/api/').
+        :param pool_size: How many connections to have open to it, and so how many requests at once, at most.
+        """
+        self.url = solder_url.rstrip('/')
+        self.api = API(self.url, {'User-Agent': USER_AGENT}, pool_size=pool_size)
+        HTTP_CACHE.set_ttl(self.url + '/modpack/', PACK_TTL)
+        # the builds are under the same prefix as their pack, but the longest prefix wins.
+        HTTP_CACHE.set_ttl(self.url + '/modpack/*/', BUILD_TTL)
+
+    @classmethod
+    def for_url(cls, solder_url):
+        """The client for a Solder, made the first time somebody wants it."""
+        key = solder_url.rstrip('/')
+        with cls._clients_lock:
+            client = cls._clients.get(key)
+            if client is None:
+                client = cls._clients[key] = cls(solder_url)
+            return client
+
+    def modpack(self, slug):
+        """modpack/{slug}: the pack's builds, and which are latest and recommended."""
+        return self.api.get_json('/modpack/' + urllib.parse.quote(slug))
+
+    def build(self, slug, build):
+        """modpack/{slug}/{build}: the Minecraft and Forge versions of a build, and its mods."""
+        return self.builds(slug, [build])[build]
+
+    def builds(self, slug, builds):
+        """build() for every one of builds, pool_size at a time.
+
+        :return: dict of build -> what build() would have returned.
+        """
+        builds = list(dict.fromkeys(builds))
+        path = '/modpack/%s/' % urllib.parse.quote(slug)
+        return dict(zip(builds, self.api.get_json_many(path + urllib.parse.quote(build) for build in builds)))
+
+    def close(self):
+        self.api.close()
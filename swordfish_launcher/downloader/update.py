@@ -0,0 +1,288 @@
+"""
+Updating an installed modpack to another version of it by only downloading what changed.
+
+The providers' _download generators (see modpack.AbstractModpack) describe how to install a version from nothing, so
+going from one week's version of a pack to the next means fetching all 300 mods again to change 5 of them.  But every
+kind of pack we know about names its mods in a way that carries across versions -- a Curse project ID, a Solder mod
+name, an ATLauncher mod name -- along with something that changes whenever the file does (a file ID, a version string).
+So: turn the target version's manifest into a dict of PackItems keyed by that identity (curse_items, solder_items,
+atl_items), compare it with what InstalledPack says the last update put in the instance, and plan_update() comes up with
+the mods to add, the ones to replace, and the ones to delete.  UpdatePlan.execute() downloads the first two in one
+DownloadJob and only deletes anything once its replacement is safely in place.  A replacement jar of any size is patched
+from the jar it replaces instead, so only the entries that changed get downloaded (see jardelta.py).
+
+A fresh install is just an update from nothing, so this works for that too; the state lives in the instance directory,
+in INSTALLED_NAME, next to the overrides index (see overrides.py).  Configs and the rest of a pack's overrides are
+OverrideIndex's business, not this module's.
+"""
+
+import collections
+import functools
+import http.client
+import json
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from . import DownloadJob
+from .jardelta import patch_jar
+from .streamzip import StreamingUnzipper
+from .zipprobe import PROBER
+
+INSTALLED_NAME = '.swordfish-installed.json'
+# Replacement jars are patched from the old one (see jardelta.py) if the old one's at least this big.  Below that, the
+# probe and the ranges aren't worth the round trips.
+DELTA_THRESHOLD = 256 * 1024
+# Where ATLauncher's 'server' downloads live; their urls are relative to this.
+ATL_DOWNLOAD_BASE = 'https://download.nodecdn.net/containers/atl/'
+# ATLauncher mod types we know where to put, and where.  The rest (forge, jar mods, things to extract or decompile...)
+# are the full installer's problem.
+_ATL_DIRECTORIES = {
+    'mods': 'mods',
+    'coremods': 'coremods',
+    'resourcepack': 'resourcepacks',
+    'texturepack': 'texturepacks',
+    'shaderpack': 'shaderpacks',
+}
+
+#: One file of one version of a pack.  identity is what stays the same when the mod is updated ('curse:238222');
+#: version is what changes.  path is where it goes relative to the instance, or None for a zip to extract into the
+#: instance (Solder's mods are packaged that way).  urls is every URL it can be had from, best first, and digests is
+#: whatever DownloadJob.add() can check it against.
+PackItem = collections.namedtuple('PackItem', ('identity', 'version', 'path', 'urls', 'digests'))
+
+
+def curse_items(manifest, optional=(), resolver=None, subdir='mods'):
+    """The mods a Curse manifest.json asks for.
+
+    :param optional: Project IDs of the optional mods the user wants.
+    :param resolver: curse.manifest.ManifestResolver to look the files up with; the usual RESOLVER if None.
+    """
+    from .third_party.curse.manifest import RESOLVER, file_sources
+    if resolver is None:
+        resolver = RESOLVER
+    wanted = [mod for mod in manifest['files'] if mod['required'] or mod['projectID'] in optional]
+    resolved = resolver.resolve(wanted)
+    items = {}
+    for (project_id, file_id), info in resolved.items():
+        urls, digests = file_sources(file_id, info)
+        identity = 'curse:%d' % project_id
+        items[identity] = PackItem(identity, str(file_id), subdir + '/' + info['fileName'], urls, digests)
+    return items
+
+
+def solder_items(build):
+    """The mods in a Solder build (what /api/modpack/{slug}/{build} returns).  Each of them is a zip to extract into the
+    instance."""
+    items = {}
+    for mod in build['mods']:
+        digests = {}
+        if mod.get('md5'):
+            digests['md5'] = mod['md5']
+        if mod.get('filesize'):
+            digests['length'] = int(mod['filesize'])
+        identity = 'solder:' + mod['name']
+        items[identity] = PackItem(identity, mod['version'], None, [mod['url']], digests)
+    return items
+
+
+def atl_items(version):
+    """The mods in an ATLauncher version JSON that can simply be downloaded into place.  The ones that need the user to
+    fetch them in a browser, and the types we don't know what to do with, aren't included."""
+    items = {}
+    for mod in version.get('mods') or ():
+        directory = _ATL_DIRECTORIES.get(mod.get('type'))
+        download = mod.get('download', 'server')
+        if directory is None or download not in ('server', 'direct'):
+            continue
+        url = mod['url'] if download == 'direct' else ATL_DOWNLOAD_BASE + mod['url'].lstrip('/')
+        digests = {'md5': mod['md5']} if mod.get('md5') else {}
+        identity = 'atl:' + mod['name']
+        # the md5 changes with the file even when somebody forgets to bump the version.
+        items[identity] = PackItem(identity, '%s/%s' % (mod.get('version'), mod.get('md5')),
+                                   directory + '/' + mod['file'], [url], digests)
+    return items
+
+
+class InstalledPack:
+    """What the last update (or install) put in an instance: for each identity, the version and the files it became."""
+
+    def __init__(self, outputdir):
+        """
+        :param outputdir: The instance directory.
+        """
+        self.outputdir = outputdir
+        self.path = os.path.join(outputdir, INSTALLED_NAME)
+        # identity -> {'version': ..., 'files': [paths relative to outputdir, with forward slashes]}
+        self.items = {}
+        try:
+            with open(self.path) as f:
+                self.items = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def _full_path(self, path):
+        return os.path.join(self.outputdir, path.replace('/', os.path.sep))
+
+    def present(self, identity):
+        """Whether every file identity was installed as is still there."""
+        record = self.items.get(identity)
+        return record is not None and all(os.path.exists(self._full_path(path)) for path in record['files'])
+
+    def save(self):
+        os.makedirs(self.outputdir, exist_ok=True)
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.items, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class UpdatePlan:
+    def __init__(self, installed, add, replace, remove, unchanged):
+        """Use plan_update() rather than making one of these yourself."""
+        self.installed = installed
+        #: PackItems that aren't installed at all (or whose files have gone missing).
+        self.add = add
+        #: PackItems whose identity is installed, but at another version.
+        self.replace = replace
+        #: Identities that are installed but aren't in the target version.
+        self.remove = remove
+        #: Identities that are already installed at the version the target wants.
+        self.unchanged = unchanged
+
+    def __bool__(self):
+        return bool(self.add or self.replace or self.remove)
+
+    @property
+    def download_size(self):
+        """How many bytes execute() will download (at most: patched jars cost less), as far as we know.  None if
+        there's anything we don't know the size of."""
+        return _total_length(self.add + self.replace)
+
+    def execute(self, downloader, priority=0, progressbar=None, delta=True):
+        """Download everything to add and replace, then delete whatever that made redundant, and save the new state.
+
+        Anything that fails to download is left as it was: a replacement's old files stay where they are and stay
+        recorded, so running the same plan (or a new one) again picks up where this left off.
+
+        :param downloader: A started AsyncDownloader.  (Not the threaded Downloader: that one talks to a single host,
+        and pack items come with full URLs, from all over, and several mirrors apiece.)
+        :param delta: Whether to patch replacement jars from the ones they replace, rather than download them whole,
+        where that's possible.  Whatever can't be patched is downloaded as usual.
+        :return: The job's failures, as DownloadJob.join() returns them.
+        """
+        fetch = self.add + self.replace
+        # identity -> files it turned into, for the ones that got that far.
+        produced = {}
+        patched = self._patch_jars(produced) if delta else set()
+        # the progress bar only sees what the job downloads, so the jars that were patched don't count.
+        downloads = [item for item in fetch if item.identity not in patched]
+        job = DownloadJob(self.installed.outputdir, priority, progressbar, total_filesize=_total_length(downloads))
+        for item in downloads:
+            url_args = (item.urls,) if len(item.urls) > 1 else (item.urls[0],)
+            if item.path is None:
+                job.add(functools.partial(self._extract, item, produced), url_args, **item.digests)
+            else:
+                job.add(item.path, url_args, **item.digests)
+                produced[item.identity] = [item.path]
+        downloader.enqueue_job(job)
+        failures = job.join()
+
+        items = self.installed.items
+        stale = set()
+        for item in fetch:
+            # failures are keyed by the first URL, whichever mirror it came from in the end.
+            if item.urls[0] in failures or item.identity not in produced:
+                continue
+            old = items.get(item.identity)
+            if old is not None:
+                stale.update(old['files'])
+            items[item.identity] = {'version': item.version, 'files': produced[item.identity]}
+        for identity in self.remove:
+            stale.update(items.pop(identity)['files'])
+        # a new version of a mod (or a different mod altogether) can land on the same path as an old one, in which case
+        # it's already been replaced, and deleting it now would delete the new one.
+        for record in items.values():
+            stale.difference_update(record['files'])
+        for path in sorted(stale):
+            try:
+                os.remove(self.installed._full_path(path))
+            except FileNotFoundError:
+                pass
+        self.installed.save()
+        return failures
+
+    def _patch_jars(self, produced):
+        """Patch every replacement that's a jar worth patching.  Returns the identities of the ones that worked."""
+        candidates = []
+        for item in self.replace:
+            old = self.installed.items.get(item.identity)
+            if item.path is None or not item.path.endswith('.jar') or old is None or len(old['files']) != 1 or \
+                    not (item.digests.get('sha1') or item.digests.get('md5') or
+                         item.digests.get('fingerprint') is not None):
+                continue
+            old_path = self.installed._full_path(old['files'][0])
+            try:
+                if os.path.getsize(old_path) >= DELTA_THRESHOLD:
+                    candidates.append((item, old_path))
+            except OSError:
+                pass
+        if not candidates:
+            return set()
+        # one pipelined burst for all the central directories.
+        tails = PROBER.probe(item.urls[0] for item, _ in candidates)
+
+        def patch(candidate):
+            item, old_path = candidate
+            try:
+                patch_jar(old_path, item.urls[0], self.installed._full_path(item.path), item.digests,
+                          tails[item.urls[0]])
+            except (OSError, ValueError, EOFError, zipfile.BadZipFile, http.client.HTTPException):
+                # the downloader can have a go instead.
+                return None
+            return item
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            done = [item for item in executor.map(patch, candidates) if item is not None]
+        for item in done:
+            produced[item.identity] = [item.path]
+        return {item.identity for item in done}
+
+    def _extract(self, item, produced, fin):
+        # called by the downloader with the downloaded zip, from a thread of its own (AsyncDownloader runs callbacks
+        # in an executor), so taking our time over it doesn't hold up the other downloads.
+        outputdir = self.installed.outputdir
+        with fin, StreamingUnzipper(outputdir) as unzipper:
+            while True:
+                data = fin.read(1024 * 1024)
+                if not data:
+                    break
+                unzipper.write(data)
+            unzipper.finish()
+        produced[item.identity] = [os.path.relpath(path, outputdir).replace(os.path.sep, '/')
+                                   for path in unzipper.extracted]
+
+
+def _total_length(items):
+    lengths = [item.digests.get('length') for item in items]
+    return None if None in lengths else sum(lengths)
+
+
+def plan_update(installed, target):
+    """Work out what it takes to get from what's installed to the target version.
+
+    :param installed: InstalledPack for the instance.
+    :param target: dict of identity -> PackItem, from curse_items() or the like.
+    :return: An UpdatePlan.  It's false if there's nothing to do.
+    """
+    add, replace, unchanged = [], [], []
+    for identity, item in sorted(target.items()):
+        record = installed.items.get(identity)
+        if record is None or not installed.present(identity):
+            # not there, or somebody's deleted it.  if there was a record, whatever's left of it is replaced.
+            (add if record is None else replace).append(item)
+        elif record['version'] != item.version:
+            replace.append(item)
+        else:
+            unchanged.append(identity)
+    remove = sorted(set(installed.items) - set(target))
+    return UpdatePlan(installed, add, replace, remove, unchanged)
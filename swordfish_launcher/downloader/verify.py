@@ -0,0 +1,81 @@
+"""
+Integrity checking for downloads, done on the same chunks we write to disk rather than by reading the file back
+afterwards.
+
+Every source we download from tells us something about what we should be getting: Mojang's version JSON gives a SHA-1
+and a size for every library and asset, Technic Solder gives an MD5, and Curse gives a length and a fingerprint (see
+third_party/curse/fingerprint.py).  A Verifier takes whichever of those we have and checks them all.
+"""
+
+import hashlib
+import os
+
+
+class VerificationError(ValueError):
+    """The file we downloaded isn't the file we were promised."""
+
+
+class Verifier:
+    def __init__(self, sha1=None, md5=None, length=None, fingerprint=None):
+        """
+        :param sha1: Expected SHA-1, as a hex string.
+        :param md5: Expected MD5, as a hex string.
+        :param length: Expected length in bytes.
+        :param fingerprint: Expected Curse fingerprint (an integer).
+        """
+        self.expected_length = length
+        self.length = 0
+        self._hashes = []
+        if sha1:
+            self._hashes.append(('sha1', hashlib.sha1(), sha1.lower()))
+        if md5:
+            self._hashes.append(('md5', hashlib.md5(), md5.lower()))
+        if fingerprint is not None:
+            from .third_party.curse.fingerprint import FingerprintHasher
+            self._hashes.append(('fingerprint', FingerprintHasher(), int(fingerprint)))
+
+    @classmethod
+    def from_digests(cls, digests):
+        """Make a Verifier from a dict of keyword arguments, or return None if there's nothing to check."""
+        if not digests:
+            return None
+        return cls(**digests)
+
+    def update(self, data):
+        """Feed the next chunk of the file through every hash.  data may be a memoryview."""
+        self.length += len(data)
+        for _, hasher, _ in self._hashes:
+            hasher.update(data)
+
+    def update_from_file(self, path, length=None, blocksize=1024 * 1024):
+        """Feed the first length bytes (default: all) of a file on disk through the hashes.
+
+        Needed when resuming a .part file, since the bytes already on disk came from a previous run and we never saw
+        them go past.  It's a second read of those bytes, but only those.
+        """
+        with open(path, 'rb') as f, memoryview(bytearray(blocksize)) as buffer:
+            remaining = os.fstat(f.fileno()).st_size if length is None else length
+            while remaining:
+                count = f.readinto(buffer[:min(blocksize, remaining)])
+                if not count:
+                    break
+                self.update(buffer[:count])
+                remaining -= count
+
+    def verify(self):
+        """Raise VerificationError if anything doesn't match."""
+        if self.expected_length is not None and self.length != self.expected_length:
+            raise VerificationError('expected %d bytes, got %d' % (self.expected_length, self.length))
+        for name, hasher, expected in self._hashes:
+            actual = hasher.intdigest() if name == 'fingerprint' else hasher.hexdigest()
+            if actual != expected:
+                raise VerificationError('%s mismatch: expected %s, got %s' % (name, expected, actual))
+
+
+def verify_file(path, digests):
+    """Check a complete file on disk against a dict of digests.  For when the file wasn't written in order (segmented
+    downloads), so there was no stream to check it against."""
+    verifier = Verifier.from_digests(digests)
+    if verifier is not None:
+        verifier.update_from_file(path)
+        verifier.verify()
@@ -0,0 +1,91 @@
+"""
+The bit of the download path that puts bytes on the disk.
+
+Two things live here.  BUFFERS is a pool of receive buffers, so that downloading ten thousand asset files doesn't mean
+allocating (and zeroing) ten thousand megabyte-sized bytearrays.  ChunkWriter writes consecutive chunks to a file with
+os.pwrite() at explicit offsets where the OS has it, which skips the BufferedWriter (and its copy) entirely and is
+what lets several segments of one file be written through separate handles without fighting over a file position.
+
+tests/bench_write_path.py measures the difference.
+"""
+
+import contextlib
+import io
+import os
+import threading
+
+_HAVE_PWRITE = hasattr(os, 'pwrite')
+
+
+class BufferPool:
+    """A thread-safe pool of bytearrays, bucketed by size."""
+
+    def __init__(self, max_per_size=16):
+        """
+        :param max_per_size: How many idle buffers of each size to keep around.  Anything beyond that is left for the
+        garbage collector.
+        """
+        self.max_per_size = max_per_size
+        self._free = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def get(self, size):
+        """Borrow a buffer of exactly `size` bytes, as a memoryview.  Its contents are whatever the last borrower left
+        in it.  Don't hang on to slices of it past the end of the with block.
+        """
+        with self._lock:
+            free = self._free.get(size)
+            buffer = free.pop() if free else None
+        if buffer is None:
+            buffer = bytearray(size)
+        try:
+            with memoryview(buffer) as view:
+                yield view
+        finally:
+            with self._lock:
+                free = self._free.setdefault(size, [])
+                if len(free) < self.max_per_size:
+                    free.append(buffer)
+
+
+BUFFERS = BufferPool()
+
+
+class ChunkWriter:
+    """Writes chunks to a file one after another, starting at a given offset."""
+
+    def __init__(self, fout, offset=None):
+        """
+        :param fout: A file object opened for writing.  Anything still sitting in its buffer is flushed first.  It
+        doesn't have to be a real file (see streamzip.StreamingUnzipper); if it hasn't got a file descriptor, chunks
+        just go to its write().
+        :param offset: Where to start writing.  Defaults to the file object's current position.
+        """
+        fout.flush()
+        self._fout = fout
+        self.offset = fout.tell() if offset is None else offset
+        self.fd = None
+        if _HAVE_PWRITE:
+            try:
+                self.fd = fout.fileno()
+            except (AttributeError, io.UnsupportedOperation):
+                pass
+        if self.fd is None and offset is not None:
+            fout.seek(offset)
+
+    def write(self, chunk):
+        if self.fd is not None:
+            length = len(chunk)
+            written = os.pwrite(self.fd, chunk, self.offset)
+            while written < length:
+                # short writes are allowed, if unusual on regular files.
+                written += os.pwrite(self.fd, chunk[written:], self.offset + written)
+        else:
+            self._fout.write(chunk)
+        self.offset += len(chunk)
+
+    def close(self):
+        """Leave the file object's position after the last byte we wrote, as if we'd used its write() all along."""
+        if self.fd is not None:
+            self._fout.seek(self.offset)
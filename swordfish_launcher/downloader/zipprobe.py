@@ -0,0 +1,271 @@
+"""
+Reading the table of contents of a zip file (well, a jar) on a server without downloading the rest of it.
+
+Everything about what's in a zip file is in its central directory, which sits at the end, followed by the End of Central
+Directory record that says where it starts and how big it is.  So: ask for the last few K (a suffix Range), find the
+EOCD record (or its ZIP64 equivalent) in there, and if the central directory didn't all fit, ask for exactly the bit
+that's missing.  What we end up with -- central directory through to the end of the file -- is enough for
+zipfile.ZipFile to list the contents, and it's also the last bytes of the file, so whoever downloads the whole thing
+later only needs to ask for everything before it.
+
+The requests are tiny, so what matters is round trips.  ZipProber sends them pipelined (see pipeline.py) down a couple
+of connections per host, so a few hundred jars on forgecdn are one burst of requests rather than a few hundred
+handshakes.
+"""
+
+import collections
+import io
+import queue
+import re
+import struct
+import threading
+import urllib.parse
+import zipfile
+
+from .aio import split_url
+from .pipeline import ConnectionPool
+from ..minefish import USER_AGENT
+
+_EOCD = struct.Struct('<4s4H2LH')
+_EOCD_SIGNATURE = b'PK\x05\x06'
+_ZIP64_LOCATOR = struct.Struct('<4sLQL')
+_ZIP64_LOCATOR_SIGNATURE = b'PK\x06\x07'
+_ZIP64_EOCD = struct.Struct('<4sQ2H2L4Q')
+_ZIP64_EOCD_SIGNATURE = b'PK\x06\x06'
+# The furthest from the end of the file an EOCD record can start: itself, plus the longest comment there can be.
+_MAX_EOCD_DISTANCE = _EOCD.size + 0xffff
+_CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+REDIRECTS = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+
+class ZipTail:
+    """The end of a remote zip file, from the start of its central directory to its last byte (or all of it, if it was
+    small enough that we got all of it anyway)."""
+    __slots__ = ('url', 'length', 'offset', 'data')
+
+    def __init__(self, url, length, offset, data):
+        """
+        :param length: Length of the whole file.
+        :param offset: Where in the file data starts.  0 if we've got all of it.
+        """
+        self.url = url
+        self.length = length
+        self.offset = offset
+        self.data = data
+
+    @property
+    def complete(self):
+        return self.offset == 0
+
+    def signature(self):
+        """The file's table of contents, as a frozenset of (filename, size, CRC), like cache.Cache uses."""
+        # zipfile works out where the central directory starts from where the EOCD record is, rather than believing
+        # the offset written in it, so it's perfectly happy with a zip file missing everything before that.
+        with zipfile.ZipFile(io.BytesIO(self.data)) as zf:
+            return frozenset((info.filename, info.file_size, info.CRC) for info in zf.infolist())
+
+
+def _find_central_directory(data, data_offset):
+    """Where in the file the central directory starts, given some bytes from the end of it.  Returns None if the EOCD
+    record (or the ZIP64 record it points to) isn't in data; raises zipfile.BadZipFile if it isn't anywhere."""
+    position = len(data)
+    while True:
+        position = data.rfind(_EOCD_SIGNATURE, 0, position)
+        if position < 0:
+            if data_offset == 0 or len(data) >= _MAX_EOCD_DISTANCE:
+                raise zipfile.BadZipFile('no End of Central Directory record')
+            return None
+        if position + _EOCD.size <= len(data):
+            _, _, _, _, entries, cd_size, cd_offset, comment_length = _EOCD.unpack_from(data, position)
+            # the signature could turn up in the comment (or in compressed data), but then the comment length won't
+            # take us to the end of the file.
+            if position + _EOCD.size + comment_length == len(data):
+                break
+    if entries != 0xffff and cd_size != 0xffffffff and cd_offset != 0xffffffff:
+        return _check(data_offset + position - cd_size)
+    # ZIP64: the real numbers are in another record, which a locator just before this one points to.  Like zipfile, we
+    # assume the ZIP64 EOCD record comes right before the locator.
+    locator = position - _ZIP64_LOCATOR.size
+    record = locator - _ZIP64_EOCD.size
+    if record < 0:
+        if data_offset == 0:
+            raise zipfile.BadZipFile('truncated ZIP64 records')
+        return None
+    if _ZIP64_LOCATOR.unpack_from(data, locator)[0] != _ZIP64_LOCATOR_SIGNATURE or \
+            _ZIP64_EOCD.unpack_from(data, record)[0] != _ZIP64_EOCD_SIGNATURE:
+        raise zipfile.BadZipFile('ZIP64 EOCD record missing')
+    cd_size = _ZIP64_EOCD.unpack_from(data, record)[-2]
+    return _check(data_offset + record - cd_size)
+
+
+def _check(cd_start):
+    if cd_start < 0:
+        raise zipfile.BadZipFile('central directory is bigger than the file')
+    return cd_start
+
+
+class _Probe:
+    """One URL's worth of probing."""
+    __slots__ = ('url', 'target', 'key', 'path', 'redirects', 'data', 'offset', 'length', 'wanted')
+
+    def __init__(self, url, first_read):
+        self.url = url
+        # where we're asking now, which isn't url once it's redirected.
+        self.target = url
+        self.key, self.path = split_url(url)
+        self.redirects = 0
+        self.data = b''
+        self.offset = None
+        self.length = None
+        # the range to ask for next: a suffix length (negative), or (start, end) inclusive.
+        self.wanted = -first_read
+
+    def range_header(self):
+        if isinstance(self.wanted, int):
+            return 'bytes=%d' % self.wanted
+        return 'bytes=%d-%d' % self.wanted
+
+    def got(self, resp, body):
+        """Take in a response.  Returns a ZipTail if that's everything, else None, and self.wanted says what's next (and
+        self.key and self.path where to ask for it)."""
+        if resp.status in REDIRECTS:
+            # every mod download on the Curse CDN is one of these, from edge.forgecdn.net to wherever the file is.
+            self.redirects += 1
+            if self.redirects > MAX_REDIRECTS:
+                raise ValueError('too many redirects from %s' % self.url)
+            self.target = urllib.parse.urljoin(self.target, resp.getheader('Location', ''))
+            self.key, self.path = split_url(self.target)
+            return None
+        if resp.status == 200:
+            # the server ignored the Range, or the file's smaller than what we asked for and it couldn't be bothered.
+            self.data, self.offset, self.length = body, 0, len(body)
+        elif resp.status == 206:
+            match = _CONTENT_RANGE.fullmatch(resp.getheader('Content-Range', ''))
+            if not match:
+                raise ValueError('bad Content-Range from %s: %r' % (self.url, resp.getheader('Content-Range')))
+            start, end, length = map(int, match.groups())
+            if self.offset is not None and end + 1 != self.offset:
+                raise ValueError('%s sent %d-%d, we wanted up to %d' % (self.url, start, end, self.offset - 1))
+            self.data = body + self.data
+            self.offset, self.length = start, length
+        else:
+            raise ValueError(resp.status)
+
+        cd_start = _find_central_directory(self.data, self.offset)
+        if cd_start is None:
+            # the EOCD record has a long comment (or it's ZIP64 and the records didn't fit).  get everything it could
+            # possibly need.
+            self.wanted = (max(0, self.length - _MAX_EOCD_DISTANCE - _ZIP64_LOCATOR.size - _ZIP64_EOCD.size),
+                           self.offset - 1)
+            return None
+        if cd_start < self.offset:
+            self.wanted = (cd_start, self.offset - 1)
+            return None
+        if self.offset == 0:
+            # we've got the whole file, so nobody needs to download it again.
+            return ZipTail(self.url, self.length, 0, self.data)
+        return ZipTail(self.url, self.length, cd_start, self.data[cd_start - self.offset:])
+
+
+class ZipProber:
+    def __init__(self, connections_per_host=2, depth=16, first_read=8192, timeout=30):
+        """
+        :param connections_per_host: How many connections to open to each host.
+        :param depth: How many requests to have in flight on each connection.
+        :param first_read: How many bytes to ask for from the end of each file to begin with.  Enough for the EOCD
+        record and then some; the central directory itself is usually bigger, and gets its own request.
+        """
+        self.connections_per_host = connections_per_host
+        self.depth = depth
+        self.first_read = first_read
+        self.timeout = timeout
+        #: Where the connections are kept between probe() calls.  remotezip borrows them too.
+        self.pool = ConnectionPool(depth, timeout)
+
+    def probe(self, urls):
+        """Probe every one of urls.
+
+        :return: dict of url -> ZipTail, or url -> the exception that stopped us probing that one.  Redirects are
+        followed, but the results are under the URLs we were given.
+        """
+        results = {}
+        pending = []
+        for url in dict.fromkeys(urls):
+            try:
+                pending.append(_Probe(url, self.first_read))
+            except ValueError as e:
+                results[url] = e
+        # a redirect to another host can't carry on down the same connection, so those go round again, all together,
+        # once this lot are done.
+        while pending:
+            moved = []
+            self._probe_all(pending, results, moved)
+            pending = moved
+        return results
+
+    def _probe_all(self, pending, results, moved):
+        by_host = collections.defaultdict(queue.SimpleQueue)
+        counts = collections.Counter()
+        for probe in pending:
+            by_host[probe.key].put(probe)
+            counts[probe.key] += 1
+        threads = []
+        for key, probes in by_host.items():
+            for _ in range(min(self.connections_per_host, -(-counts[key] // self.depth))):
+                thread = threading.Thread(target=self._worker, args=(key, probes, results, moved), daemon=True,
+                                          name='ZipProber-' + key[1])
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+    def _worker(self, key, probes, results, moved):
+        conn = self.pool.get(key)
+        # follow-up requests for probes this connection started go ahead of new probes, so they finish sooner.
+        followups = collections.deque()
+        try:
+            while True:
+                while conn.can_send():
+                    if followups:
+                        probe = followups.popleft()
+                    else:
+                        try:
+                            probe = probes.get_nowait()
+                        except queue.Empty:
+                            break
+                    conn.send_request('GET', probe.path, {'User-Agent': USER_AGENT, 'Range': probe.range_header()},
+                                      token=probe)
+                if not conn.outstanding:
+                    break
+                try:
+                    probe, resp = conn.get_response()
+                except Exception as e:
+                    # the connection's beyond saving; everything that was waiting on it goes down with it.
+                    for probe in conn.abort_all():
+                        results[probe.url] = e
+                    continue
+                try:
+                    body = resp.read()
+                except Exception as e:
+                    conn.abort_response()
+                    results[probe.url] = e
+                    continue
+                try:
+                    tail = probe.got(resp, body)
+                except Exception as e:
+                    results[probe.url] = e
+                    continue
+                if tail is None:
+                    (followups if probe.key == key else moved).append(probe)
+                else:
+                    results[probe.url] = tail
+        finally:
+            self.pool.put(key, conn)
+
+    def close(self):
+        self.pool.close()
+
+
+# The one everybody uses.
+PROBER = ZipProber()
@@ -0,0 +1,64 @@
+"""
+Micro-benchmark for the download write path: lots of small files, the way an asset download looks.
+
+Not a test (pytest won't collect it).  Run it directly:
+
+    python -m swordfish_launcher.tests.bench_write_path [file count] [file size]
+
+"old" is what download() used to do: a fresh bytearray for every file and buffered fout.write() of every chunk.  "new"
+is what it does now: a pooled buffer, os.pwrite() via ChunkWriter, and the file preallocated from its Content-Length.
+"""
+
+import io
+import os
+import sys
+import tempfile
+import time
+
+from swordfish_launcher.downloader.writer import BUFFERS, ChunkWriter
+from swordfish_launcher.misc.fallocate import prealloc
+
+BLOCKSIZE = 1024 * 1024
+
+
+def old_path(resp, fout, length):
+    with memoryview(bytearray(BLOCKSIZE)) as buffer:
+        while True:
+            count = resp.readinto1(buffer)
+            if not count:
+                return
+            fout.write(buffer if count == BLOCKSIZE else buffer[:count])
+
+
+def new_path(resp, fout, length):
+    writer = ChunkWriter(fout)
+    prealloc(fout, length)
+    with BUFFERS.get(BLOCKSIZE) as buffer:
+        while True:
+            count = resp.readinto1(buffer)
+            if not count:
+                writer.close()
+                return
+            writer.write(buffer if count == BLOCKSIZE else buffer[:count])
+
+
+def run(path_function, directory, count, payload):
+    start = time.perf_counter()
+    for i in range(count):
+        # a BufferedReader over a BytesIO has the same readinto1() as an HTTPResponse.
+        resp = io.BufferedReader(io.BytesIO(payload))
+        with open(os.path.join(directory, str(i)), 'wb') as fout:
+            path_function(resp, fout, len(payload))
+    return time.perf_counter() - start
+
+
+def main(count=2000, size=16 * 1024):
+    payload = os.urandom(size)
+    for name, path_function in (('old', old_path), ('new', new_path)):
+        with tempfile.TemporaryDirectory() as directory:
+            elapsed = run(path_function, directory, count, payload)
+        print('%s: %d files of %d bytes in %.3fs, %.1f us/file' % (name, count, size, elapsed, elapsed / count * 1e6))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
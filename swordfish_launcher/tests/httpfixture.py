@@ -0,0 +1,86 @@
+"""
+A local HTTP server for the tests that need something to download from.
+
+Subclass QuietHandler with a do_GET (and whatever else) and hand it to serve() in setUp; the server's gone again once
+the test is over, tearDown and all.
+"""
+
+import http.server
+import threading
+
+
+class QuietHandler(http.server.BaseHTTPRequestHandler):
+    """Speaks HTTP/1.1, so keep-alive and pipelining get exercised, and doesn't log every request to stderr."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, body, status=200, headers=()):
+        """Send a whole response: status, headers (name, value pairs), Content-Length and body."""
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_redirect(self, location, status=302):
+        self.send_body(b'', status, [('Location', location)])
+
+    def send_ranges(self, data, headers=()):
+        """Answer a GET for data, going by its Range header: a 200 if there isn't one, a 206 for one range, and a
+        multipart/byteranges 206 for more than one."""
+        byte_range = self.headers.get('Range')
+        if not byte_range:
+            self.send_body(data, 200, headers)
+            return
+        ranges = []
+        for spec in byte_range[len('bytes='):].split(','):
+            first, last = spec.strip().split('-')
+            if not first:
+                ranges.append((max(0, len(data) - int(last)), len(data) - 1))
+            else:
+                ranges.append((int(first), min(int(last), len(data) - 1) if last else len(data) - 1))
+        headers = list(headers)
+        if len(ranges) == 1:
+            (start, end), = ranges
+            headers.append(('Content-Range', 'bytes %d-%d/%d' % (start, end, len(data))))
+            self.send_body(data[start:end + 1], 206, headers)
+            return
+        body = b''
+        for start, end in ranges:
+            body += b'\r\n--BOUNDARY\r\nContent-Type: application/octet-stream\r\n'
+            body += b'Content-Range: bytes %d-%d/%d\r\n\r\n' % (start, end, len(data))
+            body += data[start:end + 1]
+        body += b'\r\n--BOUNDARY--\r\n'
+        headers.append(('Content-Type', 'multipart/byteranges; boundary=BOUNDARY'))
+        self.send_body(body, 206, headers)
+
+
+class LocalServer:
+    """A ThreadingHTTPServer on a free port on 127.0.0.1, serving from a thread of its own until close()."""
+
+    def __init__(self, handler):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.port = self.server.server_address[1]
+        #: 'http://127.0.0.1:port', to stick paths on the end of.
+        self.base = 'http://127.0.0.1:%d' % self.port
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def serve(testcase, handler):
+    """Start a LocalServer for the rest of a test.  It's closed after tearDown()."""
+    server = LocalServer(handler)
+    testcase.addCleanup(server.close)
+    return server
@@ -0,0 +1,326 @@
+from unittest import TestCase
+import hashlib
+import io
+import os
+import tempfile
+import time
+import zipfile
+from swordfish_launcher.downloader import DownloadJob
+from swordfish_launcher.downloader.aio import AsyncDownloader
+from swordfish_launcher.downloader.journal import ResumeJournal
+from swordfish_launcher.downloader.streamzip import StreamingUnzipper
+from swordfish_launcher.downloader.third_party.curse.fingerprint import fingerprint
+from swordfish_launcher.downloader.verify import VerificationError
+from swordfish_launcher.tests.httpfixture import QuietHandler, serve
+
+FILES = {'/a.bin': os.urandom(300000), '/b.bin': b'hello world', '/c/d.bin': os.urandom(70000)}
+
+
+def _zip(files):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    return out.getvalue()
+
+
+PACK = {'overrides/config/a.cfg': b'a=1', 'overrides/mods/b.jar': os.urandom(50000), 'manifest.json': b'{}'}
+ARCHIVES = {'/pack.zip': _zip(PACK)}
+ARCHIVES['/truncated.zip'] = ARCHIVES['/pack.zip'][:30000]
+
+
+class _Handler(QuietHandler):
+    connections = set()
+    paths = []
+    # every If-Range we were sent.
+    validators = []
+    # (what, when) for /slow/ requests.
+    timeline = []
+
+    def do_GET(self):
+        _Handler.connections.add(self.client_address)
+        _Handler.paths.append((self.path, self.headers.get('Range')) if self.path.startswith('/m/') else self.path)
+        if 'If-Range' in self.headers:
+            _Handler.validators.append(self.headers['If-Range'])
+        if self.path.startswith('/m/'):
+            # a mirror.  /m/stall/... sends half the file and then goes quiet.
+            self.path = self.path[2:]
+        if self.path.startswith('/stall/'):
+            # (with a validator of its own, which means nothing to the other mirrors.)
+            data = FILES[self.path[6:]]
+            self.send_response(200)
+            self.send_header('ETag', '"stall"')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data[:len(data) // 2])
+            self.wfile.flush()
+            time.sleep(2)
+            self.close_connection = True
+            return
+        if self.path.startswith('/r/'):
+            self.send_redirect(self.path[2:])
+            return
+        slow = self.path.startswith('/slow/')
+        if slow:
+            # /slow/... trickles the file out, and notes when each request came in and when the first quarter of the
+            # file had gone out.
+            self.path = self.path[5:]
+            _Handler.timeline.append(('range' if 'Range' in self.headers else 'whole', time.monotonic()))
+        data = FILES.get(self.path) or ARCHIVES.get(self.path)
+        if data is None:
+            self.send_body(b'', 404)
+            return
+        headers = [('Accept-Ranges', 'bytes'), ('ETag', '"v1"')]
+        if not slow:
+            if self.headers.get('If-Range', '"v1"') == '"v1"':
+                self.send_ranges(data, headers)
+            else:
+                self.send_body(data, headers=headers)
+            return
+        start, end = 0, len(data)
+        if 'Range' in self.headers and self.headers.get('If-Range', '"v1"') == '"v1"':
+            start, end = self.headers['Range'][6:].split('-')
+            start, end = int(start), int(end) + 1 if end else len(data)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, len(data)))
+        else:
+            self.send_response(200)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+        try:
+            for offset in range(start, end, 16384):
+                self.wfile.write(data[offset:min(end, offset + 16384)])
+                self.wfile.flush()
+                if start == 0 and offset + 16384 >= len(data) // 4 > offset:
+                    _Handler.timeline.append(('first segment sent', time.monotonic()))
+                time.sleep(0.05)
+        except ConnectionError:
+            # the first segment's connection is hung up on once it's got its quarter.
+            self.close_connection = True
+
+
+class TestAsyncDownloader(TestCase):
+    def setUp(self):
+        self.base = serve(self, _Handler).base
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.downloader = AsyncDownloader(max_connections_per_host=1)
+        self.downloader.start()
+
+    def tearDown(self):
+        self.downloader.shutdown()
+        self.temp_dir.cleanup()
+
+    def test_download_job(self):
+        _Handler.connections.clear()
+        job = DownloadJob(self.temp_dir.name)
+        self.downloader.enqueue_job(job)
+        for path in FILES:
+            job.add(path[1:], (self.base + path,))
+        job.add('missing.bin', (self.base + '/missing.bin',))
+        failures = job.join()
+        self.assertEqual(failures, {self.base + '/missing.bin': 404})
+        for path, data in FILES.items():
+            with open(os.path.join(self.temp_dir.name, path[1:]), 'rb') as f:
+                self.assertEqual(f.read(), data)
+        # one connection, reused for every file.
+        self.assertEqual(len(_Handler.connections), 1)
+
+    def test_segmented(self):
+        downloader = AsyncDownloader(max_connections_per_host=4, blocksize=16384, segment_threshold=100000)
+        downloader.start()
+        try:
+            # pretend we were interrupted partway through the last segment last time.
+            part = os.path.join(self.temp_dir.name, 'a.bin.part')
+            with open(part, 'wb') as f:
+                f.write(FILES['/a.bin'][:245760])
+                f.truncate(300000)
+            with open(part + '.segments', 'w') as f:
+                f.write('{"length": 300000, "validator": "\\"v1\\"", "segments": '
+                        '[[0, 81920, 81920], [81920, 163840, 163840], [163840, 200000, 245760], [245760, 245760, 300000]]}')
+            job = DownloadJob(self.temp_dir.name)
+            job.add('a.bin', (self.base + '/a.bin',))
+            job.add('c/d.bin', (self.base + '/c/d.bin',))
+            downloader.enqueue_job(job)
+            self.assertEqual(job.join(), {})
+        finally:
+            downloader.shutdown()
+        with open(os.path.join(self.temp_dir.name, 'a.bin'), 'rb') as f:
+            self.assertEqual(f.read(), FILES['/a.bin'])
+        self.assertFalse(os.path.exists(part + '.segments'))
+
+    def test_segments_overlap(self):
+        downloader = AsyncDownloader(max_connections_per_host=4, blocksize=16384, segment_threshold=100000)
+        downloader.start()
+        _Handler.timeline = []
+        try:
+            job = DownloadJob(self.temp_dir.name)
+            job.add('a.bin', (self.base + '/slow/a.bin',))
+            downloader.enqueue_job(job)
+            self.assertEqual(job.join(), {})
+        finally:
+            downloader.shutdown()
+        with open(os.path.join(self.temp_dir.name, 'a.bin'), 'rb') as f:
+            self.assertEqual(f.read(), FILES['/a.bin'])
+        # the other three segments were asked for while the first was still coming down the original connection.
+        events = sorted(_Handler.timeline, key=lambda event: event[1])
+        self.assertEqual([what for what, _ in events[:4]], ['whole', 'range', 'range', 'range'])
+        self.assertIn('first segment sent', [what for what, _ in events[4:]])
+
+    def test_streaming_unzipper(self):
+        outputdir = os.path.join(self.temp_dir.name, 'pack')
+        unzipper = StreamingUnzipper(outputdir, 'overrides', keep=('manifest.json',))
+        job = DownloadJob(self.temp_dir.name)
+        job.add(unzipper, (self.base + '/pack.zip',), sha1=hashlib.sha1(ARCHIVES['/pack.zip']).hexdigest())
+        truncated = StreamingUnzipper(os.path.join(self.temp_dir.name, 'truncated'))
+        job.add(truncated, (self.base + '/truncated.zip',))
+        self.downloader.enqueue_job(job)
+        failures = job.join()
+        self.assertEqual(list(failures), [self.base + '/truncated.zip'])
+        self.assertIsInstance(failures[self.base + '/truncated.zip'], zipfile.BadZipFile)
+        for name in ('config/a.cfg', 'mods/b.jar'):
+            with open(os.path.join(outputdir, name), 'rb') as f:
+                self.assertEqual(f.read(), PACK['overrides/' + name])
+        self.assertEqual(unzipper.kept, {'manifest.json': b'{}'})
+
+    def test_redirect(self):
+        _Handler.paths.clear()
+        for _ in range(2):
+            job = DownloadJob(self.temp_dir.name)
+            job.add('b.bin', (self.base + '/r/b.bin',))
+            self.downloader.enqueue_job(job)
+            self.assertEqual(job.join(), {})
+            with open(os.path.join(self.temp_dir.name, 'b.bin'), 'rb') as f:
+                self.assertEqual(f.read(), FILES['/b.bin'])
+        # the second time round we should have gone straight to the target.
+        self.assertEqual(_Handler.paths, ['/r/b.bin', '/b.bin', '/b.bin'])
+
+    def test_verification(self):
+        job = DownloadJob(self.temp_dir.name)
+        job.add('a.bin', (self.base + '/a.bin',), sha1=hashlib.sha1(FILES['/a.bin']).hexdigest(), length=300000)
+        job.add('b.bin', (self.base + '/b.bin',), md5='0' * 32)
+        self.downloader.enqueue_job(job)
+        failures = job.join()
+        self.assertIsInstance(failures.pop(self.base + '/b.bin'), VerificationError)
+        self.assertEqual(failures, {})
+        self.assertEqual(sorted(os.listdir(self.temp_dir.name)), ['a.bin'])
+
+    def test_resume(self):
+        with open(os.path.join(self.temp_dir.name, 'a.bin.part'), 'wb') as f:
+            f.write(FILES['/a.bin'][:1000])
+        job = DownloadJob(self.temp_dir.name)
+        job.add('a.bin', (self.base + '/a.bin',))
+        self.downloader.enqueue_job(job)
+        self.assertEqual(job.join(), {})
+        with open(os.path.join(self.temp_dir.name, 'a.bin'), 'rb') as f:
+            self.assertEqual(f.read(), FILES['/a.bin'])
+
+    def test_journal(self):
+        journal = ResumeJournal(os.path.join(self.temp_dir.name, 'journal.sqlite'))
+        downloader = AsyncDownloader(journal=journal)
+        downloader.start()
+        try:
+            url = self.base + '/a.bin'
+            for validator, prefix in (('"v1"', FILES['/a.bin'][:1000]), ('"v0"', os.urandom(1000))):
+                # the first 1000 bytes were synced last time; the 500 after that never made it to disk intact.
+                # the second time round, the file has changed on the server since.
+                path = os.path.join(self.temp_dir.name, 'a.bin')
+                with open(path + '.part', 'wb') as f:
+                    f.write(prefix + os.urandom(500))
+                journal.db.execute('insert into resume_journal values (?, ?, ?, ?, ?)',
+                                   (path, url, validator, len(FILES['/a.bin']), 1000))
+                job = DownloadJob(self.temp_dir.name)
+                job.add('a.bin', (url,))
+                downloader.enqueue_job(job)
+                self.assertEqual(job.join(), {})
+                with open(path, 'rb') as f:
+                    self.assertEqual(f.read(), FILES['/a.bin'])
+                self.assertIsNone(journal.lookup(path))
+        finally:
+            downloader.shutdown()
+
+    def test_blob_store(self):
+        from swordfish_launcher.downloader.blobstore import BLOB_STORE
+        BLOB_STORE.configure(os.path.join(self.temp_dir.name, 'blobs'), max_size=350000)
+        try:
+            for instance in ('one', 'two'):
+                job = DownloadJob(os.path.join(self.temp_dir.name, instance))
+                self.downloader.enqueue_job(job)
+                job.add('b.bin', (self.base + '/b.bin',))
+                job.add('d.bin', (self.base + '/c/d.bin',), sha1=hashlib.sha1(FILES['/c/d.bin']).hexdigest())
+                _Handler.paths.clear()
+                self.assertEqual(job.join(), {})
+                for path, name in (('/b.bin', 'b.bin'), ('/c/d.bin', 'd.bin')):
+                    with open(os.path.join(self.temp_dir.name, instance, name), 'rb') as f:
+                        self.assertEqual(f.read(), FILES[path])
+            # the second instance didn't download anything.
+            self.assertEqual(_Handler.paths, [])
+            # a.bin doesn't fit alongside the others.  the least recently used one has to go.
+            BLOB_STORE.add(os.path.join(self.temp_dir.name, 'one', 'b.bin'))
+            job = DownloadJob(os.path.join(self.temp_dir.name, 'three'))
+            self.downloader.enqueue_job(job)
+            job.add('a.bin', (self.base + '/a.bin',))
+            self.assertEqual(job.join(), {})
+            self.assertIsNone(BLOB_STORE.find(sha1=hashlib.sha1(FILES['/c/d.bin']).hexdigest()))
+            self.assertIsNotNone(BLOB_STORE.find(url=self.base + '/b.bin'))
+        finally:
+            BLOB_STORE.configure(None)
+
+    def test_blob_store_mirrors(self):
+        from swordfish_launcher.downloader.blobstore import BLOB_STORE
+        BLOB_STORE.configure(os.path.join(self.temp_dir.name, 'blobs'))
+        try:
+            mirrors = [self.base + '/m/missing.bin', self.base + '/m/b.bin']
+            for instance in ('one', 'two'):
+                job = DownloadJob(os.path.join(self.temp_dir.name, instance))
+                self.downloader.enqueue_job(job)
+                _Handler.paths.clear()
+                job.add('b.bin', (mirrors,))
+                self.assertEqual(job.join(), {})
+                with open(os.path.join(self.temp_dir.name, instance, 'b.bin'), 'rb') as f:
+                    self.assertEqual(f.read(), FILES['/b.bin'])
+            # it was stored under the mirror that had it, and found there the second time.
+            self.assertEqual(_Handler.paths, [])
+        finally:
+            BLOB_STORE.configure(None)
+
+    def test_mirrors(self):
+        downloader = AsyncDownloader(stall_timeout=0.5)
+        downloader.start()
+        try:
+            _Handler.paths.clear()
+            job = DownloadJob(self.temp_dir.name)
+            job.add('a.bin', ([self.base + '/m/stall/a.bin', self.base + '/m/a.bin'],),
+                    sha1=hashlib.sha1(FILES['/a.bin']).hexdigest())
+            job.add('b.bin', ([self.base + '/m/missing.bin', self.base + '/m/b.bin'],))
+            downloader.enqueue_job(job)
+            self.assertEqual(job.join(), {})
+        finally:
+            downloader.shutdown()
+        for name in ('a.bin', 'b.bin'):
+            with open(os.path.join(self.temp_dir.name, name), 'rb') as f:
+                self.assertEqual(f.read(), FILES['/' + name])
+        # the second mirror carried on from where the first one stalled.
+        self.assertIn(('/m/a.bin', 'bytes=150000-'), _Handler.paths)
+
+    def test_mirrors_fingerprint(self):
+        # a Curse file has just a length and a fingerprint, and that's as good as a hash for carrying on elsewhere,
+        # without the first mirror's If-Range.
+        journal = ResumeJournal(os.path.join(self.temp_dir.name, 'journal.sqlite'))
+        downloader = AsyncDownloader(stall_timeout=0.5, journal=journal)
+        downloader.start()
+        try:
+            _Handler.paths.clear()
+            _Handler.validators.clear()
+            job = DownloadJob(self.temp_dir.name)
+            job.add('a.bin', ([self.base + '/m/stall/a.bin', self.base + '/m/a.bin'],),
+                    length=len(FILES['/a.bin']), fingerprint=fingerprint(FILES['/a.bin']))
+            downloader.enqueue_job(job)
+            self.assertEqual(job.join(), {})
+        finally:
+            downloader.shutdown()
+        with open(os.path.join(self.temp_dir.name, 'a.bin'), 'rb') as f:
+            self.assertEqual(f.read(), FILES['/a.bin'])
+        self.assertIn(('/m/a.bin', 'bytes=150000-'), _Handler.paths)
+        self.assertEqual(_Handler.validators, [])
@@ -0,0 +1,118 @@
+from unittest import TestCase
+import io
+import os
+import tempfile
+import zipfile
+from swordfish_launcher.downloader.third_party.curse.cache import CurseModCache, pack_signature, unpack_signature
+from swordfish_launcher.downloader.third_party.curse.manifest import RESOLVER
+from swordfish_launcher.tests.httpfixture import QuietHandler, serve
+
+
+def _jar():
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w') as zf:
+        for i in range(150):
+            # incompressible, so the jar's well over 64K, and with enough files that the central directory doesn't fit
+            # in the probe's first read.
+            zf.writestr('com/example/mod/Class%d.class' % i, os.urandom(3000))
+    return out.getvalue()
+
+
+JAR = _jar()
+
+
+class _Handler(QuietHandler):
+    ranges = []
+    # ignore the Range header on everything but the probe's requests, like some CDNs do.
+    whole = False
+
+    def do_GET(self):
+        byte_range = self.headers.get('Range')
+        _Handler.ranges.append(byte_range)
+        if _Handler.whole and byte_range and byte_range.startswith('bytes=0-'):
+            byte_range = None
+        body = JAR
+        if byte_range:
+            start, end = byte_range[len('bytes='):].split('-')
+            body = JAR[-int(end):] if not start else JAR[int(start):int(end) + 1]
+        headers = []
+        if byte_range:
+            start = len(JAR) - len(body) if not start else int(start)
+            headers.append(('Content-Range', 'bytes %d-%d/%d' % (start, start + len(body) - 1, len(JAR))))
+        self.send_body(body, 206 if byte_range else 200, headers)
+
+
+class _MasterCache:
+    def __init__(self):
+        self.added = []
+
+    def procure_file(self, manifest, outputdir):
+        return None
+
+    def add_to_cache(self, file, manifest=None):
+        self.added.append((file, manifest))
+
+
+class TestCurseModCache(TestCase):
+    def test_signature(self):
+        signature = frozenset([('a/B.class', 10, 0xdeadbeef), ('é.txt', 0, 0), ('a/C.class', 2 ** 32 - 1, 1)])
+        self.assertEqual(unpack_signature(pack_signature(signature)), signature)
+
+    def test_procure_mod(self):
+        server = serve(self, _Handler)
+        RESOLVER.remember({'id': 4000123, 'fileName': 'example.jar', 'fileLength': len(JAR),
+                           'downloadUrl': server.base + '/files/4000/123/example.jar'})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db = os.path.join(temp_dir, 'cache.db')
+            master = _MasterCache()
+            cache = CurseModCache(master, db)
+            path = cache.procure_mod(1234, 4000123, temp_dir)
+            cache.save()
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), JAR)
+            # the EOCD record, then the rest of the central directory, then everything before it.
+            cd_start = zipfile.ZipFile(io.BytesIO(JAR)).start_dir
+            self.assertEqual(_Handler.ranges, ['bytes=-8192', 'bytes=%d-%d' % (cd_start, len(JAR) - 8192 - 1),
+                                               'bytes=0-%d' % (cd_start - 1)])
+            with zipfile.ZipFile(path) as zf:
+                signature = frozenset((info.filename, info.file_size, info.CRC) for info in zf.infolist())
+            self.assertEqual(master.added, [(path, signature)])
+
+            # a new run: no probe, just the download.
+            _Handler.ranges = []
+            cache = CurseModCache(master, db, lru_size=1)
+            self.assertIsNone(cache.lookup(1234, 1))
+            os.makedirs(os.path.join(temp_dir, 'again'))
+            cache.procure_mod(1234, 4000123, os.path.join(temp_dir, 'again'))
+            self.assertEqual(_Handler.ranges, [None])
+            self.assertEqual(cache.lookup(1234, 4000123).signature, signature)
+
+            # prefetched: the probe's tail is used for the download.
+            _Handler.ranges = []
+            cache = CurseModCache(master, os.path.join(temp_dir, 'other.db'))
+            cache.prefetch([{'projectID': 1234, 'fileID': 4000123, 'required': True}])
+            self.assertEqual(cache.lookup(1234, 4000123).signature, signature)
+            os.makedirs(os.path.join(temp_dir, 'prefetched'))
+            cache.procure_mod(1234, 4000123, os.path.join(temp_dir, 'prefetched'))
+            self.assertEqual(_Handler.ranges[2:], ['bytes=0-%d' % (cd_start - 1)])
+
+    def test_range_ignored(self):
+        _Handler.whole = True
+        self.addCleanup(setattr, _Handler, 'whole', False)
+        server = serve(self, _Handler)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            master = _MasterCache()
+            cache = CurseModCache(master, os.path.join(temp_dir, 'cache.db'))
+            for file_id, length in ((4000124, len(JAR)), (4000125, len(JAR) + 1)):
+                RESOLVER.remember({'id': file_id, 'fileName': '%d.jar' % file_id, 'fileLength': length,
+                                   'downloadUrl': server.base + '/files/4000/%d/mod.jar' % (file_id % 1000)})
+                cache.prefetch([{'projectID': 1234, 'fileID': file_id, 'required': True}])
+            # the whole jar, without the probe's tail stuck on the end of it.
+            path = cache.procure_mod(1234, 4000124, temp_dir)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), JAR)
+            # and if that's not as long as Curse said it'd be, it's not kept.
+            with self.assertRaises(ValueError):
+                cache.procure_mod(1234, 4000125, temp_dir)
+            self.assertFalse(os.path.exists(os.path.join(temp_dir, '4000125.jar')))
+            self.assertEqual([added for added, _ in master.added], [path])
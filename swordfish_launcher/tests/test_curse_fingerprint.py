@@ -0,0 +1,79 @@
+from unittest import TestCase
+import json
+import os
+import struct
+import tempfile
+from swordfish_launcher.downloader.http_api import API
+from swordfish_launcher.downloader.third_party.curse import fingerprint
+from swordfish_launcher.downloader.third_party.curse.identify import identify_files
+from swordfish_launcher.downloader.third_party.curse.manifest import ManifestResolver
+from swordfish_launcher.tests.httpfixture import QuietHandler, serve
+
+
+def _reference_murmur2(data, seed=1):
+    """The one block at a time version, straight out of Appleby's C."""
+    m, mask = 0x5bd1e995, 0xffffffff
+    h = (seed ^ len(data)) & mask
+    tail_start = len(data) - len(data) % 4
+    for (k,) in struct.iter_unpack('<I', data[:tail_start]):
+        k = (k * m) & mask
+        k ^= k >> 24
+        k = (k * m) & mask
+        h = ((h * m) & mask) ^ k
+    for i, byte in reversed(list(enumerate(data[tail_start:]))):
+        h ^= byte << (8 * i)
+    if len(data) % 4:
+        h = (h * m) & mask
+    h ^= h >> 13
+    h = (h * m) & mask
+    return h ^ (h >> 15)
+
+
+class _Handler(QuietHandler):
+    known = {}
+
+    def do_POST(self):
+        fingerprints = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        matches = [{'id': 1000 + fp % 7, 'file': _Handler.known[fp]} for fp in fingerprints if fp in _Handler.known]
+        self.send_body(json.dumps({'exactMatches': matches}).encode())
+
+
+class TestFingerprint(TestCase):
+    def test_murmur2(self):
+        numpy = fingerprint.numpy
+        try:
+            for length in (0, 1, 2, 3, 4, 5, 4095, 4096, 4099, 100001):
+                data = os.urandom(length)
+                expected = _reference_murmur2(data)
+                self.assertEqual(fingerprint.murmur2(data), expected, length)
+                fingerprint.numpy = None
+                self.assertEqual(fingerprint.murmur2(data), expected, length)
+                fingerprint.numpy = numpy
+        finally:
+            fingerprint.numpy = numpy
+        self.assertEqual(fingerprint.fingerprint(b'a b\tc\r\nd'), _reference_murmur2(b'abcd'))
+
+    def test_identify_files(self):
+        api = API(serve(self, _Handler).base + '/api', {})
+        self.addCleanup(api.close)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for i in range(6):
+                paths.append(os.path.join(temp_dir, 'mod%d.jar' % i))
+                with open(paths[-1], 'wb') as f:
+                    f.write(os.urandom(5000 + i))
+            prints = fingerprint.fingerprint_files(paths + [os.path.join(temp_dir, 'missing.jar')], processes=2)
+            self.assertEqual(prints, {path: fingerprint.fingerprint_file(path) for path in paths})
+
+            # Curse knows the first three.
+            _Handler.known = {prints[path]: {'id': 50 + i, 'fileName': 'mod%d.jar' % i, 'fileLength': 5000 + i,
+                                             'downloadUrl': 'https://example/%d' % i,
+                                             'packageFingerprint': prints[path]}
+                              for i, path in enumerate(paths[:3])}
+            resolver = ManifestResolver(api)
+            found = identify_files(paths, api, processes=1, resolver=resolver)
+            self.assertEqual(sorted(found), paths[:3])
+            project_id, info = found[paths[1]]
+            self.assertEqual((project_id, info['id']), (1000 + prints[paths[1]] % 7, 51))
+            # and the resolver knows about them now, without asking.
+            self.assertEqual(resolver.resolve([(project_id, 51)])[(project_id, 51)]['fileName'], 'mod1.jar')
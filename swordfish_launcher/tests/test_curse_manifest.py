@@ -0,0 +1,73 @@
+from unittest import TestCase
+import json
+import os
+import tempfile
+from swordfish_launcher.downloader import DownloadJob
+from swordfish_launcher.downloader.http_api import API
+from swordfish_launcher.downloader.third_party.curse.manifest import ManifestResolver, add_to_job
+from swordfish_launcher.tests.httpfixture import QuietHandler, serve
+
+
+def _file(project_id, file_id):
+    return {'id': file_id, 'fileName': 'mod%d-%d.jar' % (project_id, file_id), 'fileLength': 1000 + file_id,
+            'downloadUrl': 'https://edge.forgecdn.net/files/%d/%d/mod.jar' % (file_id // 1000, file_id % 1000),
+            'packageFingerprint': file_id * 7, 'dependencies': []}
+
+
+class _Handler(QuietHandler):
+    requests = []
+
+    def _reply(self, data):
+        self.send_body(json.dumps(data).encode())
+
+    def do_POST(self):
+        project_ids = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        _Handler.requests.append(('POST', len(project_ids)))
+        # every project's latest file is project ID * 10
+        self._reply([{'id': project_id, 'latestFiles': [_file(project_id, project_id * 10)]}
+                     for project_id in project_ids])
+
+    def do_GET(self):
+        _Handler.requests.append(('GET', self.path))
+        _, _, _, project_id, _, file_id = self.path.split('/')
+        # file 666 isn't project 1's: the server tells you about the one it has instead.
+        self._reply(_file(int(project_id), int(file_id) if file_id != '666' else 1))
+
+
+class TestManifestResolver(TestCase):
+    def test_resolve(self):
+        api = API(serve(self, _Handler).base + '/api', {})
+        self.addCleanup(api.close)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'curse_files.json')
+            resolver = ManifestResolver(api, path)
+            files = [{'projectID': i, 'fileID': i * 10, 'required': True} for i in range(1, 250)]
+            # one that isn't its project's latest file
+            files.append({'projectID': 5, 'fileID': 49, 'required': True})
+            resolved = resolver.resolve(files)
+            self.assertEqual(len(resolved), 250)
+            self.assertEqual(resolved[(5, 49)]['fileLength'], 1049)
+            self.assertEqual(sorted(_Handler.requests, key=str),
+                             [('GET', '/api/addon/5/file/49'), ('POST', 100), ('POST', 100), ('POST', 49)])
+
+            resolver.save()
+            _Handler.requests = []
+            self.assertEqual(ManifestResolver(api, path).resolve(files), resolved)
+            self.assertEqual(_Handler.requests, [])
+
+            job = DownloadJob(temp_dir)
+            add_to_job(job, {(5, 49): resolved[(5, 49)]})
+            outfile, urls = job.queue.get_nowait()
+            self.assertEqual(outfile, os.path.join(temp_dir, 'mods', 'mod5-49.jar'))
+            self.assertEqual(urls[0], 'https://edge.forgecdn.net/files/0/49/mod.jar')
+            self.assertIn('https://media.forgecdn.net/files/0/49/mod5-49.jar', urls)
+            self.assertEqual(job.digests[outfile], {'length': 1049, 'fingerprint': 343})
+
+    def test_unknown_file(self):
+        api = API(serve(self, _Handler).base + '/api', {})
+        self.addCleanup(api.close)
+        resolver = ManifestResolver(api, None)
+        with self.assertRaises(ValueError):
+            resolver.resolve([(1, 666), (2, 20)])
+        # the rest were looked up all the same.
+        self.assertEqual(resolver.resolve([(2, 20)])[(2, 20)]['fileLength'], 1020)
@@ -0,0 +1,53 @@
+from unittest import TestCase
+import os
+import tempfile
+from swordfish_launcher.downloader import Downloader, DownloadJob
+from swordfish_launcher.downloader.journal import ResumeJournal
+from swordfish_launcher.downloader.pipeline import PipelinedConnection
+from swordfish_launcher.downloader.verify import VerificationError
+from swordfish_launcher.tests.httpfixture import QuietHandler, serve
+
+# a.bin looks like a response itself, so if it's left in the socket, it'll be taken for b.bin's.
+FILES = {'/a.bin': b'HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nWRONG', '/b.bin': os.urandom(5000)}
+
+
+class _Handler(QuietHandler):
+    def do_GET(self):
+        data = FILES[self.path]
+        if self.headers.get('Range'):
+            # whatever was asked for, here's the whole thing, with a Content-Range to say so.
+            self.send_body(data, 206, [('ETag', '"v1"'), ('Content-Range', 'bytes 0-%d/%d' % (len(data) - 1, len(data)))])
+        else:
+            self.send_body(data, headers=[('ETag', '"v1"')])
+
+
+class TestDownloader(TestCase):
+    def test_journal_mismatch(self):
+        # the journal turns down a.bin's 206 before a byte of it's been read.  b.bin's response is behind it on the
+        # same connection, and has to come out intact all the same.
+        server = serve(self, _Handler)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            journal = ResumeJournal(os.path.join(temp_dir, 'journal.sqlite'))
+            path = os.path.join(temp_dir, 'files', 'a.bin')
+            os.makedirs(os.path.dirname(path))
+            with open(path + '.part', 'wb') as f:
+                f.write(FILES['/a.bin'][:1000])
+            journal.db.execute('insert into resume_journal values (?, ?, ?, ?, ?)',
+                               (path, '127.0.0.1/a.bin', '"v1"', len(FILES['/a.bin']), 1000))
+            downloader = Downloader('127.0.0.1', '/{}', journal=journal)
+            downloader.client = PipelinedConnection('127.0.0.1', server.port, https=False)
+            try:
+                job = DownloadJob(os.path.join(temp_dir, 'files'))
+                job.add('a.bin', ('a.bin',))
+                job.add('b.bin', ('b.bin',))
+                job.finalize()
+                downloader.enqueue_job(job)
+                downloader.start()
+                failures = job.join()
+            finally:
+                downloader.shutdown()
+            self.assertEqual(list(failures), ['/a.bin'])
+            self.assertIsInstance(failures['/a.bin'], VerificationError)
+            with open(os.path.join(temp_dir, 'files', 'b.bin'), 'rb') as f:
+                self.assertEqual(f.read(), FILES['/b.bin'])
+            journal.db.close()
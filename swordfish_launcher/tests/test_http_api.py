@@ -0,0 +1,58 @@
+from unittest import TestCase
+import json
+import threading
+import time
+from swordfish_launcher.downloader.http_api import API
+from swordfish_launcher.tests.httpfixture import QuietHandler, serve
+
+
+class _Handler(QuietHandler):
+    posts = []
+    in_flight = 0
+    most_in_flight = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with _Handler.lock:
+            _Handler.in_flight += 1
+            _Handler.most_in_flight = max(_Handler.most_in_flight, _Handler.in_flight)
+        time.sleep(0.05)
+        self.send_body(json.dumps({'path': self.path}).encode())
+        with _Handler.lock:
+            _Handler.in_flight -= 1
+        if self.path.endswith('/hangup'):
+            # keep-alive, as far as the client knows, but we're hanging up anyway.
+            self.close_connection = True
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        _Handler.posts.append(data)
+        self.send_body(json.dumps({'path': self.path, 'data': data}).encode())
+
+
+class TestAPI(TestCase):
+    def setUp(self):
+        self.api = API(serve(self, _Handler).base + '/api', {}, pool_size=4)
+
+    def tearDown(self):
+        self.api.close()
+
+    def test_get_json_many(self):
+        _Handler.most_in_flight = 0
+        paths = ['/addon/%d' % i for i in range(20)]
+        self.assertEqual(self.api.get_json_many(paths), [{'path': '/api' + path} for path in paths])
+        self.assertEqual(_Handler.most_in_flight, 4)
+
+    def test_reconnect(self):
+        self.assertEqual(self.api.get_json('/hangup'), {'path': '/api/hangup'})
+        time.sleep(0.1)
+        # the pooled connection is dead now; this has to notice and try again on a new one.
+        self.assertEqual(self.api.get_json('/after'), {'path': '/api/after'})
+
+    def test_post_after_hangup(self):
+        _Handler.posts = []
+        self.api.get_json('/hangup')
+        time.sleep(0.1)
+        # the same goes for a POST: it never reached the server, so it's sent again, once.
+        self.assertEqual(self.api.post_json('/addon', [1]), {'path': '/api/addon', 'data': [1]})
+        self.assertEqual(_Handler.posts, [[1]])
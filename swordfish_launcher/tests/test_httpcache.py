@@ -0,0 +1,75 @@
+from unittest import TestCase
+import json
+import tempfile
+from swordfish_launcher.downloader.http_api import API
+from swordfish_launcher.downloader.httpcache import HTTPCache, HTTP_CACHE
+from swordfish_launcher.tests.httpfixture import QuietHandler, serve
+
+PACKS = json.dumps([{'name': 'Skyfactory'}]).encode()
+
+
+class _Handler(QuietHandler):
+    requests = []
+
+    def do_GET(self):
+        _Handler.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('ETag', '"v1"')
+            self.end_headers()
+            return
+        headers = [('ETag', '"v1"')]
+        if self.path == '/fresh':
+            headers.append(('Cache-Control', 'max-age=3600'))
+        self.send_body(PACKS, headers=headers)
+
+
+class TestHTTPCache(TestCase):
+    def setUp(self):
+        _Handler.requests = []
+        self.base = serve(self, _Handler).base
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_revalidate_and_fresh(self):
+        cache = HTTPCache(self.temp_dir.name)
+        for _ in range(2):
+            self.assertEqual(cache.get_json(self.base + '/packs'), [{'name': 'Skyfactory'}])
+            self.assertEqual(cache.get_json(self.base + '/fresh'), [{'name': 'Skyfactory'}])
+        # /packs has no max-age so it's revalidated, and gets a 304; /fresh is served from disk the second time.
+        self.assertEqual(_Handler.requests, [('/packs', None), ('/fresh', None), ('/packs', '"v1"')])
+
+        # an override beats the server, and a new cache over the same directory picks up where this one left off.
+        cache = HTTPCache(self.temp_dir.name)
+        cache.set_ttl(self.base + '/pa', 60)
+        self.assertEqual(cache.get_json(self.base + '/packs'), [{'name': 'Skyfactory'}])
+        self.assertEqual(len(_Handler.requests), 3)
+
+    def test_ttl_wildcard(self):
+        cache = HTTPCache(self.temp_dir.name)
+        cache.set_ttl(self.base + '/modpack/', 60)
+        cache.set_ttl(self.base + '/modpack/*/', 3600)
+        self.assertEqual(cache._ttl(self.base + '/modpack/pack1', None), 60)
+        self.assertEqual(cache._ttl(self.base + '/modpack/pack1/1.0', None), 3600)
+        self.assertEqual(cache._ttl(self.base + '/modpack//1.0', None), 60)
+        self.assertEqual(cache._ttl(self.base + '/other', 5), 5)
+
+    def test_stale_when_offline(self):
+        cache = HTTPCache(self.temp_dir.name)
+        cache.get(self.base + '/packs')
+
+        def offline(url, headers):
+            raise ConnectionRefusedError
+        self.assertEqual(cache.get(self.base + '/packs', offline), PACKS)
+
+    def test_api(self):
+        HTTP_CACHE.configure(self.temp_dir.name)
+        try:
+            api = API(self.base + '/api', {})
+            self.assertEqual(api.get_json('/packs'), [{'name': 'Skyfactory'}])
+            self.assertEqual(api.get_json('/packs'), [{'name': 'Skyfactory'}])
+        finally:
+            HTTP_CACHE.configure(None)
+        self.assertEqual(_Handler.requests, [('/api/packs', None), ('/api/packs', '"v1"')])
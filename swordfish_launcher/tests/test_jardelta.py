@@ -0,0 +1,103 @@
+from unittest import TestCase
+import hashlib
+import io
+import os
+import tempfile
+import zipfile
+from swordfish_launcher.downloader.jardelta import patch_jar, plan_delta
+from swordfish_launcher.downloader.zipprobe import ZipProber
+from swordfish_launcher.tests.httpfixture import QuietHandler, serve
+
+
+def _jar(entries, date_time):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data, extra in entries:
+            info = zipfile.ZipInfo(name, date_time)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.extra = extra
+            zf.writestr(info, data)
+    return out.getvalue()
+
+
+ASSETS = [('assets/mod/textures/t%d.png' % i, os.urandom(4000), b'') for i in range(200)]
+OLD = _jar([('META-INF/MANIFEST.MF', b'Version: 1\n', b'')] + ASSETS + [('com/example/Mod.class', b'old' * 500, b'')],
+           (2020, 1, 1, 0, 0, 0))
+NEW = _jar([('META-INF/MANIFEST.MF', b'Version: 2\n', b'')] + ASSETS[:100] +
+           [('com/example/New.class', os.urandom(900), b'')] + ASSETS[100:] +
+           [('com/example/Mod.class', b'new' * 500, b'')], (2020, 2, 3, 4, 5, 6))
+
+
+class _Handler(QuietHandler):
+    files = {}
+    ranges = []
+    multirange = True
+
+    def do_GET(self):
+        data = _Handler.files[self.path]
+        byte_range = self.headers.get('Range')
+        _Handler.ranges.append(byte_range)
+        if byte_range and ',' in byte_range and not _Handler.multirange:
+            self.send_body(data)
+        else:
+            self.send_ranges(data)
+
+
+class TestJarDelta(TestCase):
+    def setUp(self):
+        _Handler.files = {'/new.jar': NEW}
+        _Handler.ranges = []
+        _Handler.multirange = True
+        self.url = serve(self, _Handler).base + '/new.jar'
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.old_path = os.path.join(self.temp_dir.name, 'mod.jar')
+        with open(self.old_path, 'wb') as f:
+            f.write(OLD)
+        self.prober = ZipProber()
+
+    def tearDown(self):
+        self.prober.close()
+        self.temp_dir.cleanup()
+
+    def _patch(self, outpath=None):
+        stats = patch_jar(self.old_path, self.url, outpath or self.old_path, {'sha1': hashlib.sha1(NEW).hexdigest()},
+                          prober=self.prober)
+        with open(outpath or self.old_path, 'rb') as f:
+            self.assertEqual(f.read(), NEW)
+        return stats
+
+    def test_plan(self):
+        tail = self.prober.probe([self.url])[self.url]
+        plan = plan_delta(self.old_path, tail)
+        # the manifest, the new class and the changed class; the textures all come from the old jar.
+        self.assertEqual(len(plan.reuse), 200)
+        self.assertEqual(plan.reused_bytes + plan.fetched_bytes + len(tail.data), len(NEW))
+
+    def test_patch(self):
+        stats = self._patch(os.path.join(self.temp_dir.name, 'mod-2.jar'))
+        self.assertEqual(stats.length, len(NEW))
+        self.assertLess(stats.fetched, len(NEW) // 50)
+        # the probe, then one request with all three ranges in it.
+        self.assertEqual(len(_Handler.ranges), 3)
+        self.assertEqual(_Handler.ranges[-1].count(','), 2)
+
+    def test_no_multirange(self):
+        _Handler.multirange = False
+        stats = self._patch()
+        self.assertEqual((stats.reused, stats.fetched), (0, len(NEW)))
+
+    def test_not_identical(self):
+        # same contents, but a different extra field in every local header: the patched jar comes out wrong, so it's
+        # downloaded whole instead.
+        global NEW
+        new = NEW
+        NEW = _Handler.files['/new.jar'] = _jar([(name, data, b'\xfe\xca\x04\x00abcd') for name, data, _ in ASSETS],
+                                                (2020, 1, 1, 0, 0, 0))
+        with open(self.old_path, 'wb') as f:
+            f.write(_jar([(name, data, b'\xfe\xca\x04\x00wxyz') for name, data, _ in ASSETS], (2020, 1, 1, 0, 0, 0)))
+        try:
+            stats = self._patch()
+        finally:
+            NEW = new
+        self.assertEqual((stats.reused, stats.fetched), (0, stats.length))
+        self.assertIsNone(_Handler.ranges[-1])
@@ -0,0 +1,77 @@
+from unittest import TestCase
+import os
+import socket
+from swordfish_launcher.downloader.pipeline import PipelinedConnection
+from swordfish_launcher.tests.httpfixture import QuietHandler, serve
+
+FILES = {'/%d.bin' % i: os.urandom(1000 + 37 * i) for i in range(50)}
+
+
+class _Handler(QuietHandler):
+    # how many requests each connection gets answered before the server hangs up on it, regardless of what's queued
+    # behind them.
+    limit = 7
+    # whether it says so first, with Connection: close.
+    announce = False
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        _Handler.connections += 1
+        self.served = 0
+
+    def do_GET(self):
+        self.served += 1
+        last = self.served >= _Handler.limit
+        self.send_body(FILES[self.path], headers=[('Connection', 'close')] if last and _Handler.announce else [])
+        if last:
+            # hang up politely, like a real server would: closing with the rest of the pipeline still unread would
+            # send a reset, and the client could lose the responses it hasn't read yet along with it.
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_WR)
+            self.connection.settimeout(5)
+            try:
+                while self.connection.recv(65536):
+                    pass
+            except OSError:
+                pass
+            self.close_connection = True
+
+
+class TestPipelinedConnection(TestCase):
+    def setUp(self):
+        _Handler.limit = 7
+        _Handler.announce = False
+        _Handler.connections = 0
+        self.port = serve(self, _Handler).port
+
+    def _fetch_all(self):
+        conn = PipelinedConnection('127.0.0.1', self.port, depth=8, https=False, timeout=10)
+        paths = list(FILES)
+        received = {}
+        try:
+            while paths or conn.outstanding:
+                while paths and conn.can_send():
+                    path = paths.pop(0)
+                    conn.send_request('GET', path, token=path)
+                path, resp = conn.get_response()
+                received[path] = resp.read()
+        finally:
+            conn.close()
+        return received
+
+    def test_pipeline(self):
+        _Handler.limit = 1000
+        self.assertEqual(self._fetch_all(), FILES)
+        self.assertEqual(_Handler.connections, 1)
+
+    def test_server_hangs_up(self):
+        # every seventh response, the server closes the connection with the next few requests still unanswered.
+        # they're sent again on a new one.
+        self.assertEqual(self._fetch_all(), FILES)
+        self.assertEqual(_Handler.connections, -(-len(FILES) // _Handler.limit))
+
+    def test_connection_close(self):
+        _Handler.announce = True
+        self.assertEqual(self._fetch_all(), FILES)
+        self.assertEqual(_Handler.connections, -(-len(FILES) // _Handler.limit))
@@ -0,0 +1,72 @@
+from unittest import TestCase
+from swordfish_launcher.downloader.ratelimit import BandwidthLimiter
+
+
+class _Clock:
+    def __init__(self, now=100.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestBandwidthLimiter(TestCase):
+    def setUp(self):
+        self.clock = _Clock()
+        self.limiter = BandwidthLimiter(1000, burst=0.25, clock=self.clock)
+
+    def _share(self, consumers, seconds, chunk=50):
+        """Have every one of consumers, (name, weight, max_share), download flat out for a while, each sleeping as
+        long as it's told to after every chunk.  Returns how many bytes each got."""
+        ready = {name: self.clock.now for name, _, _ in consumers}
+        received = dict.fromkeys(ready, 0)
+        end = self.clock.now + seconds
+        while True:
+            name, weight, max_share = min(consumers, key=lambda consumer: ready[consumer[0]])
+            if ready[name] >= end:
+                return received
+            self.clock.now = ready[name]
+            received[name] += chunk
+            ready[name] = self.clock.now + self.limiter.reserve(chunk, name, weight, max_share)
+
+    def test_no_cap(self):
+        limiter = BandwidthLimiter(clock=self.clock)
+        self.assertEqual(limiter.reserve(10 ** 9, 'job'), 0)
+
+    def test_burst(self):
+        # a quarter of a second's worth goes straight through after being idle...
+        self.assertEqual(self.limiter.reserve(250, 'job'), 0)
+        # and then the bucket's empty.
+        self.assertAlmostEqual(self.limiter.reserve(250, 'job'), 0.25)
+        self.assertAlmostEqual(self.limiter.reserve(100, 'job'), 0.35)
+
+    def test_refill(self):
+        self.limiter.reserve(500, 'job')
+        # half a second later, the debt's paid off and another quarter second's worth has saved up...
+        self.clock.now += 0.5
+        self.assertEqual(self.limiter.reserve(250, 'job'), 0)
+        # but no more than that, however long it's been.
+        self.clock.now += 0.9
+        self.assertAlmostEqual(self.limiter.reserve(500, 'job'), 0.25)
+
+    def test_rate(self):
+        received = self._share([('job', 1.0, None)], 10)
+        # the cap, plus the burst it started with.
+        self.assertAlmostEqual(received['job'], 10250, delta=100)
+
+    def test_weights(self):
+        received = self._share([('game', 3.0, None), ('update', 1.0, None)], 10)
+        self.assertAlmostEqual(sum(received.values()), 10250, delta=200)
+        self.assertAlmostEqual(received['game'] / received['update'], 3, delta=0.2)
+
+    def test_max_share(self):
+        # nobody else wants it, but the background job still only gets its 30%.
+        received = self._share([('update', 1.0, 0.3)], 10)
+        self.assertAlmostEqual(received['update'], 3000, delta=300)
+
+    def test_idle_consumer(self):
+        self._share([('game', 3.0, None), ('update', 1.0, None)], 1)
+        # once the game's done downloading, the update gets the lot.
+        self.clock.now += 2
+        received = self._share([('update', 1.0, None)], 10)
+        self.assertAlmostEqual(received['update'], 10250, delta=200)
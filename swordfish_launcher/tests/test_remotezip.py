@@ -0,0 +1,97 @@
+from unittest import TestCase
+import io
+import json
+import os
+import zipfile
+from swordfish_launcher.downloader.remotezip import RemoteFile, RemoteZipFile, read_members
+from swordfish_launcher.downloader.zipprobe import ZipProber
+from swordfish_launcher.tests.httpfixture import QuietHandler, serve
+
+
+def _jar(entries):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, data in entries:
+            zf.writestr(name, data)
+    return out.getvalue()
+
+
+MCMOD = json.dumps([{'modid': 'example', 'version': '1.0'}]).encode()
+TOML = b'[[mods]]\nmodId="example"\nversion="1.0"\n'
+JAR = _jar([('assets/t%d.png' % i, os.urandom(5000)) for i in range(100)] + [('mcmod.info', MCMOD)] +
+           [('assets/u%d.png' % i, os.urandom(5000)) for i in range(100)] + [('META-INF/mods.toml', TOML)] +
+           [('com/example/C%d.class' % i, os.urandom(3000)) for i in range(50)])
+
+
+class _Handler(QuietHandler):
+    sent = 0
+    requests = []
+    ignore_ranges = False
+
+    def do_GET(self):
+        _Handler.requests.append((self.path, self.headers.get('Range')))
+        if self.path.startswith('/moved/'):
+            self.send_redirect(self.path[len('/moved'):])
+        elif _Handler.ignore_ranges:
+            self.send_body(JAR)
+        else:
+            self.send_ranges(JAR)
+
+    def send_body(self, body, *args):
+        _Handler.sent += len(body)
+        super().send_body(body, *args)
+
+
+class TestRemoteZip(TestCase):
+    def setUp(self):
+        _Handler.sent = 0
+        _Handler.requests = []
+        _Handler.ignore_ranges = False
+        self.base = serve(self, _Handler).base
+        self.prober = ZipProber()
+
+    def tearDown(self):
+        self.prober.close()
+
+    def test_read(self):
+        with RemoteZipFile(self.base + '/mod.jar', prober=self.prober) as zf:
+            self.assertEqual(zf.namelist(), zipfile.ZipFile(io.BytesIO(JAR)).namelist())
+            probed = len(_Handler.requests)
+            self.assertEqual(zf.read('mcmod.info'), MCMOD)
+            self.assertEqual(zf.read('mcmod.info'), MCMOD)
+            self.assertEqual(len(_Handler.requests), probed + 1)
+            # both entries in one request, one range each.
+            zf.prefetch(['META-INF/mods.toml', 'assets/t3.png', 'assets/t4.png'])
+            self.assertEqual(len(_Handler.requests), probed + 2)
+            self.assertEqual(_Handler.requests[-1][1].count(','), 1)
+            self.assertEqual(zf.read('META-INF/mods.toml'), TOML)
+            self.assertEqual(zf.read('assets/t4.png'), zipfile.ZipFile(io.BytesIO(JAR)).read('assets/t4.png'))
+            self.assertEqual(len(_Handler.requests), probed + 2)
+        self.assertLess(_Handler.sent, len(JAR) // 10)
+
+    def test_file_object(self):
+        # anything that takes a file object can have a RemoteFile.
+        tail = self.prober.probe([self.base + '/mod.jar'])[self.base + '/mod.jar']
+        f = RemoteFile(self.base + '/moved/mod.jar', tail, self.prober)
+        with f, zipfile.ZipFile(f) as zf:
+            self.assertEqual(zf.read('META-INF/mods.toml'), TOML)
+            self.assertEqual(f.url, self.base + '/mod.jar')
+            f.seek(0)
+            self.assertEqual(f.read(4), b'PK\x03\x04')
+
+    def test_ranges_ignored(self):
+        tail = self.prober.probe([self.base + '/mod.jar'])[self.base + '/mod.jar']
+        _Handler.ignore_ranges = True
+        with RemoteZipFile(self.base + '/mod.jar', tail, self.prober) as zf:
+            self.assertEqual(zf.read('mcmod.info'), MCMOD)
+            self.assertEqual(zf.remote.fetched, len(JAR))
+            zf.prefetch(zf.namelist())
+            self.assertEqual(zf.remote.requests, 1)
+
+    def test_read_members(self):
+        urls = [self.base + '/mod.jar?%d' % i for i in range(20)]
+        results = read_members(urls + [self.base + '/moved/mod.jar', 'ftp://127.0.0.1/mod.jar'], prober=self.prober)
+        for url in urls + [self.base + '/moved/mod.jar']:
+            self.assertEqual(results[url], {'mcmod.info': MCMOD, 'META-INF/mods.toml': TOML})
+        self.assertIsInstance(results['ftp://127.0.0.1/mod.jar'], Exception)
+        self.assertLess(_Handler.sent, len(JAR))
@@ -0,0 +1,142 @@
+from unittest import TestCase
+from unittest.mock import patch
+import os
+import tempfile
+import threading
+import time
+from swordfish_launcher.downloader import Downloader, DownloadJob
+from swordfish_launcher.downloader.pipeline import PipelinedConnection
+from swordfish_launcher.downloader.scheduler import JobScheduler
+from swordfish_launcher.tests.httpfixture import QuietHandler, serve
+
+FILES = {'/big.bin': os.urandom(3 * 1024 * 1024), '/small.bin': os.urandom(1000)}
+
+
+class _Handler(QuietHandler):
+    # (path, Range) of every request.
+    requests = []
+    # set once the big file has been asked for, and once it's started coming down.
+    asked = threading.Event()
+    started = threading.Event()
+    # how long the big file's headers take.
+    header_delay = 0
+
+    def do_GET(self):
+        _Handler.requests.append((self.path, self.headers.get('Range')))
+        data = FILES[self.path]
+        if self.path == '/big.bin':
+            _Handler.asked.set()
+            time.sleep(_Handler.header_delay)
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'][len('bytes='):].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        try:
+            # the big one trickles out, so there's time to preempt it.
+            for offset in range(start, len(data), 64 * 1024):
+                self.wfile.write(data[offset:offset + 64 * 1024])
+                self.wfile.flush()
+                if self.path == '/big.bin':
+                    _Handler.started.set()
+                    time.sleep(0.01)
+        except ConnectionError:
+            # preempted: the downloader hung up on us.
+            self.close_connection = True
+
+
+class TestJobScheduler(TestCase):
+    def test_priority_order(self):
+        scheduler = JobScheduler(aging_rate=0)
+        low, high, middle = DownloadJob('.', 0), DownloadJob('.', 10), DownloadJob('.', 5)
+        for job in (low, high, middle):
+            scheduler.push(job)
+        self.assertEqual([scheduler.pop(False) for _ in range(4)], [high, middle, low, None])
+
+    def test_aging(self):
+        scheduler = JobScheduler(aging_rate=1 / 60)
+        with patch('time.monotonic', return_value=1000):
+            background = DownloadJob('.', 0)
+            scheduler.push(background)
+        # ten minutes later, a job with priority 5 shows up.  the background job has aged to 10 and goes first.
+        with patch('time.monotonic', return_value=1600):
+            newcomer = DownloadJob('.', 5)
+            scheduler.push(newcomer)
+            self.assertAlmostEqual(scheduler.effective_priority(background), 10)
+        self.assertIs(scheduler.pop(False), background)
+        # and when it's preempted and put back, it keeps its age.
+        scheduler.push(background)
+        self.assertIs(scheduler.pop(False), background)
+
+
+class TestPreemption(TestCase):
+    def setUp(self):
+        _Handler.requests = []
+        _Handler.asked.clear()
+        _Handler.started.clear()
+        _Handler.header_delay = 0
+        server = serve(self, _Handler)
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.downloader = Downloader('127.0.0.1', '/{}')
+        self.downloader.client = PipelinedConnection('127.0.0.1', server.port, https=False)
+
+    def tearDown(self):
+        self.downloader.shutdown()
+        self.temp_dir.cleanup()
+
+    def test_preempt_and_resume(self):
+        background = DownloadJob(os.path.join(self.temp_dir.name, 'background'), priority=0)
+        background.add('big.bin', ('big.bin',))
+        background.finalize()
+        self.downloader.enqueue_job(background)
+        self.downloader.start()
+        self.assertTrue(_Handler.started.wait(5))
+        part = os.path.join(background.outputdir, 'big.bin.part')
+        deadline = time.monotonic() + 5
+        while not (os.path.exists(part) and os.path.getsize(part)) and time.monotonic() < deadline:
+            time.sleep(0.005)
+
+        urgent = DownloadJob(os.path.join(self.temp_dir.name, 'urgent'), priority=10)
+        urgent.add('small.bin', ('small.bin',))
+        urgent.finalize()
+        self.downloader.enqueue_job(urgent)
+        self.assertEqual(urgent.join(), {})
+        # the big file was parked, not finished first.
+        self.assertFalse(background.done.is_set())
+        self.assertTrue(os.path.exists(os.path.join(background.outputdir, 'big.bin.part')))
+
+        self.assertEqual(background.join(), {})
+        with open(os.path.join(urgent.outputdir, 'small.bin'), 'rb') as f:
+            self.assertEqual(f.read(), FILES['/small.bin'])
+        with open(os.path.join(background.outputdir, 'big.bin'), 'rb') as f:
+            self.assertEqual(f.read(), FILES['/big.bin'])
+        # and it picked up from where it was parked, rather than starting again.
+        paths = [path for path, _ in _Handler.requests]
+        self.assertEqual(paths, ['/big.bin', '/small.bin', '/big.bin'])
+        resumed_from = int(_Handler.requests[2][1][len('bytes='):].rstrip('-'))
+        self.assertGreater(resumed_from, 0)
+
+    def test_preempt_before_response(self):
+        # the background job's request is in flight, but nothing's come back yet, so nothing's being read.
+        _Handler.header_delay = 0.3
+        background = DownloadJob(os.path.join(self.temp_dir.name, 'background'), priority=0)
+        background.add('big.bin', ('big.bin',))
+        background.finalize()
+        self.downloader.enqueue_job(background)
+        self.downloader.start()
+        self.assertTrue(_Handler.asked.wait(5))
+
+        urgent = DownloadJob(os.path.join(self.temp_dir.name, 'urgent'), priority=10)
+        urgent.add('small.bin', ('small.bin',))
+        urgent.finalize()
+        self.downloader.enqueue_job(urgent)
+        self.assertEqual(urgent.join(), {})
+        self.assertFalse(background.done.is_set())
+        self.assertEqual(background.join(), {})
+        with open(os.path.join(background.outputdir, 'big.bin'), 'rb') as f:
+            self.assertEqual(f.read(), FILES['/big.bin'])
+        self.assertEqual([path for path, _ in _Handler.requests], ['/big.bin', '/small.bin', '/big.bin'])
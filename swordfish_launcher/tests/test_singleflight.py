@@ -0,0 +1,66 @@
+from unittest import TestCase
+import os
+import tempfile
+import threading
+import time
+from swordfish_launcher.downloader import Downloader, DownloadJob
+from swordfish_launcher.downloader.pipeline import PipelinedConnection
+from swordfish_launcher.downloader.singleflight import SingleFlight
+from swordfish_launcher.tests.httpfixture import QuietHandler, serve
+
+LIBRARY = os.urandom(200000)
+
+
+class _Handler(QuietHandler):
+    paths = []
+
+    def do_GET(self):
+        _Handler.paths.append(self.path)
+        # slow enough that the second job's request comes along while the first is still in flight.
+        time.sleep(0.2)
+        self.send_body(LIBRARY)
+
+
+class TestSingleFlight(TestCase):
+    def test_do(self):
+        flights = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def slow():
+            calls.append(1)
+            release.wait()
+            return 'result'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flights.do('key', slow))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ['result'] * 5)
+        # and once it's done, the next call goes through again.
+        self.assertEqual(flights.do('key', lambda: 'again'), 'again')
+
+    def test_downloader(self):
+        server = serve(self, _Handler)
+        downloader = Downloader('127.0.0.1', '/{}')
+        downloader.client = PipelinedConnection('127.0.0.1', server.port, https=False)
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                jobs = [DownloadJob(os.path.join(temp_dir, instance)) for instance in ('one', 'two')]
+                for job in jobs:
+                    job.add('libraries/forge.jar', ('forge.jar',))
+                    job.finalize()
+                    downloader.enqueue_job(job)
+                downloader.start()
+                for job in jobs:
+                    self.assertEqual(job.join(), {})
+                    with open(os.path.join(job.outputdir, 'libraries', 'forge.jar'), 'rb') as f:
+                        self.assertEqual(f.read(), LIBRARY)
+                self.assertEqual(_Handler.paths, ['/forge.jar'])
+        finally:
+            downloader.shutdown()
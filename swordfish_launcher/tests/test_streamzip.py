@@ -0,0 +1,138 @@
+import io
+import os
+import tempfile
+import zipfile
+from unittest import TestCase
+from swordfish_launcher.downloader.overrides import OverrideIndex
+from swordfish_launcher.downloader.streamzip import StreamingUnzipper
+
+MEMBERS = {
+    'manifest.json': b'{"name": "test"}',
+    'overrides/config/a.cfg': b'a=1\n' * 1000,
+    'overrides/mods/b.jar': os.urandom(200000),
+    'overrides/empty.txt': b'',
+}
+
+
+class _Unseekable(io.RawIOBase):
+    """zipfile writes data descriptors when it can't go back and fill the sizes in."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+
+def make_zip(compression, seekable=True):
+    out = io.BytesIO() if seekable else _Unseekable()
+    with zipfile.ZipFile(out, 'w', compression) as zf:
+        for name, data in MEMBERS.items():
+            zf.writestr(name, data)
+    return bytes(out.getvalue() if seekable else out.data)
+
+
+class TestStreamingUnzipper(TestCase):
+    def check(self, archive, chunk_size=1000):
+        with tempfile.TemporaryDirectory() as outputdir:
+            unzipper = StreamingUnzipper(outputdir, 'overrides', keep=('manifest.json',))
+            for i in range(0, len(archive), chunk_size):
+                unzipper.write(archive[i:i + chunk_size])
+            unzipper.finish()
+            self.assertEqual(unzipper.kept, {'manifest.json': MEMBERS['manifest.json']})
+            for name, data in MEMBERS.items():
+                if name.startswith('overrides/'):
+                    with open(os.path.join(outputdir, *name[10:].split('/')), 'rb') as f:
+                        self.assertEqual(f.read(), data)
+            self.assertFalse(os.path.exists(os.path.join(outputdir, 'manifest.json')))
+
+    def test_stored(self):
+        self.check(make_zip(zipfile.ZIP_STORED))
+
+    def test_deflated(self):
+        self.check(make_zip(zipfile.ZIP_DEFLATED), chunk_size=7)
+
+    def test_deflated_data_descriptors(self):
+        self.check(make_zip(zipfile.ZIP_DEFLATED, seekable=False))
+
+    def test_stored_data_descriptors(self):
+        # these can't be streamed, and have to come from the central directory.
+        self.check(make_zip(zipfile.ZIP_STORED, seekable=False))
+
+    def test_truncated(self):
+        archive = make_zip(zipfile.ZIP_DEFLATED)
+        with tempfile.TemporaryDirectory() as outputdir:
+            unzipper = StreamingUnzipper(outputdir)
+            unzipper.write(archive[:len(archive) // 2])
+            self.assertRaises(zipfile.BadZipFile, unzipper.finish)
+
+
+class TestOverrideIndex(TestCase):
+    def apply(self, outputdir, members, seekable=True):
+        out = io.BytesIO() if seekable else _Unseekable()
+        with zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED) as zf:
+            for name, data in members.items():
+                zf.writestr('overrides/' + name, data)
+        index = OverrideIndex(outputdir)
+        unzipper = StreamingUnzipper(outputdir, 'overrides', index=index)
+        unzipper.write(out.getvalue() if seekable else bytes(out.data))
+        unzipper.finish()
+        return unzipper, index, index.finish()
+
+    def check_update(self, seekable):
+        v1 = {'config/%d.cfg' % i: b'value=%d\n' % i for i in range(50)}
+        v1['scripts/old.zs'] = b'gone in v2'
+        v1['scripts/edited.zs'] = b'gone in v2, but the user changed it'
+        v2 = {name: data for name, data in v1.items() if not name.startswith('scripts/')}
+        v2['config/7.cfg'] = b'value=seven\n'
+        v2['config/new.cfg'] = b'new=1\n'
+        with tempfile.TemporaryDirectory() as outputdir:
+            unzipper, index, removed = self.apply(outputdir, v1, seekable)
+            self.assertEqual(len(unzipper.extracted), 52)
+            self.assertEqual(removed, [])
+            with open(os.path.join(outputdir, 'scripts', 'edited.zs'), 'ab') as f:
+                f.write(b' like this')
+
+            unzipper, index, removed = self.apply(outputdir, v2, seekable)
+            self.assertEqual(sorted(os.path.relpath(path, outputdir) for path in unzipper.extracted),
+                             [os.path.join('config', '7.cfg'), os.path.join('config', 'new.cfg')])
+            self.assertEqual(index.skipped, 49)
+            self.assertEqual(removed, [os.path.join(outputdir, 'scripts', 'old.zs')])
+            self.assertTrue(os.path.exists(os.path.join(outputdir, 'scripts', 'edited.zs')))
+            for name, data in v2.items():
+                with open(os.path.join(outputdir, *name.split('/')), 'rb') as f:
+                    self.assertEqual(f.read(), data)
+            self.assertFalse([name for name in os.listdir(os.path.join(outputdir, 'config')) if name.endswith('.tmp')])
+
+            # a file someone changed that's still in the pack gets put back.
+            with open(os.path.join(outputdir, 'config', '3.cfg'), 'wb') as f:
+                f.write(b'value=X\n')
+            unzipper, index, removed = self.apply(outputdir, v2, seekable)
+            self.assertEqual(unzipper.extracted, [os.path.join(outputdir, 'config', '3.cfg')])
+
+    def test_update(self):
+        self.check_update(seekable=True)
+
+    def test_update_from_central_directory(self):
+        self.check_update(seekable=False)
+
+
+class TestZipExtractor(TestCase):
+    def test_extract(self):
+        from swordfish_launcher.downloader import ZipExtractor
+        with tempfile.TemporaryDirectory() as outputdir:
+            archive = tempfile.TemporaryFile()
+            archive.write(make_zip(zipfile.ZIP_DEFLATED))
+            extractor = ZipExtractor(workers=3)
+            extractor.BATCH_FILES = 1
+            extractor.extract(archive, 'overrides', outputdir)
+            self.assertEqual(extractor.failures, {})
+            self.assertTrue(archive.closed)
+            for name, data in MEMBERS.items():
+                if name.startswith('overrides/'):
+                    with open(os.path.join(outputdir, *name[10:].split('/')), 'rb') as f:
+                        self.assertEqual(f.read(), data)
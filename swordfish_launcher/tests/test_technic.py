@@ -0,0 +1,109 @@
+from unittest import TestCase, mock
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+from swordfish_launcher.downloader.http_api import API
+from swordfish_launcher.downloader.httpcache import HTTP_CACHE
+from swordfish_launcher.downloader.third_party import technic
+from swordfish_launcher.downloader.third_party.technic.solder import SolderClient
+from swordfish_launcher.tests.httpfixture import QuietHandler, serve
+
+SLUGS = ['pack%d' % i for i in range(12)]
+
+
+class _Handler(QuietHandler):
+    paths = []
+    active = 0
+    most_active = 0
+    lock = threading.Lock()
+
+    def _answer(self):
+        path = self.path.partition('?')[0]
+        base = 'http://%s:%d' % self.server.server_address
+        if path == '/search':
+            return {'modpacks': [{'slug': slug, 'name': slug.title(), 'iconUrl': None} for slug in SLUGS]}
+        parts = [urllib.parse.unquote(part) for part in path.strip('/').split('/')]
+        if parts[0] == 'modpack':
+            return {'solder': base + '/api/', 'description': 'about ' + parts[1], 'url': None, 'version': None,
+                    'icon': {'url': None}, 'background': {'url': None}}
+        if parts[:2] == ['api', 'modpack'] and len(parts) == 3:
+            return {'builds': ['1.0', '1.1', '2.0'], 'latest': '2.0', 'recommended': '1.1', 'minecraft': '1.12.2'}
+        if parts[:2] == ['api', 'modpack']:
+            return {'minecraft': '1.12.2', 'forge': None, 'mods': [{'name': 'mod', 'version': parts[3]}]}
+
+    def do_GET(self):
+        with _Handler.lock:
+            _Handler.paths.append(self.path)
+            _Handler.active += 1
+            _Handler.most_active = max(_Handler.most_active, _Handler.active)
+        try:
+            time.sleep(0.02)
+            data = self._answer()
+        finally:
+            with _Handler.lock:
+                _Handler.active -= 1
+        self.send_body(json.dumps(data).encode(), 200 if data is not None else 404)
+
+
+class TestTechnic(TestCase):
+    def setUp(self):
+        _Handler.paths = []
+        _Handler.most_active = 0
+        self.base = serve(self, _Handler).base
+        self.temp_dir = tempfile.TemporaryDirectory()
+        HTTP_CACHE.configure(os.path.join(self.temp_dir.name, 'http'))
+        # AbstractModpack makes itself a directory under ~.
+        self.patches = [mock.patch.dict(os.environ, {'HOME': self.temp_dir.name}),
+                        mock.patch.object(technic, 'TECHNIC_API', API(self.base, {}))]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        HTTP_CACHE.configure(None)
+        self.temp_dir.cleanup()
+
+    def test_search(self):
+        ready = []
+        packs = technic.TechnicModpack.search('pack')
+        # one request, and nothing else until somebody asks.
+        self.assertEqual(_Handler.paths, ['/search?build=minefish&q=pack'])
+        self.assertEqual([pack.slug for pack in packs], SLUGS)
+        self.assertIsNone(packs[0].versions)
+
+        for future in technic.TechnicModpack.hydrate(packs, ready.append):
+            future.result()
+        # the callbacks can run a moment after result() returns.
+        deadline = time.monotonic() + 5
+        while len(ready) < len(SLUGS) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sorted(pack.slug for pack in ready), sorted(SLUGS))
+        self.assertEqual(packs[3].versions, ['1.0', '1.1', '2.0'])
+        self.assertEqual(packs[3].recommended_version, '1.1')
+        self.assertEqual(packs[3].summary, 'about pack3')
+        self.assertEqual(len(_Handler.paths), 1 + 2 * len(SLUGS))
+        self.assertGreater(_Handler.most_active, 1)
+
+        # the versions are known now, so this is no more requests.
+        self.assertEqual(packs[3].getVersions(), ['1.0', '1.1', '2.0'])
+        self.assertEqual(len(_Handler.paths), 1 + 2 * len(SLUGS))
+
+    def test_solder_client(self):
+        client = SolderClient.for_url(self.base + '/api/')
+        self.assertIs(SolderClient.for_url(self.base + '/api'), client)
+        builds = client.builds('pack1', ['1.0', '1.1', '2.0', '1.0'])
+        self.assertEqual(sorted(builds), ['1.0', '1.1', '2.0'])
+        self.assertEqual(builds['2.0']['mods'], [{'name': 'mod', 'version': '2.0'}])
+        # builds don't change, so the second time round they come off the disk.  the pack's build list does, and
+        # asking for other packs' builds doesn't add any more TTLs to the cache.
+        requests = len(_Handler.paths)
+        self.assertEqual(client.build('pack1', '1.1'), builds['1.1'])
+        self.assertEqual(len(_Handler.paths), requests)
+        ttls = len(HTTP_CACHE._ttls)
+        client.builds('pack2', ['1.0'])
+        self.assertEqual(len(HTTP_CACHE._ttls), ttls)
+        client.close()
@@ -0,0 +1,151 @@
+from unittest import TestCase
+import hashlib
+import io
+import os
+import tempfile
+import zipfile
+from unittest import mock
+from swordfish_launcher.downloader import update
+from swordfish_launcher.downloader.aio import AsyncDownloader
+from swordfish_launcher.downloader.update import InstalledPack, PackItem, atl_items, plan_update, solder_items
+from swordfish_launcher.tests.httpfixture import QuietHandler, serve
+
+
+def _zip(files):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w') as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    return out.getvalue()
+
+
+FILES = {
+    '/a-1.jar': _zip({'a/A.class': os.urandom(5000)}),
+    '/a-2.jar': _zip({'a/A.class': os.urandom(5000)}),
+    '/b-1.jar': os.urandom(3000),
+    '/c-1.jar': os.urandom(4000),
+    '/d-1.jar': os.urandom(2000),
+    '/lib-1.zip': _zip({'mods/lib-1.jar': b'lib one', 'config/lib.cfg': b'x=1'}),
+    '/lib-2.zip': _zip({'mods/lib-2.jar': b'lib two', 'config/lib.cfg': b'x=2'}),
+}
+
+
+class _Handler(QuietHandler):
+    paths = []
+
+    def do_GET(self):
+        _Handler.paths.append(self.path)
+        data = FILES.get(self.path)
+        self.send_body(data or b'', 200 if data is not None else 404)
+
+
+class _ProgressBar:
+    def __init__(self):
+        self.total = None
+        self.done = 0
+
+    def reset(self):
+        pass
+
+    def configure(self, determinate, total):
+        self.total = total if determinate else None
+
+    def progress(self, amount):
+        self.done += amount
+
+
+class TestUpdate(TestCase):
+    def setUp(self):
+        _Handler.paths = []
+        self.base = serve(self, _Handler).base
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.downloader = AsyncDownloader()
+        self.downloader.start()
+
+    def tearDown(self):
+        self.downloader.shutdown()
+        self.temp_dir.cleanup()
+
+    def _jar(self, name, version):
+        path = '/%s-%s.jar' % (name, version)
+        return PackItem(name, version, 'mods/%s.jar' % path[1:-4], [self.base + path],
+                        {'md5': hashlib.md5(FILES[path]).hexdigest(), 'length': len(FILES[path])})
+
+    def _lib(self, version):
+        return solder_items({'mods': [{'name': 'lib', 'version': version, 'url': self.base + '/lib-%s.zip' % version,
+                                       'md5': hashlib.md5(FILES['/lib-%s.zip' % version]).hexdigest()}]})
+
+    def _files(self):
+        out = set()
+        for directory, _, files in os.walk(self.temp_dir.name):
+            for name in files:
+                out.add(os.path.relpath(os.path.join(directory, name), self.temp_dir.name).replace(os.path.sep, '/'))
+        return out
+
+    def test_update(self):
+        target = {item.identity: item for item in (self._jar('a', '1'), self._jar('b', '1'), self._jar('c', '1'))}
+        target.update(self._lib('1'))
+        plan = plan_update(InstalledPack(self.temp_dir.name), target)
+        self.assertEqual(len(plan.add), 4)
+        self.assertEqual(plan.execute(self.downloader), {})
+        self.assertEqual(self._files(), {'mods/a-1.jar', 'mods/b-1.jar', 'mods/c-1.jar', 'mods/lib-1.jar',
+                                         'config/lib.cfg', '.swordfish-installed.json'})
+
+        # a new version of a and of lib, no more c, and a new d.
+        _Handler.paths = []
+        target = {item.identity: item for item in (self._jar('a', '2'), self._jar('b', '1'), self._jar('d', '1'))}
+        target.update(self._lib('2'))
+        installed = InstalledPack(self.temp_dir.name)
+        plan = plan_update(installed, target)
+        self.assertEqual([item.identity for item in plan.add], ['d'])
+        self.assertEqual([item.identity for item in plan.replace], ['a', 'solder:lib'])
+        self.assertEqual(plan.remove, ['c'])
+        self.assertEqual(plan.unchanged, ['b'])
+        self.assertIsNone(plan.download_size)
+        self.assertEqual(plan.execute(self.downloader), {})
+        self.assertEqual(sorted(_Handler.paths), ['/a-2.jar', '/d-1.jar', '/lib-2.zip'])
+        self.assertEqual(self._files(), {'mods/a-2.jar', 'mods/b-1.jar', 'mods/d-1.jar', 'mods/lib-2.jar',
+                                         'config/lib.cfg', '.swordfish-installed.json'})
+        with open(os.path.join(self.temp_dir.name, 'config', 'lib.cfg'), 'rb') as f:
+            self.assertEqual(f.read(), b'x=2')
+        self.assertFalse(plan_update(InstalledPack(self.temp_dir.name), target))
+
+        # somebody deleted b, and the new d is nowhere to be found: b comes back, and the old d stays.
+        os.remove(os.path.join(self.temp_dir.name, 'mods', 'b-1.jar'))
+        target['d'] = PackItem('d', '2', 'mods/d-2.jar', [self.base + '/d-2.jar'], {})
+        plan = plan_update(InstalledPack(self.temp_dir.name), target)
+        self.assertEqual([item.identity for item in plan.replace], ['b', 'd'])
+        self.assertEqual(list(plan.execute(self.downloader)), [self.base + '/d-2.jar'])
+        self.assertIn('mods/b-1.jar', self._files())
+        self.assertIn('mods/d-1.jar', self._files())
+        self.assertEqual(InstalledPack(self.temp_dir.name).items['d']['version'], '1')
+
+    def test_patched_progress(self):
+        target = {item.identity: item for item in (self._jar('a', '1'), self._jar('b', '1'))}
+        self.assertEqual(plan_update(InstalledPack(self.temp_dir.name), target).execute(self.downloader), {})
+        _Handler.paths = []
+        target = {item.identity: item for item in (self._jar('a', '2'), self._jar('b', '1'), self._jar('d', '1'))}
+        plan = plan_update(InstalledPack(self.temp_dir.name), target)
+        progressbar = _ProgressBar()
+        with mock.patch.object(update, 'DELTA_THRESHOLD', 0):
+            self.assertEqual(plan.execute(self.downloader, progressbar=progressbar), {})
+        # a was patched (this server doesn't do ranges, so the probe got all of it), and only d went to the job.
+        self.assertEqual(sorted(_Handler.paths), ['/a-2.jar', '/d-1.jar'])
+        self.assertEqual(progressbar.total, len(FILES['/d-1.jar']))
+        self.assertEqual(progressbar.done, progressbar.total)
+        with open(os.path.join(self.temp_dir.name, 'mods', 'a-2.jar'), 'rb') as f:
+            self.assertEqual(f.read(), FILES['/a-2.jar'])
+
+    def test_atl_items(self):
+        items = atl_items({'mods': [
+            {'name': 'Foo', 'version': '1.2', 'url': 'mods/foo.jar', 'file': 'foo.jar', 'md5': 'abc', 'type': 'mods'},
+            {'name': 'Bar', 'version': '3', 'url': 'https://example/bar.zip', 'file': 'bar.zip', 'type': 'resourcepack',
+             'download': 'direct'},
+            {'name': 'Baz', 'version': '1', 'url': 'https://example/', 'file': 'baz.jar', 'type': 'mods',
+             'download': 'browser'},
+            {'name': 'Forge', 'version': '1', 'url': 'forge.jar', 'file': 'forge.jar', 'type': 'forge'},
+        ]})
+        self.assertEqual(sorted(items), ['atl:Bar', 'atl:Foo'])
+        self.assertEqual(items['atl:Foo'].urls, ['https://download.nodecdn.net/containers/atl/mods/foo.jar'])
+        self.assertEqual(items['atl:Foo'].digests, {'md5': 'abc'})
+        self.assertEqual(items['atl:Bar'].path, 'resourcepacks/bar.zip')
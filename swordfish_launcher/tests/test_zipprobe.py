@@ -0,0 +1,110 @@
+from unittest import TestCase
+import io
+import os
+import zipfile
+from swordfish_launcher.downloader.zipprobe import ZipProber
+from swordfish_launcher.tests.httpfixture import LocalServer, QuietHandler, serve
+
+
+def _zip(files, comment=b''):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w') as zf:
+        for name, data in files:
+            zf.writestr(name, data)
+        zf.comment = comment
+    return out.getvalue()
+
+
+ZIPS = {
+    '/tiny.jar': _zip([('a.txt', b'hello')]),
+    '/big.jar': _zip([('com/example/Class%d.class' % i, os.urandom(1000)) for i in range(300)]),
+    # a comment longer than the first read, so the EOCD record isn't in it.
+    '/comment.jar': _zip([('a.txt', os.urandom(20000))], comment=b'x' * 30000),
+    # more than 65535 entries makes zipfile write ZIP64 records.
+    '/zip64.jar': _zip([('%d' % i, b'') for i in range(70000)]),
+}
+for i in range(40):
+    ZIPS['/mod%d.jar' % i] = _zip([('mod%d/Mod.class' % i, os.urandom(5000))])
+
+
+class _Handler(QuietHandler):
+    connections = set()
+    ignore_ranges = False
+
+    def do_GET(self):
+        _Handler.connections.add(self.client_address)
+        if self.path.startswith('/moved/'):
+            self.send_redirect(self.path[len('/moved'):])
+        elif _Handler.ignore_ranges:
+            self.send_body(ZIPS[self.path])
+        else:
+            self.send_ranges(ZIPS[self.path])
+
+
+class _EdgeHandler(QuietHandler):
+    # like edge.forgecdn.net: sends everybody somewhere else.
+    target = None
+
+    def do_GET(self):
+        self.send_redirect(_EdgeHandler.target + self.path)
+
+
+class TestZipProber(TestCase):
+    def setUp(self):
+        _Handler.connections = set()
+        _Handler.ignore_ranges = False
+        self.base = serve(self, _Handler).base
+        self.prober = ZipProber(connections_per_host=2, depth=8)
+
+    def tearDown(self):
+        self.prober.close()
+
+    def _check(self, results):
+        self.assertEqual(sorted(results), sorted(self.base + path for path in ZIPS))
+        for path, data in ZIPS.items():
+            tail = results[self.base + path]
+            with zipfile.ZipFile(io.BytesIO(data)) as zf:
+                self.assertEqual(tail.offset, 0 if tail.complete else zf.start_dir, path)
+                expected = frozenset((info.filename, info.file_size, info.CRC) for info in zf.infolist())
+            self.assertEqual(tail.length, len(data))
+            self.assertEqual(data[tail.offset:], tail.data)
+            self.assertEqual(tail.signature(), expected)
+
+    def test_probe(self):
+        results = self.prober.probe(self.base + path for path in ZIPS)
+        self._check(results)
+        self.assertTrue(results[self.base + '/tiny.jar'].complete)
+        self.assertFalse(results[self.base + '/big.jar'].complete)
+        self.assertEqual(len(_Handler.connections), 2)
+
+    def test_ranges_ignored(self):
+        _Handler.ignore_ranges = True
+        results = self.prober.probe(self.base + path for path in ZIPS)
+        self.assertTrue(results[self.base + '/big.jar'].complete)
+        for path, data in ZIPS.items():
+            with zipfile.ZipFile(io.BytesIO(data)) as zf:
+                expected = frozenset((info.filename, info.file_size, info.CRC) for info in zf.infolist())
+            self.assertEqual(results[self.base + path].signature(), expected)
+
+    def test_not_a_zip(self):
+        ZIPS['/bad.jar'] = b'not a zip file' * 1000
+        try:
+            results = self.prober.probe([self.base + '/bad.jar', self.base + '/tiny.jar'])
+        finally:
+            del ZIPS['/bad.jar']
+        self.assertIsInstance(results[self.base + '/bad.jar'], zipfile.BadZipFile)
+        self.assertTrue(results[self.base + '/tiny.jar'].complete)
+
+    def test_redirects(self):
+        _EdgeHandler.target = self.base + '/moved'
+        with LocalServer(_EdgeHandler) as edge:
+            # another host, then the same host again.
+            results = self.prober.probe(edge.base + path for path in ZIPS)
+        self._check({url.replace(edge.base, self.base): tail for url, tail in results.items()})
+
+    def test_redirect_loop(self):
+        _EdgeHandler.target = ''
+        with LocalServer(_EdgeHandler) as edge:
+            url = edge.base + '/tiny.jar'
+            results = self.prober.probe([url])
+        self.assertIsInstance(results[url], ValueError)